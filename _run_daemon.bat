@@ -0,0 +1,3 @@
+call conda activate bbc-forwarder
+call python daemon_bbc_forwarder.py
+pause
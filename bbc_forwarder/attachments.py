@@ -0,0 +1,167 @@
+"""attachments module
+==================
+
+The attachments module fetches the attachments of a message selectively.
+Instead of downloading all attachments with their base64 encoded content (as
+`message.attachments.download_attachments()` does), it first lists the metadata
+of the attachments (id, name, size and content type). Only the attachments the
+caller selects are downloaded. Their raw bytes are streamed to a file in the
+download folder, so neither the base64 string nor the decoded document is held
+in memory.
+
+Downloaded files are named by the sha256 hash of their content (computed while
+streaming), so the name doubles as the key of the parser cache and a document
+that is attached to several messages is stored once.
+
+Files larger than `UPLOAD_LIMIT` cannot be attached inline (as base64 in the
+json body of a message). `upload` attaches them to a saved draft through an
+upload session instead, reading the file in chunks of `UPLOAD_CHUNKSIZE`, so
+only one chunk is held in memory at a time.
+
+The download folder is configured in `CONFIG['parser']['attachments']`:
+
+- path : location of the download folder (relative to the project folder)
+- max_size_mb : pdfs larger than this are not downloaded (used by the parser)
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+from typing import Callable
+
+from bbc_forwarder.metrics import METRICS, timed
+
+
+Attachment = namedtuple(
+    'Attachment',
+    ['attachment_id', 'name', 'content', 'size', 'content_type', 'hash'],
+    defaults = [None, None, None],
+)
+
+ENDPOINTS = {
+    'attachments': '/messages/{id}/attachments',
+    'content': '/messages/{id}/attachments/{ida}/$value',
+    'upload_session': '/messages/{id}/attachments/createUploadSession',
+}
+
+FIELDS = ['id', 'name', 'size', 'contentType']
+
+# bytes per chunk when streaming an attachment to disk
+CHUNKSIZE = 64 * 1024
+
+# largest attachment that can be sent inline (graph limit)
+UPLOAD_LIMIT = 3 * 1024 * 1024
+
+# bytes per chunk in an upload session (must be a multiple of 320 KiB)
+UPLOAD_CHUNKSIZE = 10 * 320 * 1024
+
+
+@timed('list_attachments')
+def list_attachments(message) -> list[Attachment]:
+    "Return the metadata of the attachments of `message` (without content)."
+    url = message.build_url(ENDPOINTS['attachments'].format(id=message.object_id))
+    params = {'$select': ','.join(FIELDS)}
+    attachments = []
+    while url:
+        data = message.con.get(url, params=params).json()
+        attachments.extend(
+            Attachment(
+                attachment_id = item['id'],
+                name = item['name'],
+                content = None,
+                size = item.get('size'),
+                content_type = item.get('contentType'),
+            )
+            for item in data.get('value', [])
+        )
+        # the next link already contains the query parameters
+        url = data.get('@odata.nextLink')
+        params = None
+    return attachments
+
+
+@timed('download')
+def download(message, attachment: Attachment, folder: Path) -> Path:
+    """Stream the content of `attachment` of `message` to `folder` and return
+    the path of the file (named by the sha256 hash of the content)."""
+    url = message.build_url(ENDPOINTS['content'].format(
+        id = message.object_id,
+        ida = attachment.attachment_id,
+    ))
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    response = message.con.get(url, stream=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=folder, suffix='.tmp', delete=False) as f:
+        try:
+            for chunk in response.iter_content(CHUNKSIZE):
+                digest.update(chunk)
+                f.write(chunk)
+                METRICS.count('download', 'bytes', len(chunk))
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    path = folder / f"{digest.hexdigest()}{Path(attachment.name).suffix.lower()}"
+    os.replace(f.name, path)
+    return path
+
+
+def get_attachments(
+    message,
+    folder: Path,
+    select: Callable[[Attachment], bool],
+) -> list[Attachment]:
+    """Return the attachments of `message`. Attachments for which `select`
+    returns True are downloaded to `folder`; their content is the path of the
+    downloaded file and their hash the sha256 hash of the content. The content
+    of the other attachments is None."""
+    result = []
+    for attachment in list_attachments(message):
+        if select(attachment):
+            path = download(message, attachment, folder)
+            attachment = attachment._replace(content=path, hash=path.stem)
+        result.append(attachment)
+    return result
+
+
+@timed('upload')
+def upload(
+    message,
+    path: Path,
+    name: str,
+    chunksize: int|None = None,
+) -> int:
+    """Attach the file at `path` as `name` to `message` (a saved draft) through
+    an upload session. The file is read and sent in chunks of `chunksize`
+    bytes (default: `UPLOAD_CHUNKSIZE`). Return the number of chunks."""
+    chunksize = chunksize or UPLOAD_CHUNKSIZE
+    size = Path(path).stat().st_size
+    url = message.build_url(ENDPOINTS['upload_session'].format(id=message.object_id))
+    data = {'AttachmentItem': {'attachmentType': 'file', 'name': name, 'size': size}}
+    upload_url = message.con.post(url, data=data).json()['uploadUrl']
+    n_chunks = 0
+    with open(path, 'rb') as f:
+        start = 0
+        while chunk := f.read(chunksize):
+            end = start + len(chunk) - 1
+            headers = {
+                'Content-type': 'application/octet-stream',
+                'Content-Length': str(len(chunk)),
+                'Content-Range': f"bytes {start}-{end}/{size}",
+            }
+            # the upload url is pre-authenticated: no authorization header
+            message.con.naive_request(upload_url, 'PUT', data=chunk, headers=headers)
+            METRICS.count('upload', 'bytes', len(chunk))
+            start = end + 1
+            n_chunks += 1
+    return n_chunks
+
+
+def clear(folder: Path) -> None:
+    "Remove the download folder and all downloaded attachments."
+    shutil.rmtree(folder, ignore_errors=True)
+    return None
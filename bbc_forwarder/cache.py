@@ -0,0 +1,142 @@
+"""cache module
+============
+
+The cache module stores the text and features that the parser extracts from
+pdf attachments in a SQLite database. Entries are keyed by a hash of the
+attachment bytes, so a bbc that stays in the 'to_process' folder for several
+runs is only extracted once.
+
+Every entry is stored together with a version key (see `parser.get_version`).
+Entries with another version are ignored and removed on eviction, so changing
+the extraction code or the list of institutes invalidates old entries.
+
+Eviction is based on age (days since an entry was last used) and on the total
+size of the cache (least recently used entries are removed first). It runs
+once when the cache is opened.
+
+The cache is configured in `CONFIG['parser']['cache']`:
+
+- path : location of the database (relative to the project folder)
+- max_age_days : remove entries not used for this many days
+- max_size_mb : remove least recently used entries above this size
+"""
+
+import hashlib
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+
+
+SCHEMA = """
+create table if not exists extracted (
+    key      text primary key,
+    version  text not null,
+    value    blob not null,
+    size     integer not null,
+    created  real not null,
+    accessed real not null
+)
+"""
+
+
+def get_key(doc: bytes) -> str:
+    "Return the key for `doc` in the cache."
+    return hashlib.sha256(doc).hexdigest()
+
+
+class Cache:
+    "Content-addressed store of extracted pdf text and features."
+    def __init__(
+        self,
+        path: Path,
+        version: str,
+        max_age_days: float|None = None,
+        max_size_mb: float|None = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(SCHEMA)
+        self.version = version
+        self.max_age_days = max_age_days
+        self.max_size_mb = max_size_mb
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        "Return value stored under `key` or None if it is not in the cache."
+        row = self.connection.execute(
+            "select value from extracted where key = ? and version = ?",
+            (key, self.version),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.connection:
+            self.connection.execute(
+                "update extracted set accessed = ? where key = ?",
+                (time.time(), key),
+            )
+        return pickle.loads(row[0])
+
+    def set(self, key: str, value) -> None:
+        "Store `value` under `key`."
+        blob = pickle.dumps(value)
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                "insert or replace into extracted values (?, ?, ?, ?, ?, ?)",
+                (key, self.version, blob, len(blob), now, now),
+            )
+        return None
+
+    def evict(self) -> int:
+        """Remove entries of other versions, entries older than `max_age_days`
+        and the least recently used entries above `max_size_mb`. Return the
+        number of removed entries."""
+        with self.connection:
+            removed = self.connection.execute(
+                "delete from extracted where version != ?",
+                (self.version,),
+            ).rowcount
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+                removed += self.connection.execute(
+                    "delete from extracted where accessed < ?",
+                    (cutoff,),
+                ).rowcount
+            if self.max_size_mb is not None:
+                removed += self.connection.execute(
+                    """
+                    delete from extracted where key in (
+                        select key from (
+                            select
+                                key,
+                                sum(size) over (order by accessed desc) total
+                            from extracted
+                        )
+                        where total > ?
+                    )
+                    """,
+                    (self.max_size_mb * 1024 * 1024,),
+                ).rowcount
+        return removed
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "select count(*) from extracted"
+        ).fetchone()[0]
+
+
+def open_cache(settings: dict, version: str, root: Path) -> Cache:
+    "Open the cache configured in `settings` and evict outdated entries."
+    cache = Cache(
+        root / settings['path'],
+        version = version,
+        max_age_days = settings.get('max_age_days'),
+        max_size_mb = settings.get('max_size_mb'),
+    )
+    cache.evict()
+    return cache
@@ -0,0 +1,195 @@
+"""client module
+=============
+
+The client module contains the clients with which the parser looks up
+candidates (the enrolment records of students with one of the given birth
+dates). A client holds its connection for the whole run and sends the same
+statement for every lookup, with the birth dates as bound parameters (padded to
+`size` parameters), so the database can reuse the parsed statement. The rows
+are fetched into a frame with the dtypes in `DTYPES` (strings as `StringDtype`,
+so NULL stays missing).
+
+- OracleClient : pooled connection to OSIRIS (needs the optional `oracledb`
+package)
+- SQLiteClient : local SQLite database with a population table, a stand-in for
+OSIRIS in tests and benchmarks
+
+Every client has a `query(geboortedata)` method returning the records for at
+most `size` birth dates, and a `close()` method.
+
+The client is configured in `CONFIG['parser']['client']`; without it (or with
+type 'osiris') the parser queries OSIRIS through the `query.osiris` module:
+
+- type : 'osiris', 'oracle' or 'sqlite'
+- user, password, dsn : credentials of the OSIRIS database (oracle)
+- pool_min, pool_max : number of pooled connections (oracle)
+- path : location of the database (sqlite, relative to the project folder)
+"""
+
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from bbc_forwarder.snapshot import to_storage
+
+
+DATETIME = 'datetime64[ns]'
+STRING = 'string'
+
+DTYPES = {
+    'studentnummer': STRING,
+    'voorletters': STRING,
+    'voorvoegsels': STRING,
+    'achternaam': STRING,
+    'geboortedatum': DATETIME,
+    'sinh_id': 'Int64',
+    'soort_inschrijving': STRING,
+    'croho': STRING,
+    'opleiding': STRING,
+    'faculteit': STRING,
+    'aggregaat_1': STRING,
+    'aggregaat_2': STRING,
+    'actiefcode': STRING,
+    'datum_actiefcode': DATETIME,
+    'inschrijvingstatus': STRING,
+    'datum_verzoek': DATETIME,
+    'datum_intrekking': DATETIME,
+    'ingangsdatum': DATETIME,
+    'afloopdatum': DATETIME,
+    'examentype': STRING,
+}
+
+
+def to_frame(rows: list[tuple], columns: list[str]) -> pd.DataFrame:
+    """Return `rows` as frame with the dtypes in `DTYPES` (inferred for other
+    columns)."""
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pd.DataFrame({
+        column:pd.array(list(value), dtype=DTYPES.get(column))
+        for column, value in zip(columns, values)
+    })
+
+
+def pad(geboortedata, size: int) -> list:
+    "Return `geboortedata` padded with None to `size` parameters."
+    geboortedata = list(geboortedata)
+    if len(geboortedata) > size:
+        raise ValueError(f"at most {size} birth dates per query")
+    return geboortedata + [None] * (size - len(geboortedata))
+
+
+class OracleClient:
+    """Candidate lookups in OSIRIS through a pool of connections, with one
+    prepared statement. `sql` is the candidate query with the placeholders
+    `{{ collegejaar }}` and `{{ geboortedata }}`."""
+    def __init__(
+        self,
+        sql: str,
+        collegejaar: int,
+        user: str,
+        password: str,
+        dsn: str,
+        pool_min: int = 1,
+        pool_max: int = 2,
+        size: int = 500,
+    ):
+        try:
+            import oracledb
+        except ImportError as error:
+            raise ImportError(
+                "client type 'oracle' needs the oracledb package"
+            ) from error
+        self.oracledb = oracledb
+        self.size = size
+        self.collegejaar = collegejaar
+        binds = ', '.join(f":d{i}" for i in range(size))
+        self.statement = (
+            sql
+            .replace('{{ collegejaar }}', ':collegejaar')
+            .replace('{{ geboortedata }}', binds)
+        )
+        self.pool = oracledb.create_pool(
+            user = user,
+            password = password,
+            dsn = dsn,
+            min = pool_min,
+            max = pool_max,
+            increment = 1,
+        )
+
+    def query(self, geboortedata) -> pd.DataFrame:
+        dates = [
+            None if i is None else pd.Timestamp(i).to_pydatetime()
+            for i in pad(geboortedata, self.size)
+        ]
+        binds = {f"d{i}":date for i, date in enumerate(dates)}
+        with self.pool.acquire() as connection:
+            with connection.cursor() as cursor:
+                cursor.prepare(self.statement)
+                cursor.setinputsizes(**{key:self.oracledb.DB_TYPE_DATE for key in binds})
+                cursor.execute(None, collegejaar=self.collegejaar, **binds)
+                columns = [i[0].lower() for i in cursor.description]
+                rows = cursor.fetchall()
+        return to_frame(rows, columns)
+
+    def close(self) -> None:
+        self.pool.close()
+        return None
+
+
+class SQLiteClient:
+    """Candidate lookups in a local SQLite database with a population table
+    (stored as by `snapshot.to_storage`)."""
+    def __init__(self, path: Path, size: int = 500):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.connection = sqlite3.connect(self.path)
+        placeholders = ', '.join('?' * size)
+        self.statement = f"select * from population where geboortedatum in ({placeholders})"
+
+    def load(self, population: pd.DataFrame) -> None:
+        "Replace the population table with `population`."
+        df, _ = to_storage(population)
+        with self.connection:
+            df.to_sql('population', self.connection, if_exists='replace', index=False)
+            self.connection.execute(
+                "create index if not exists ix_geboortedatum "
+                "on population (geboortedatum)"
+            )
+        return None
+
+    def query(self, geboortedata) -> pd.DataFrame:
+        dates = [
+            None if i is None else f"{i:%Y-%m-%d}"
+            for i in pad(geboortedata, self.size)
+        ]
+        cursor = self.connection.execute(self.statement, dates)
+        columns = [i[0] for i in cursor.description]
+        return to_frame(cursor.fetchall(), columns)
+
+    def close(self) -> None:
+        self.connection.close()
+        return None
+
+
+def open_client(settings: dict|None, sql: str, collegejaar: int, size: int, root: Path):
+    """Return the client configured in `settings` or None if the parser should
+    use the `query.osiris` module."""
+    if not settings or settings.get('type', 'osiris') == 'osiris':
+        return None
+    if settings['type'] == 'oracle':
+        return OracleClient(
+            sql,
+            collegejaar,
+            user = settings['user'],
+            password = settings['password'],
+            dsn = settings['dsn'],
+            pool_min = settings.get('pool_min', 1),
+            pool_max = settings.get('pool_max', 2),
+            size = size,
+        )
+    if settings['type'] == 'sqlite':
+        return SQLiteClient(root / settings['path'], size=size)
+    raise ValueError(f"unknown client type {settings['type']!r}")
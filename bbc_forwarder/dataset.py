@@ -1,13 +1,16 @@
-from typing import Literal, Callable
+from typing import Literal
+import numpy as np
 import pandas as pd
 import bbc_forwarder.parser as parser
 from bbc_forwarder.config import CONFIG
+from bbc_forwarder.metrics import timed
 
 
 MsgStatus = Literal[
     'no_pdfs',
     'pdf_not_parsed',
     'too_many_pdfs',
+    'duplicate',
     'no_student_matched',
     'more_than_one_matched_student',
     'more_than_one_sinh_id',
@@ -29,85 +32,132 @@ def format_strings(df: pd.DataFrame, na_rep='') -> pd.DataFrame:
     return df
 
 
-def get_status(grp) -> MsgStatus:
-    pdfs = grp.loc[grp.is_pdf == True]
-    n_pdfs = pdfs.attachment_id.nunique()
-
-    if n_pdfs == 0:
-        return 'no_pdfs'
-    if n_pdfs > 1:
-        return 'too_many_pdfs'
-    if n_pdfs == 1:
-        if not pdfs.is_parsed.any():
-            return 'pdf_not_parsed'
-        if not pdfs.found_student.any():
-            return 'no_student_matched'
-
-        n_studentnummers = pdfs.studentnummer.nunique()
-        if n_studentnummers > 1:
-            return 'more_than_one_matched_student'
-
-        n_sinhids = pdfs.sinh_id.nunique()
-        if n_sinhids > 1:
-            return 'more_than_one_sinh_id'
-        return 'one_matched_sinh_id'
-
+def is_true(df: pd.DataFrame, column: str) -> pd.Series:
+    "Return if the values in `column` are True (False if missing or NA)."
+    if column not in df:
+        return pd.Series(False, index=df.index)
+    return df[column].eq(True).fillna(False).astype(bool)
+
+
+def has_value(df: pd.DataFrame, column: str) -> pd.Series:
+    "Return if the values in `column` are not missing (False if there is no `column`)."
+    if column not in df:
+        return pd.Series(False, index=df.index)
+    return df[column].notna()
+
+
+def count_unique(df: pd.DataFrame, column: str, mask: pd.Series) -> pd.Series:
+    "Return the number of unique values in `column` where `mask` per object_id."
+    if column not in df:
+        return df.groupby('object_id').size().mul(0)
+    return df[column].where(mask).groupby(df.object_id).nunique()
+
+
+def get_statuses(df: pd.DataFrame) -> pd.Series:
+    "Return the status per object_id (see `MsgStatus`, the first condition that holds)."
+    pdf = is_true(df, 'is_pdf')
+    per_message = df.object_id
+    n_pdfs = count_unique(df, 'attachment_id', pdf)
+    is_duplicate = (pdf & has_value(df, 'duplicate_of')).groupby(per_message).any()
+    is_parsed = (pdf & is_true(df, 'is_parsed')).groupby(per_message).any()
+    found = (pdf & is_true(df, 'found_student')).groupby(per_message).any()
+    n_studentnummers = count_unique(df, 'studentnummer', pdf)
+    n_sinhids = count_unique(df, 'sinh_id', pdf)
+    conditions = {
+        'no_pdfs': n_pdfs == 0,
+        'too_many_pdfs': n_pdfs > 1,
+        'duplicate': is_duplicate,
+        'pdf_not_parsed': ~is_parsed,
+        'no_student_matched': ~found,
+        'more_than_one_matched_student': n_studentnummers > 1,
+        'more_than_one_sinh_id': n_sinhids > 1,
+    }
+    status = np.select(
+        list(conditions.values()),
+        list(conditions.keys()),
+        default = 'one_matched_sinh_id',
+    )
+    return pd.Series(status, index=n_pdfs.index, name='status')
 
-def get_soort(grp) -> Literal['issue', 'csa', 'faculteit']:
-    status = grp.status.iloc[0]
-    if status != 'one_matched_sinh_id':
-        return 'issue'
 
-    if (grp.soort_inschrijving == 'S').any():
-        return 'csa'
-    return 'faculteit'
+def get_soorten(df: pd.DataFrame, status: pd.Series) -> pd.Series:
+    "Return the soort per object_id: duplicate, issue, csa (central enrolment) or faculteit."
+    is_s = df.get('soort_inschrijving', pd.Series(index=df.index)).eq('S').fillna(False)
+    has_s = is_s.astype(bool).groupby(df.object_id).any().reindex(status.index)
+    soort = np.select(
+        [status == 'duplicate', status != 'one_matched_sinh_id', has_s],
+        ['duplicate', 'issue', 'csa'],
+        default = 'faculteit',
+    )
+    return pd.Series(soort, index=status.index, name='soort')
 
 
-def get_address(keys) -> str|None:
-    """Loop through `keys` and return the first address where the key matches a
-    key in `CONFIG['forwarder']['address']`. Return None if no match was found."""
+def get_addresses(df: pd.DataFrame, fields: list[str]) -> pd.Series:
+    """Return the address for every row in `df`: the address in
+    `CONFIG['forwarder']['address']` of the first of `fields` of which the
+    value (lowercase) is a key, None if no field matches."""
     address = CONFIG['forwarder']['address']
-    for key in keys:
-        if key.lower() in address:
-            return address.get(key.lower())
-    return None
+    conditions, choices = [], []
+    for field in fields:
+        keys = [
+            key.lower() if isinstance(key, str) else None
+            for key in df[field].to_numpy(dtype=object)
+        ]
+        conditions.append(np.array([key in address for key in keys], dtype=bool))
+        choices.append(np.array([address.get(key) for key in keys], dtype=object))
+    addresses = np.select(conditions, choices, default=None) if fields else None
+    return pd.Series(addresses, index=df.index, dtype=object)
+
+
+def get_ontvangers(df: pd.DataFrame, soort: pd.Series) -> pd.Series:
+    "Return the ontvanger per object_id (None for duplicates)."
+    ontvanger = pd.Series(CONFIG['forwarder']['address']['csa'], index=soort.index, dtype=object)
+    ontvanger[soort == 'duplicate'] = None
+    faculteit = soort.index[soort == 'faculteit']
+    if faculteit.empty:
+        return ontvanger.rename('ontvanger')
+    fields = ['opleiding', 'aggregaat_2', 'aggregaat_1', 'faculteit']
+    first = (
+        df.loc[df.object_id.isin(faculteit) & df.opleiding.notna()]
+        .drop_duplicates('object_id')
+        .set_index('object_id')
+    )
+    ontvanger[faculteit] = get_addresses(first, fields).reindex(faculteit)
+    return ontvanger.rename('ontvanger')
 
 
-def get_ontvanger(grp) -> str|None:
-    soort = grp.soort.iloc[0]
-    if soort in ['csa', 'issue']:
-        return CONFIG['forwarder']['address']['csa']
+def classify(df: pd.DataFrame) -> pd.DataFrame:
+    """Return status, soort and ontvanger per object_id, with groupby
+    aggregations over the whole frame (see `tests.reference_dataset` for the
+    rules per message)."""
+    status = get_statuses(df)
+    soort = get_soorten(df, status)
+    ontvanger = get_ontvangers(df, soort)
+    return pd.concat([status, soort, ontvanger], axis=1)
 
-    fields = ['opleiding', 'aggregaat_2', 'aggregaat_1', 'faculteit']
 
-    search_terms = grp.query("opleiding.notna()").iloc[0].loc[fields].dropna().to_list()
-    address = get_address(search_terms)
-    return address
+# status-like columns with few distinct values, stored as categoricals
+CATEGORICALS = ['status', 'soort', 'soort_inschrijving', 'faculteit', 'instelling']
 
 
-def apply_merge(df: pd.DataFrame, f: Callable, name: str) -> pd.DataFrame:
-    new_field = (
-        df
-        .groupby('object_id')
-        .apply(f, include_groups=False)
-        .rename(name)
-    )
-    merged = df.merge(
-        new_field,
-        left_on = 'object_id',
-        right_index = True,
-    )
-    return merged
+def to_categoricals(df: pd.DataFrame) -> pd.DataFrame:
+    for column in CATEGORICALS:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
 
 
+@timed('create_dataset')
 def create_dataset(messages) -> pd.DataFrame:
     results = (
         messages
         .pipe(format_dates)
         .convert_dtypes()
         # .pipe(format_strings)
-        .pipe(apply_merge, f=get_status, name='status')
-        .pipe(apply_merge, f=get_soort, name='soort')
-        .pipe(apply_merge, f=get_ontvanger, name='ontvanger')
     )
-    return results
+    classes = classify(results)
+    return results.assign(**{
+        column:results.object_id.map(classes[column])
+        for column in classes
+    }).pipe(to_categoricals)
+
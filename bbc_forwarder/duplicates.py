@@ -0,0 +1,233 @@
+"""duplicates module
+=================
+
+Institutions regularly send the same bbc twice, or send it again with another
+subject. The duplicates module remembers every bbc that was forwarded, so a
+copy is recognized and archived without being extracted, matched and forwarded
+again.
+
+A bbc is recognized by two keys:
+
+- pdf key : sha256 hash of the pdf bytes without the metadata that changes when
+a document is generated or saved again (document id, creation and modification
+dates, producer and creator, see `normalize_pdf`)
+- text key : sha256 hash of the extracted text (without whitespace and case,
+see `get_text_key`), for copies of which the bytes differ
+
+The parser checks the pdf key before extraction, so a copy with the same bytes
+is neither extracted nor looked up in OSIRIS. The text key is checked after
+extraction, so a copy with other bytes is not looked up. A copy of a bbc that
+is also in the current run is recognized in the same way; the message that was
+received first is the original. The records of a copy get the message it is a
+duplicate of (see `FIELDS`) and the status 'duplicate' (see
+`dataset.get_statuses`).
+
+A copy is only archived once its original was forwarded (see `is_forwarded`).
+A copy of a message in the same run that is not forwarded (an issue, or a bbc
+without a matched student) stays in the folder and is checked again in the
+next run. The duplicate features are not kept in the state of the parser
+(incremental mode), so a copy is recognized again in every run.
+
+After a bbc is forwarded to the faculty or csa, its keys are registered with
+its outcome: message, soort, studentnummer, ontvanger and the time it was
+forwarded. Issues are not registered, so a bbc that is sent again after an
+issue is handled again.
+
+The registry is configured in `CONFIG['parser']['duplicates']`:
+
+- enabled : recognize and archive duplicates
+- path : location of the database (relative to the project folder)
+"""
+
+import base64
+import functools
+import hashlib
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from bbc_forwarder.config import CONFIG, PATH
+
+
+SCHEMA = """
+create table if not exists forwarded (
+    key           text primary key,
+    kind          text not null,
+    object_id     text not null,
+    soort         text,
+    studentnummer text,
+    ontvanger     text,
+    forwarded     text not null
+)
+"""
+
+# metadata written by the pdf producer: differs between copies of a document
+VOLATILE = re.compile(
+    rb"/(?:ID\s*\[[^\]]*\]|(?:CreationDate|ModDate|Producer|Creator)\s*\((?:[^()\\]|\\.)*\))"
+    rb"|<(xmp:\w*Date|xmpMM:\w*ID|pdf:Producer|xmp:CreatorTool)>[^<]*</\1>"
+)
+
+WHITESPACE = re.compile(r"\s+")
+
+# features added to the records of a duplicate
+FIELDS = [
+    'duplicate_of',
+    'duplicate_by',
+    'duplicate_ontvanger',
+    'duplicate_forwarded',
+]
+
+# soorten of which the bbc is registered after forwarding
+REGISTERED = ['faculteit', 'csa']
+
+
+def normalize_pdf(doc: bytes) -> bytes:
+    "Return pdf `doc` without the metadata that differs between copies."
+    return VOLATILE.sub(b'', doc)
+
+
+def get_pdf_key(content: str|Path) -> str:
+    """Return the pdf key of `content` (the path of a downloaded pdf or a base64
+    encoded string)."""
+    if isinstance(content, Path):
+        doc = content.read_bytes()
+    else:
+        doc = base64.b64decode(content)
+    return hashlib.sha256(normalize_pdf(doc)).hexdigest()
+
+
+def get_text_key(text: str, tier: str) -> str|None:
+    """Return the text key of `text` read with `tier` (None if no text was
+    read). Texts of different tiers are not compared."""
+    if not text:
+        return None
+    normalized = WHITESPACE.sub('', text).casefold()
+    return f"{tier}:{hashlib.sha256(normalized.encode()).hexdigest()}"
+
+
+class Registry:
+    "Keys and outcome of the bbc's that were forwarded."
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # messages are processed (and registered) by the workers of the engine
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def find(self, keys) -> dict[str, dict]:
+        "Return the outcome of the forwarded bbc's with one of `keys`, by key."
+        keys = list(dict.fromkeys(i for i in keys if i is not None))
+        found = {}
+        with self.lock:
+            # stay below the maximum number of parameters of SQLite
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                cursor = self.connection.execute(
+                    f"select * from forwarded where key in ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                columns = [i[0] for i in cursor.description]
+                found.update((row[0], dict(zip(columns, row))) for row in cursor)
+        return found
+
+    def register(self, logs: pd.DataFrame, forwarded: datetime|None = None) -> int:
+        """Register the pdf and text keys of the pdfs in `logs` (the records of
+        one message) if the message was forwarded to the faculty or csa. Keys
+        that are already registered keep their first outcome. Return the number
+        of new keys."""
+        record = logs.iloc[0]
+        if record.get('soort') not in REGISTERED:
+            return 0
+        pdfs = logs.loc[logs.is_pdf.eq(True).fillna(False).astype(bool)]
+        keys = [
+            (key, kind)
+            for kind in ['pdf', 'text']
+            if f"{kind}_key" in pdfs
+            for key in pdfs[f"{kind}_key"].dropna().unique()
+        ]
+        ontvanger = record.get('ontvanger')
+        outcome = (
+            record['object_id'],
+            record['soort'],
+            ';'.join(pdfs.studentnummer.dropna().unique()) if 'studentnummer' in pdfs else None,
+            ontvanger if pd.notna(ontvanger) else None,
+            (forwarded or datetime.now()).isoformat(timespec='seconds'),
+        )
+        with self.lock, self.connection:
+            return self.connection.executemany(
+                "insert or ignore into forwarded values (?, ?, ?, ?, ?, ?, ?)",
+                [(key, kind, *outcome) for key, kind in keys],
+            ).rowcount
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "select count(*) from forwarded"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+        return None
+
+
+class Detector:
+    """Recognizes the duplicates in one run: pdfs of which a key is registered
+    or already seen in an earlier message of the run."""
+    def __init__(self, registry: Registry):
+        self.registry = registry
+        self.seen = {}
+
+    def check(self, keys: dict, kind: str) -> dict:
+        """Return the features of the duplicates among `keys` (key per
+        (object_id, attachment_id), in the order of the messages), by
+        (object_id, attachment_id). Keys that are not duplicates are
+        remembered for the rest of the run."""
+        registered = self.registry.find(keys.values())
+        duplicates = {}
+        for (object_id, attachment_id), key in keys.items():
+            if key is None:
+                continue
+            if key in registered:
+                outcome = registered[key]
+                duplicates[object_id, attachment_id] = {
+                    'duplicate_of': outcome['object_id'],
+                    'duplicate_by': kind,
+                    'duplicate_ontvanger': outcome['ontvanger'],
+                    'duplicate_forwarded': outcome['forwarded'],
+                }
+            elif self.seen.get(key, object_id) != object_id:
+                duplicates[object_id, attachment_id] = {
+                    'duplicate_of': self.seen[key],
+                    'duplicate_by': kind,
+                }
+            else:
+                self.seen.setdefault(key, object_id)
+        return duplicates
+
+
+def is_forwarded(registry: Registry, logs: pd.DataFrame) -> bool:
+    """Return if the bbc of which `logs` (the records of a duplicate) is a
+    copy was forwarded: one of the keys of its pdf is registered."""
+    keys = [
+        key
+        for column in ['pdf_key', 'text_key']
+        if column in logs
+        for key in logs[column].dropna()
+    ]
+    return bool(registry.find(keys))
+
+
+@functools.cache
+def get_registry() -> Registry|None:
+    """Return the registry of forwarded bbc's or None if duplicates are not
+    recognized (see `CONFIG['parser']['duplicates']`)."""
+    settings = CONFIG['parser'].get('duplicates')
+    if not settings or not settings.get('enabled'):
+        return None
+    return Registry(PATH / settings['path'])
@@ -0,0 +1,182 @@
+"""engine module
+=============
+
+The engine module processes messages concurrently while staying within the
+request limits of Microsoft Graph.
+
+- `run` processes every message in a pool of worker threads. All steps for one
+message (create forward, save, send, move) are done in order by one worker, but
+the steps of different messages overlap.
+- `Throttle` is installed on the connection of the mailbox. Every request first
+takes a token from a shared `TokenBucket` (limiting the request rate) and the
+number of requests in flight is capped. When Graph answers 429 (too many
+requests) or 503 (service unavailable), the bucket is paused for the time in the
+`Retry-After` header, so all workers back off together, and the request is
+retried.
+
+The engine is configured in `CONFIG['forwarder']['engine']`:
+
+- workers : number of messages processed at the same time
+- max_in_flight : maximum number of requests in flight
+- rate : requests per second
+- burst : maximum number of requests sent at once after being idle
+- max_retries : number of retries of a throttled request
+
+More information
+----------------
+- [Microsoft Graph throttling guidance](https://learn.microsoft.com/en-us/graph/throttling)
+"""
+
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+from bbc_forwarder.metrics import METRICS
+
+
+# status codes after which a request is retried
+RETRY_STATUS = (429, 503)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `acquire` blocks until a token is available.
+    Tokens are added at `rate` per second up to `capacity`. `pause` stops
+    handing out tokens for a number of seconds (for all threads). The time is
+    read from `clock` and waited with `sleep`."""
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                wait = max(
+                    self.paused_until - now,
+                    (1 - self.tokens) / self.rate,
+                )
+            self.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            now = self.clock()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated = now
+        return None
+
+
+def get_retry_after(response, default: float) -> float:
+    """Return the seconds to wait from the `Retry-After` header of `response`
+    (a number of seconds or a date) or `default` if it is missing."""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+class Throttle:
+    "Shared rate limit, cap on requests in flight and retries for a connection."
+    def __init__(
+        self,
+        rate: float = 10,
+        burst: float = 10,
+        max_in_flight: int = 4,
+        max_retries: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.n_throttled = 0
+
+    @classmethod
+    def from_config(cls, settings: dict) -> 'Throttle':
+        return cls(**{
+            key:settings[key]
+            for key in ['rate', 'burst', 'max_in_flight', 'max_retries']
+            if key in settings
+        })
+
+    def request(self, send: Callable, url: str, method: str, **kwargs):
+        "Send a request with `send`, retrying it when Graph throttles."
+        from requests.exceptions import HTTPError
+
+        for attempt in range(self.max_retries + 1):
+            with self.in_flight:
+                self.bucket.acquire()
+                try:
+                    with METRICS.timer('graph'):
+                        return send(url, method, **kwargs)
+                except HTTPError as error:
+                    response = error.response
+                    if (
+                        response is None
+                        or response.status_code not in RETRY_STATUS
+                        or attempt == self.max_retries
+                    ):
+                        raise
+                    self.n_throttled += 1
+                    METRICS.count('graph', 'retries')
+                    delay = get_retry_after(response, default=2 ** attempt)
+            self.bucket.pause(delay)
+
+    def install(self, connection) -> None:
+        """Send all requests of `connection` (an `O365.Connection`) through the
+        throttle. The connection's own delay between requests and its retries
+        are switched off; the throttle takes care of both."""
+        connection.requests_delay = 0
+        connection.request_retries = 0
+        # sessions are created again (without retries) on the next request
+        connection.session = None
+        connection.naive_session = None
+        for name in ['oauth_request', 'naive_request']:
+            send = getattr(connection, name)
+            setattr(connection, name, functools.partial(self.request, send))
+        return None
+
+
+def run(function: Callable, jobs: list[tuple], workers: int = 1, **kwargs) -> None:
+    """Call `function(*job, **kwargs)` for every job in `jobs` in a pool of
+    `workers` threads. If a job fails, the jobs that did not start yet are
+    cancelled and the error is raised."""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [executor.submit(function, *job, **kwargs) for job in jobs]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            raise
+    return None
@@ -8,22 +8,53 @@ deciding what to do with a message based on the associated logging data.
 The module further contains the following helper functions:
 
 get_stats : create table with report for logs mail
-get_message_data : create tables with logging information
+get_tier_stats : create table with extraction tiers for logs mail
+get_message_data : create tables with logging information (see `templates.Table`)
 create_forward : create forward from email
+get_pdf : get the pdf of a message (downloaded during parsing if possible)
+create_message : create new message with the renamed pdf as only attachment
+deliver_message : save or send a new message, uploading a large pdf in chunks
+deliver_forward : move a forward to the target folder or send it
+get_plan : describe how a message is delivered (recorded in the journal)
+resume_message : finish the steps of a message that was interrupted
+archive_message : archive a duplicate without forwarding it
+
+Messages for the faculty or csa are created as new messages with the renamed
+pdf as their only attachment (saved as draft in the target folder, or saved as
+draft and then sent). The pdf is read from the download folder of the parser, so it
+is not downloaded again. Pdfs above the inline limit are uploaded in chunks
+to the saved draft (see `attachments.upload`). Issues are forwarded with all
+original attachments.
+
+After a message is forwarded to the faculty or csa, its bbc is registered (if
+duplicates are recognized), so copies of it are archived without being
+forwarded again (see the `duplicates` module).
+
+Every step of `process_message` with a side effect in the mailbox (draft
+saved, pdf uploaded, message sent or saved in the target folder) is recorded in
+the journal before the next step, and the message is removed from the journal
+when it is archived. A message of which the processing was interrupted is
+finished by `resume_message` in the next run (see the `journal` module).
 """
 
-import base64
 import io
+from pathlib import Path
+from typing import TYPE_CHECKING
 
 import pandas as pd
-from O365.message import Message
 
+from bbc_forwarder import attachments, duplicates, journal, mailbox, parser
+from bbc_forwarder.attachments import Attachment
 from bbc_forwarder.config import CONFIG
-from bbc_forwarder.templates import ENV, SUBJECTS, FILENAME
-from bbc_forwarder.mailbox import MAILBOX, FOLDER_IDS
+from bbc_forwarder.metrics import METRICS, timed
+from bbc_forwarder.templates import SUBJECTS, FILENAME, Table, get_template
+
+if TYPE_CHECKING:
+    import requests
+    from O365.message import Message
 
 
-def get_message_data(df: pd.DataFrame) -> dict[str, pd.DataFrame|str]:
+def get_message_data(df: pd.DataFrame) -> dict[str, Table|str]:
     record = df.iloc[0]
     mail = [
         'datum_ontvangst',
@@ -58,15 +89,15 @@ def get_message_data(df: pd.DataFrame) -> dict[str, pd.DataFrame|str]:
         'status':              record['status'],
         'soort':               record['soort'],
         'onderwerp':           record['onderwerp'],
-        'ontvanger':           record['ontvanger'],
+        'ontvanger':           record['ontvanger'] if pd.notna(record['ontvanger']) else None,
         'opleiding':           record['opleiding'],
         'studentnummer':       ';'.join(df.studentnummer.dropna().unique()),
 
         # tables
-        'mail_data':           df[mail].drop_duplicates().T,
-        'bbc_data':            df[bbc].drop_duplicates().T,
-        'student_data':        df[student].drop_duplicates().T,
-        'inschrijfregel_data': df[inschrijfregel].T,
+        'mail_data':           Table.from_frame(df, mail, unique=True),
+        'bbc_data':            Table.from_frame(df, bbc, unique=True),
+        'student_data':        Table.from_frame(df, student, unique=True),
+        'inschrijfregel_data': Table.from_frame(df, inschrijfregel),
     }
 
 
@@ -78,11 +109,29 @@ def get_stats(results, field) -> pd.Series:
         .value_counts()
         .rename('aantal')
     )
+    # categoricals also count the categories that do not occur
+    stats = stats.loc[stats > 0]
     stats['Totaal'] = stats.sum()
     return stats
 
 
-def create_forward(msg, recipient, subject, body) -> Message:
+def get_tier_stats(results) -> pd.DataFrame:
+    "Create table with the number and share of pdfs per extraction tier."
+    if 'tier' not in results:
+        return pd.DataFrame(columns=['aantal', 'aandeel'])
+    stats = (
+        results
+        .drop_duplicates(['object_id', 'attachment_id'])
+        .tier
+        .value_counts()
+        .rename('aantal')
+        .to_frame()
+    )
+    stats['aandeel'] = (stats.aantal / stats.aantal.sum()).map('{:.0%}'.format)
+    return stats
+
+
+def create_forward(msg, recipient, subject, body) -> 'Message':
     "Create a forward from `msg` with `subject`, `body` and `recipient`."
     fwd = msg.forward()
     fwd.body = body
@@ -92,16 +141,119 @@ def create_forward(msg, recipient, subject, body) -> Message:
     return fwd
 
 
+def get_pdf(message, logs: pd.DataFrame) -> Path|None:
+    """Return the path of the pdf attachment of `message` (None if it has no
+    pdf). The pdf in the download folder of the parser is used if it was
+    downloaded during parsing, otherwise it is downloaded."""
+    pdfs = logs.loc[logs.is_pdf.eq(True).fillna(False).astype(bool)]
+    if pdfs.empty:
+        return None
+    record = pdfs.iloc[0]
+    suffix = Path(record['attachment_name']).suffix.lower()
+    folder = parser.get_download_folder()
+    content_hash = record.get('attachment_hash')
+    path = None if pd.isna(content_hash) else folder / f"{content_hash}{suffix}"
+    if path is None or not path.exists():
+        attachment = Attachment(record['attachment_id'], record['attachment_name'], None)
+        path = attachments.download(message, attachment, folder)
+    return path
+
+
+def create_message(recipient, subject, body, pdf: Path|None, filename: str) -> 'Message':
+    """Create a new message with `subject`, `body`, `recipient` and `pdf` (as
+    `filename`) as its only attachment. Nothing is sent to the mailbox yet. A
+    pdf above `attachments.UPLOAD_LIMIT` is not attached, it has to be uploaded
+    after saving the message (see `deliver_message`)."""
+    msg = mailbox.MAILBOX.new_message()
+    msg.body = body
+    msg.subject = subject
+    if recipient:
+        msg.to.add(recipient)
+    if pdf is not None and pdf.stat().st_size <= attachments.UPLOAD_LIMIT:
+        content = pdf.read_bytes()
+        msg.attachments.add([(io.BytesIO(content), filename)])
+        METRICS.count('process_message', 'bytes', len(content))
+    return msg
+
+
+def is_uploaded(pdf: Path|None) -> bool:
+    "Return if `pdf` is above `attachments.UPLOAD_LIMIT` (uploaded in chunks)."
+    return pdf is not None and pdf.stat().st_size > attachments.UPLOAD_LIMIT
+
+
+def deliver_message(
+    msg,
+    pdf: Path|None,
+    filename: str,
+    folder_id: str|None,
+    entry: journal.Entry|None = None,
+) -> None:
+    """Save `msg` as draft in `folder_id` or send it if `folder_id` is None. The
+    message is always saved as draft first (in the drafts folder when sending),
+    so every send has a draft in the journal that is checked on resume. A pdf
+    above `attachments.UPLOAD_LIMIT` is uploaded in chunks to the saved draft.
+    The steps are recorded in `entry` (see the `journal` module)."""
+    entry = entry or journal.Entry(None, None)
+    msg.save_draft(target_folder=folder_id)
+    entry.record('draft', msg.object_id)
+    if is_uploaded(pdf):
+        attachments.upload(msg, pdf, filename)
+        entry.record('uploaded')
+    if folder_id is None:
+        msg.send()
+    entry.record('delivered')
+    return None
+
+
+def deliver_forward(forward, folder_id: str|None) -> None:
+    "Move `forward` (a saved draft) to `folder_id` or send it if `folder_id` is None."
+    if folder_id is None:
+        forward.send()
+    else:
+        forward.move(folder_id)
+    return None
+
+
+def get_plan(
+    soort: str,
+    folder_id: str|None,
+    logs: pd.DataFrame,
+    pdf: Path|None = None,
+    filename: str|None = None,
+) -> dict:
+    """Return how the message of `logs` is delivered: as new message with `pdf`
+    (as `filename`) or as forward (if `filename` is None), saved in `folder_id`
+    or sent (if `folder_id` is None). The attachment of the pdf is included, so
+    it can be downloaded again when the message is resumed."""
+    plan = {
+        'kind': 'forward' if filename is None else 'message',
+        'soort': soort,
+        'folder_id': folder_id,
+    }
+    if filename is None:
+        return plan
+    plan |= {'filename': filename, 'pdf': None, 'uploaded': False}
+    if pdf is not None:
+        record = logs.loc[logs.is_pdf.eq(True).fillna(False).astype(bool)].iloc[0]
+        plan |= {
+            'pdf': str(pdf),
+            'uploaded': is_uploaded(pdf),
+            'attachment_id': record['attachment_id'],
+            'attachment_name': record['attachment_name'],
+        }
+    return plan
+
+
+@timed('process_message')
 def process_message(
-    message_id: str,
+    message: 'Message',
     template_path: str,
-    results: pd.DataFrame,
+    logs: pd.DataFrame,
     test_run: bool = False,
 ) -> None:
-    message = MAILBOX.get_message(object_id=message_id)
-
-    query = f"object_id == '{message_id}'"
-    logs = results.query(query)
+    """Process `message` based on its `logs` (the records of this message).
+    `message` is the message object that was fetched for parsing, so it is not
+    fetched from the mailbox again."""
     data = get_message_data(logs)
 
     soort         = data['soort']
@@ -111,7 +263,7 @@ def process_message(
     onderwerp     = data['onderwerp']
     ontvanger     = data['ontvanger']
 
-    template = ENV.get_template(template_path)
+    template = get_template(template_path)
     body = template.render(**data)
 
     subject = SUBJECTS[soort].substitute(
@@ -126,30 +278,107 @@ def process_message(
         print(f"{soort:.<12}{ontvanger:.<20}{subject}")
         return None
 
-    forward = create_forward(
-        message,
-        recipient = ontvanger,
-        subject = subject,
-        body = body,
-    )
-
-    if soort in ['csa', 'faculteit']:
-        # rename pdf attachment and reattach it
-        # remove all other attachments
-        forward.attachments.download_attachments()
-        for attachment in forward.attachments:
-            if attachment.name.lower().endswith('.pdf'):
-                content = base64.b64decode(attachment.content)
-                new_attachment = io.BytesIO(content)
-            forward.attachments.remove(attachment)
-        new_name = FILENAME.substitute(studentnummer=studentnummer)
-        forward.attachments.add([(new_attachment, new_name)])
-        forward.save_draft()
-
     save_as_draft = CONFIG['forwarder']['settings']['save_as_draft'][soort]
-    if save_as_draft or not ontvanger:
-        forward.move(FOLDER_IDS[soort])
+    folder_id = mailbox.FOLDER_IDS[soort] if save_as_draft or not ontvanger else None
+    entry = journal.get_entry(data['msg_id'])
+    if soort in ['csa', 'faculteit']:
+        # new message with only the renamed pdf
+        pdf = get_pdf(message, logs)
+        filename = FILENAME.substitute(studentnummer=studentnummer)
+        entry.record('started', get_plan(soort, folder_id, logs, pdf=pdf, filename=filename))
+        new_message = create_message(
+            recipient = ontvanger,
+            subject = subject,
+            body = body,
+            pdf = pdf,
+            filename = filename,
+        )
+        deliver_message(
+            new_message,
+            pdf = pdf,
+            filename = filename,
+            folder_id = folder_id,
+            entry = entry,
+        )
     else:
-        forward.send()
-    message.move(FOLDER_IDS['archived'])
+        entry.record('started', get_plan(soort, folder_id, logs))
+        forward = create_forward(
+            message,
+            recipient = ontvanger,
+            subject = subject,
+            body = body,
+        )
+        entry.record('draft', forward.object_id)
+        deliver_forward(forward, folder_id)
+        entry.record('delivered')
+    # register before archiving: a message that is not archived is not forwarded again
+    registry = duplicates.get_registry()
+    if registry is not None:
+        registry.register(logs)
+    message.move(mailbox.FOLDER_IDS['archived'])
+    entry.clear()
+    return None
+
+
+def is_not_found(error: 'requests.HTTPError') -> bool:
+    "Return if `error` is the answer of the mailbox to a request for an item that does not exist."
+    return error.response is not None and error.response.status_code == 404
+
+
+@timed('resume_message')
+def resume_message(message: 'Message', entry: journal.Entry) -> bool:
+    """Finish the steps of `message` that were not done when its processing was
+    interrupted (see the steps recorded in `entry`) and archive it. Return False
+    if no step was done (nothing was saved or sent): the message is removed
+    from the journal and has to be processed again.
+
+    A draft that no longer exists was sent or moved before the step was
+    recorded, so it is taken as delivered."""
+    steps = entry.steps()
+    plan = steps.get('started')
+    if plan is None or ('delivered' not in steps and 'draft' not in steps):
+        entry.clear()
+        return False
+    if 'delivered' not in steps:
+        import requests
+        from O365.message import Message
+
+        draft = Message(
+            parent = mailbox.MAILBOX,
+            __cloud_data__ = {'id': steps['draft'], 'isDraft': True},
+        )
+        upload = plan['kind'] == 'message' and plan['uploaded'] and 'uploaded' not in steps
+        if upload:
+            pdf = Path(plan['pdf'])
+            if not pdf.exists():
+                attachment = Attachment(plan['attachment_id'], plan['attachment_name'], None)
+                pdf = attachments.download(message, attachment, parser.get_download_folder())
+        try:
+            if plan['kind'] == 'forward':
+                deliver_forward(draft, plan['folder_id'])
+            else:
+                if upload:
+                    attachments.upload(draft, pdf, plan['filename'])
+                    entry.record('uploaded')
+                if plan['folder_id'] is None:
+                    draft.send()
+        except requests.HTTPError as error:
+            if not is_not_found(error):
+                raise
+        entry.record('delivered')
+    message.move(mailbox.FOLDER_IDS['archived'])
+    entry.clear()
+    return True
+
+
+@timed('archive_message')
+def archive_message(message: 'Message', logs: pd.DataFrame, test_run: bool = False) -> None:
+    """Move `message` (a duplicate of a bbc that was already forwarded, see
+    its `logs`) to the archive without forwarding it."""
+    if test_run:
+        record = logs.iloc[0]
+        duplicate_of = logs.duplicate_of.dropna().iloc[0]
+        print(f"{record['soort']:.<12}{duplicate_of:.<20}{record['onderwerp']}")
+        return None
+    message.move(mailbox.FOLDER_IDS['archived'])
     return None
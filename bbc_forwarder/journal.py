@@ -0,0 +1,163 @@
+"""journal module
+==============
+
+Forwarding a message takes several requests to the mailbox. If a run stops
+halfway (an expired token, an error of the mailbox), the message stays in the
+'to_process' folder, so the next run would parse and forward it again, even if
+the bbc was already sent. The journal module keeps a write-ahead journal of the
+steps of every message that is being processed, so the next run finishes the
+steps that were not done instead of forwarding the message again.
+
+The steps of a message are recorded by its object_id, every step is committed
+before the next request:
+
+- started : the plan of the message (see `forwarder.get_plan`): how it is
+delivered (new message or forward), the target folder (None if it is sent),
+the pdf and its filename
+- draft : the id of the saved draft (a forward or a new message, which is saved
+as draft before it is sent)
+- uploaded : the pdf was uploaded to the draft (a pdf that is uploaded in chunks)
+- delivered : the message was sent or saved in the target folder
+
+When the message is archived, its steps are removed from the journal. The
+messages in the journal at the start of a run were interrupted: they are
+resumed (see `forwarder.resume_message`) before the other messages are parsed.
+A message that was interrupted before its first step (a saved draft) is
+processed again. A message that can not be resumed (an error
+of the mailbox) is moved to the 'issue' folder instead of stopping the run
+(see `script_bbc_forwarder.resume_messages`).
+
+The journal is configured in `CONFIG['forwarder']['journal']`:
+
+- enabled : record the steps of every message and resume interrupted messages
+- path : location of the database (relative to the project folder)
+"""
+
+import functools
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from bbc_forwarder.config import CONFIG, PATH
+
+
+SCHEMA = """
+create table if not exists steps (
+    object_id text not null,
+    step      text not null,
+    value     text,
+    created   text not null,
+    primary key (object_id, step)
+)
+"""
+
+STEPS = ['started', 'draft', 'uploaded', 'delivered']
+
+
+class Journal:
+    "Steps of the messages that are being processed."
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # messages are processed (and recorded) by the workers of the engine
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("pragma journal_mode = wal")
+            self.connection.execute(SCHEMA)
+
+    def record(self, object_id: str, step: str, value: Any = None) -> None:
+        "Record (and commit) `step` of message `object_id` with `value` (json)."
+        if step not in STEPS:
+            raise ValueError(f"unknown step {step!r}, expected one of {STEPS}")
+        created = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.connection:
+            self.connection.execute(
+                "insert or replace into steps values (?, ?, ?, ?)",
+                (object_id, step, json.dumps(value), created),
+            )
+        return None
+
+    def steps(self, object_id: str) -> dict[str, Any]:
+        "Return the values of the recorded steps of message `object_id` by step."
+        with self.lock:
+            rows = self.connection.execute(
+                "select step, value from steps where object_id = ? order by rowid",
+                (object_id,),
+            ).fetchall()
+        return {step:json.loads(value) for step, value in rows}
+
+    def pending(self) -> dict[str, dict[str, Any]]:
+        "Return the recorded steps of every message in the journal by object_id."
+        with self.lock:
+            rows = self.connection.execute(
+                "select object_id, step, value from steps order by rowid"
+            ).fetchall()
+        pending = {}
+        for object_id, step, value in rows:
+            pending.setdefault(object_id, {})[step] = json.loads(value)
+        return pending
+
+    def clear(self, object_id: str) -> None:
+        "Remove the steps of message `object_id`."
+        with self.lock, self.connection:
+            self.connection.execute("delete from steps where object_id = ?", (object_id,))
+        return None
+
+    def entry(self, object_id: str) -> 'Entry':
+        "Return the entry of message `object_id`."
+        return Entry(self, object_id)
+
+    def __len__(self) -> int:
+        "Return the number of messages in the journal."
+        with self.lock:
+            return self.connection.execute(
+                "select count(distinct object_id) from steps"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+        return None
+
+
+class Entry:
+    """Steps of one message in `journal`. Without journal (None) nothing is
+    recorded."""
+    __slots__ = ('journal', 'object_id')
+
+    def __init__(self, journal: Journal|None, object_id: str):
+        self.journal = journal
+        self.object_id = object_id
+
+    def record(self, step: str, value: Any = None) -> None:
+        if self.journal is not None:
+            self.journal.record(self.object_id, step, value)
+        return None
+
+    def steps(self) -> dict[str, Any]:
+        if self.journal is None:
+            return {}
+        return self.journal.steps(self.object_id)
+
+    def clear(self) -> None:
+        if self.journal is not None:
+            self.journal.clear(self.object_id)
+        return None
+
+
+@functools.cache
+def get_journal() -> Journal|None:
+    """Return the journal or None if steps are not recorded (see
+    `CONFIG['forwarder']['journal']`)."""
+    settings = CONFIG['forwarder'].get('journal')
+    if not settings or not settings.get('enabled'):
+        return None
+    return Journal(PATH / settings['path'])
+
+
+def get_entry(object_id: str) -> Entry:
+    "Return the entry of message `object_id` in the journal (if configured)."
+    return Entry(get_journal(), object_id)
@@ -0,0 +1,379 @@
+"""logstore module
+===============
+
+The logstore module keeps the logs of every run in an append-only SQLite
+database. A run never overwrites the logs of an earlier run (also not of a run
+on the same day), so the logs of the whole campaign stay available in one file.
+
+- runs : one row per run (run_id, start time, date and number of messages)
+- records : the records of the logs of every run with their run_id and
+run_date (indexed by run_date and by object_id). Columns that appear in a later
+run are added to the table.
+- messages : one row per bbc with the first and last run it was seen in, its
+last status and the start of the run since which it is unmatched
+- weekly : the bbc's per week (of the run) with their status and soort
+- metrics : the metrics of every run (see `bbc_forwarder.metrics`, stored by
+the daemon)
+- reports : one row per sent log report with the last run and metrics it
+contains, so the next report contains the runs after it (also after a restart
+of the daemon)
+
+A bbc is identified by the hash of its pdf (see `attachments`), so it is
+recognized when it comes back in another message (the id of a message changes
+when it is moved); messages without a downloaded pdf by their object_id.
+
+`messages` and `weekly` are updated on every append, so the questions in the
+query API (`unmatched`, `issues_per_week`) are answered from small, indexed
+tables instead of from all records.
+
+The Excel file of the log report is exported from the store (all runs of the
+day, see `export_excel`) if `excel` is set.
+
+The store is configured in `CONFIG['forwarder']['logstore']`:
+
+- path : location of the database (relative to the project folder)
+- excel : attach the logs of the day as Excel file to the log report
+"""
+
+import functools
+import json
+import sqlite3
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+from bbc_forwarder.config import CONFIG, PATH
+
+
+SCHEMA = [
+    """
+    create table if not exists runs (
+        run_id     integer primary key autoincrement,
+        started    text not null,
+        run_date   text not null,
+        n_messages integer not null
+    )
+    """,
+    """
+    create table if not exists records (
+        run_id   integer not null,
+        run_date text not null,
+        object_id text
+    )
+    """,
+    "create index if not exists ix_records_run_date on records (run_date)",
+    "create index if not exists ix_records_object_id on records (object_id, run_id)",
+    """
+    create table if not exists messages (
+        bbc             text primary key,
+        object_id       text not null,
+        onderwerp       text,
+        zender          text,
+        first_seen      text not null,
+        last_seen       text not null,
+        status          text,
+        soort           text,
+        unmatched_since text
+    )
+    """,
+    "create index if not exists ix_messages_status on messages (status)",
+    """
+    create table if not exists weekly (
+        week   text not null,
+        status text,
+        soort  text,
+        bbc    text not null,
+        primary key (week, bbc)
+    )
+    """,
+    """
+    create table if not exists metrics (
+        metrics_id integer primary key autoincrement,
+        run_id     integer not null,
+        data       text not null
+    )
+    """,
+    """
+    create table if not exists reports (
+        report_date     text primary key,
+        sent            text not null,
+        last_run_id     integer not null,
+        last_metrics_id integer not null
+    )
+    """,
+]
+
+UNMATCHED = 'no_student_matched'
+
+UPSERT_MESSAGE = """
+insert into messages values (
+    :bbc, :object_id, :onderwerp, :zender, :started, :started, :status, :soort,
+    case when :status = :unmatched then :started end
+)
+on conflict (bbc) do update set
+    object_id = excluded.object_id,
+    last_seen = excluded.last_seen,
+    status = excluded.status,
+    soort = excluded.soort,
+    unmatched_since = case
+        when excluded.status = :unmatched
+        then coalesce(messages.unmatched_since, excluded.last_seen)
+    end
+"""
+
+
+def to_scalar(value):
+    "Return `value` as a value SQLite can store (sets are joined by ';')."
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return ';'.join(sorted(str(i) for i in value))
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)
+    if pd.isna(value):
+        return None
+    return str(value)
+
+
+def to_storage(df: pd.DataFrame) -> pd.DataFrame:
+    "Convert the columns of `df` to types SQLite can store."
+    df = df.copy()
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+        if df[column].dtype == object:
+            df[column] = df[column].map(to_scalar, na_action='ignore').astype(object)
+    return df
+
+
+def get_messages(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the first record of every message in `df` with the bbc that
+    identifies it: the hash of its first pdf or its object_id."""
+    if 'object_id' not in df:
+        return pd.DataFrame(columns=['bbc', 'object_id'])
+    messages = df.drop_duplicates('object_id').set_index('object_id', drop=False)
+    bbc = messages.object_id.astype(object)
+    if 'attachment_hash' in df and 'is_pdf' in df:
+        is_pdf = df.is_pdf.astype('boolean').fillna(False).astype(bool)
+        pdfs = df.loc[is_pdf & df.attachment_hash.notna()].drop_duplicates('object_id')
+        bbc.update(pdfs.set_index('object_id').attachment_hash.astype(object))
+    return messages.assign(bbc=bbc).reset_index(drop=True)
+
+
+def get_week(timestamp: datetime) -> str:
+    "Return the iso week of `timestamp` as 'yyyy-Www'."
+    year, week, _ = timestamp.isocalendar()
+    return f"{year}-W{week:02}"
+
+
+class LogStore:
+    "Append-only store of the logs of all runs."
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def get_columns(self) -> list[str]:
+        "Return the columns of the records table."
+        rows = self.connection.execute("pragma table_info(records)").fetchall()
+        return [row[1] for row in rows]
+
+    def append(self, logs: pd.DataFrame, started: datetime|None = None) -> int:
+        """Append `logs` (the logs of one run, started at `started`, default
+        now) to the store and return the run_id."""
+        started = started or datetime.now()
+        run_date = f"{started:%Y-%m-%d}"
+        df = to_storage(logs)
+        messages = get_messages(df)
+        with self.connection:
+            run_id = self.connection.execute(
+                "insert into runs (started, run_date, n_messages) values (?, ?, ?)",
+                (started.isoformat(timespec='seconds'), run_date, len(messages)),
+            ).lastrowid
+            existing = self.get_columns()
+            for column in df.columns:
+                if column not in existing:
+                    self.connection.execute(f'alter table records add column "{column}"')
+            df.assign(run_id=run_id, run_date=run_date).to_sql(
+                'records',
+                self.connection,
+                if_exists = 'append',
+                index = False,
+            )
+            rows = [
+                {
+                    'bbc': record['bbc'],
+                    'object_id': record['object_id'],
+                    'onderwerp': record.get('onderwerp'),
+                    'zender': record.get('zender'),
+                    'status': record.get('status'),
+                    'soort': record.get('soort'),
+                    'started': started.isoformat(timespec='seconds'),
+                    'unmatched': UNMATCHED,
+                }
+                for record in messages.to_dict('records')
+            ]
+            self.connection.executemany(UPSERT_MESSAGE, rows)
+            self.connection.executemany(
+                "insert or replace into weekly values (?, ?, ?, ?)",
+                [(get_week(started), i['status'], i['soort'], i['bbc']) for i in rows],
+            )
+        return run_id
+
+    def append_metrics(self, exported: dict) -> None:
+        """Store the metrics `exported` by `Metrics.export` with the last run
+        (also if the run failed before its logs were appended)."""
+        with self.connection:
+            self.connection.execute(
+                "insert into metrics (run_id, data) "
+                "select coalesce(max(run_id), 0), ? from runs",
+                (json.dumps(exported),),
+            )
+        return None
+
+    def runs(self) -> pd.DataFrame:
+        "Return all runs."
+        return pd.read_sql("select * from runs order by run_id", self.connection)
+
+    def last_report(self) -> date|None:
+        "Return the date of the last log report or None if no report was sent."
+        row = self.connection.execute("select max(report_date) from reports").fetchone()
+        return None if row[0] is None else date.fromisoformat(row[0])
+
+    def last_reported(self) -> tuple[int, int]:
+        """Return the run_id and metrics_id of the last run and metrics in a
+        log report (0 if no report was sent)."""
+        row = self.connection.execute(
+            "select last_run_id, last_metrics_id from reports "
+            "order by report_date desc limit 1"
+        ).fetchone()
+        return (0, 0) if row is None else row
+
+    def mark_reported(self, report_date: date, sent: datetime|None = None) -> None:
+        """Record that the log report of `report_date` was sent (at `sent`,
+        default now) with the runs and metrics stored up to now."""
+        sent = sent or datetime.now()
+        with self.connection:
+            self.connection.execute(
+                """
+                insert or replace into reports select
+                    ?,
+                    ?,
+                    (select coalesce(max(run_id), 0) from runs),
+                    (select coalesce(max(metrics_id), 0) from metrics)
+                """,
+                (report_date.isoformat(), sent.isoformat(timespec='seconds')),
+            )
+        return None
+
+    def unreported(self) -> pd.DataFrame:
+        "Return the records of the runs after the last log report."
+        return self.read(after_run=self.last_reported()[0])
+
+    def unreported_metrics(self) -> list[dict]:
+        "Return the metrics of the runs after the last log report (see `append_metrics`)."
+        rows = self.connection.execute(
+            "select data from metrics where metrics_id > ? order by metrics_id",
+            (self.last_reported()[1],),
+        ).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def read(
+        self,
+        since: str|None = None,
+        until: str|None = None,
+        object_id: str|None = None,
+        after_run: int|None = None,
+    ) -> pd.DataFrame:
+        """Return the records of the runs from `since` up to and including
+        `until` (dates as 'yyyy-mm-dd'), optionally of one message or of the
+        runs after run `after_run`."""
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("run_date >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("run_date <= ?")
+            params.append(until)
+        if object_id is not None:
+            conditions.append("object_id = ?")
+            params.append(object_id)
+        if after_run is not None:
+            conditions.append("run_id > ?")
+            params.append(after_run)
+        where = f"where {' and '.join(conditions)}" if conditions else ''
+        return pd.read_sql(
+            f"select * from records {where} order by run_id, rowid",
+            self.connection,
+            params = params,
+        )
+
+    def unmatched(self, bbc: str|None = None) -> pd.DataFrame:
+        """Return the bbc's that were unmatched in the last run they were seen
+        in, with the start of the first run since which they are unmatched and
+        the number of days up to the last run. `bbc` is the hash of a pdf or
+        the object_id of a message."""
+        where = "where status = ?"
+        params = [UNMATCHED]
+        if bbc is not None:
+            where += " and (bbc = ? or object_id = ?)"
+            params.extend([bbc, bbc])
+        return pd.read_sql(
+            f"""
+            select
+                bbc,
+                object_id,
+                onderwerp,
+                zender,
+                unmatched_since,
+                last_seen,
+                julianday(last_seen) - julianday(unmatched_since) days_unmatched
+            from messages
+            {where}
+            order by unmatched_since
+            """,
+            self.connection,
+            params = params,
+        )
+
+    def issues_per_week(self) -> pd.DataFrame:
+        """Return the number of bbc's with soort 'issue' per week (rows) and
+        status (columns). A bbc is counted once per week, with its status in
+        the last run of that week."""
+        df = pd.read_sql(
+            """
+            select week, status, count(*) n
+            from weekly
+            where soort = 'issue'
+            group by week, status
+            """,
+            self.connection,
+        )
+        return (
+            df.pivot(index='week', columns='status', values='n')
+            .fillna(0)
+            .astype(int)
+            .rename_axis(columns=None)
+        )
+
+    def export_excel(self, path: Path, run_date: str) -> Path:
+        "Export the records of all runs on `run_date` to Excel file `path`."
+        self.read(since=run_date, until=run_date).to_excel(path)
+        return Path(path)
+
+    def close(self) -> None:
+        self.connection.close()
+        return None
+
+
+@functools.cache
+def get_store() -> LogStore|None:
+    "Return the log store or None if it is not configured."
+    settings = CONFIG['forwarder'].get('logstore')
+    if not settings:
+        return None
+    return LogStore(PATH / settings['path'])
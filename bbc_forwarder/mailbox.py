@@ -17,6 +17,18 @@ work. It should contain:
 Make sure to register the app in Azure as well.
 https://portal.azure.com/
 
+Nothing is done on import. The account is authenticated on first use of
+`MAILBOX` and the workspace folders are resolved on first use of `WORKSPACE` or
+`FOLDER_IDS` (see `Workspace`). The resolved folder ids are stored in a json
+file. While they are younger than the time to live, they are verified with one
+batch request instead of walking the workspace location folder by folder. If
+the verification fails (or the ids are older) the folders are resolved again.
+
+The stored folder ids are configured in `CONFIG['forwarder']['folder_cache']`:
+
+- path : location of the json file (relative to the project folder)
+- ttl_hours : time to live of the stored folder ids
+
 More information
 ----------------
 See the following links for more information on how authentication works:
@@ -24,54 +36,213 @@ See the following links for more information on how authentication works:
 - [O365 - Oauth Authentication](https://github.com/O365/python-o365#oauth-authentication)
 """
 
+import json
+import threading
+import time
 from pathlib import Path
-from O365 import Account, FileSystemTokenBackend
-from bbc_forwarder.config import CONFIG, to_namedtuple
-
-
-token_path = Path(CONFIG['mailbox']['token_path']).expanduser().resolve()
-token_filename = CONFIG['mailbox']['token_filename']
-print(token_path / token_filename)
-
-token_backend = FileSystemTokenBackend(
-    token_path = token_path,
-    token_filename = token_filename,
-)
-credentials = (CONFIG['mailbox']['app_client_id'], CONFIG['mailbox']['secret'])
-scopes = CONFIG['mailbox']['scopes']
-main_resource = CONFIG['mailbox']['main_resource']
-
-
-account = Account(
-    credentials,
-    main_resource = CONFIG['mailbox']['main_resource'],
-    token_backend = token_backend,
-    # redirect_uri=CONFIG['mailbox']['redirect_uri'],
-)
-
-if not account.is_authenticated:
-    if account.authenticate(scopes=CONFIG['mailbox']['scopes']):
-       print('O365 Authenticated!')
-
-
-MAILBOX = account.mailbox()
-
-WORKSPACE = MAILBOX.inbox_folder()
-if CONFIG['forwarder']['location'] is not None:
-    destination = CONFIG['forwarder']['location'].split('/')
-    for folder in destination:
-        WORKSPACE = WORKSPACE.get_folder(folder_name=folder)
-
-workspace_folders = WORKSPACE.get_folders()
-found_folders = {folder.name:folder.folder_id for folder in workspace_folders}
-expected_folders = CONFIG['forwarder']['folders'].values()
-if not all(folder in found_folders for folder in expected_folders):
-    raise EnvironmentError(
-        "\nSANITY CHECK FAILED :\n"
-        "One or more workspace folders were not in the expected location."
+from typing import Callable
+
+from bbc_forwarder.config import CONFIG, PATH
+
+
+# graph allows 20 requests per batch
+BATCH_SIZE = 20
+
+
+def connect():
+    "Return the authenticated account of the mailbox."
+    # O365 (and requests) are only imported when the mailbox is used
+    from O365 import Account, FileSystemTokenBackend
+
+    token_path = Path(CONFIG['mailbox']['token_path']).expanduser().resolve()
+    token_filename = CONFIG['mailbox']['token_filename']
+    print(token_path / token_filename)
+
+    token_backend = FileSystemTokenBackend(
+        token_path = token_path,
+        token_filename = token_filename,
     )
+    credentials = (CONFIG['mailbox']['app_client_id'], CONFIG['mailbox']['secret'])
 
-FOLDER_IDS = {
-    k:found_folders[v]
-    for k,v in CONFIG['forwarder']['folders'].items()
-}
+    account = Account(
+        credentials,
+        main_resource = CONFIG['mailbox']['main_resource'],
+        token_backend = token_backend,
+        # redirect_uri=CONFIG['mailbox']['redirect_uri'],
+    )
+
+    if not account.is_authenticated:
+        if account.authenticate(scopes=CONFIG['mailbox']['scopes']):
+           print('O365 Authenticated!')
+    return account
+
+
+def read_folder_cache(path: Path, ttl_hours: float) -> dict|None:
+    """Return the stored folder ids at `path` or None if they are missing,
+    older than `ttl_hours` or stored for another location or other folders."""
+    try:
+        with open(path, encoding='utf8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - stored.get('created', 0) > ttl_hours * 3600:
+        return None
+    if stored.get('location') != CONFIG['forwarder']['location']:
+        return None
+    if stored.get('folders') != CONFIG['forwarder']['folders']:
+        return None
+    return stored
+
+
+def write_folder_cache(path: Path, workspace_id: str, folder_ids: dict) -> None:
+    "Store the resolved folder ids at `path`."
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stored = dict(
+        created = time.time(),
+        location = CONFIG['forwarder']['location'],
+        folders = CONFIG['forwarder']['folders'],
+        workspace_id = workspace_id,
+        folder_ids = folder_ids,
+    )
+    with open(path, 'w', encoding='utf8') as f:
+        json.dump(stored, f, indent=4)
+    return None
+
+
+class Workspace:
+    """The mailbox and the workspace folders, connected and resolved on first
+    use. `connect` returns the authenticated account."""
+    def __init__(self, connect: Callable = connect):
+        self.connect = connect
+        self.lock = threading.RLock()
+        self._mailbox = None
+        self._workspace_id = None
+        self._folder_ids = None
+        settings = CONFIG['forwarder'].get('folder_cache', {})
+        self.cache_path = PATH / settings.get('path', 'cache/folders.json')
+        self.ttl_hours = settings.get('ttl_hours', 24)
+
+    @property
+    def mailbox(self):
+        with self.lock:
+            if self._mailbox is None:
+                self._mailbox = self.connect().mailbox()
+            return self._mailbox
+
+    @property
+    def folder_ids(self) -> dict:
+        "Ids of the workspace folders by key (see `CONFIG['forwarder']['folders']`)."
+        with self.lock:
+            if self._folder_ids is None:
+                self.resolve()
+            return self._folder_ids
+
+    @property
+    def folder(self):
+        "The workspace folder."
+        with self.lock:
+            if self._workspace_id is None:
+                self.resolve()
+            return self.get_folder_by_id(self._workspace_id)
+
+    def get_folder_by_id(self, folder_id: str):
+        "Return the folder object for `folder_id` (without a request)."
+        return self.mailbox.folder_constructor(parent=self.mailbox, folder_id=folder_id)
+
+    def get_folder(self, key: str):
+        "Return the workspace folder `key` (without a request)."
+        return self.get_folder_by_id(self.folder_ids[key])
+
+    def resolve(self) -> None:
+        """Resolve the workspace folders: verify the stored folder ids or walk
+        the workspace location and store the found ids."""
+        stored = read_folder_cache(self.cache_path, self.ttl_hours)
+        if stored is not None and self.verify(stored['workspace_id'], stored['folder_ids']):
+            self._workspace_id = stored['workspace_id']
+            self._folder_ids = stored['folder_ids']
+            return None
+        self._workspace_id, self._folder_ids = self.discover()
+        write_folder_cache(self.cache_path, self._workspace_id, self._folder_ids)
+        return None
+
+    def discover(self) -> tuple[str, dict]:
+        """Walk the workspace location folder by folder and return the id of the
+        workspace and the ids of the workspace folders."""
+        workspace = self.mailbox.inbox_folder()
+        if CONFIG['forwarder']['location'] is not None:
+            destination = CONFIG['forwarder']['location'].split('/')
+            for folder in destination:
+                workspace = workspace.get_folder(folder_name=folder)
+
+        workspace_folders = workspace.get_folders()
+        found_folders = {folder.name:folder.folder_id for folder in workspace_folders}
+        expected_folders = CONFIG['forwarder']['folders'].values()
+        if not all(folder in found_folders for folder in expected_folders):
+            raise EnvironmentError(
+                "\nSANITY CHECK FAILED :\n"
+                "One or more workspace folders were not in the expected location."
+            )
+
+        folder_ids = {
+            k:found_folders[v]
+            for k,v in CONFIG['forwarder']['folders'].items()
+        }
+        return workspace.folder_id, folder_ids
+
+    def verify(self, workspace_id: str, folder_ids: dict) -> bool:
+        """Return if the workspace folders still exist, have the expected names
+        and are in the workspace. Uses one batch request (per 20 folders)."""
+        mailbox = self.mailbox
+        service_url = mailbox.protocol.service_url.rstrip('/')
+        requests = [
+            {
+                'id': key,
+                'method': 'GET',
+                'url': mailbox.build_url(f"/mailFolders/{folder_id}").removeprefix(service_url)
+                + '?$select=id,displayName,parentFolderId',
+            }
+            for key, folder_id in folder_ids.items()
+        ]
+        responses = {}
+        for i in range(0, len(requests), BATCH_SIZE):
+            data = {'requests': requests[i:i + BATCH_SIZE]}
+            response = mailbox.con.post(f"{service_url}/$batch", data=data)
+            responses.update(
+                (item['id'], item)
+                for item in response.json().get('responses', [])
+            )
+        names = CONFIG['forwarder']['folders']
+        for key in folder_ids:
+            response = responses.get(key, {})
+            body = response.get('body') or {}
+            if (
+                response.get('status') != 200
+                or body.get('displayName') != names[key]
+                or body.get('parentFolderId') != workspace_id
+            ):
+                return False
+        return True
+
+
+WORKSPACE_LOCK = threading.Lock()
+_workspace = None
+
+
+def get_workspace() -> Workspace:
+    "Return the workspace (created on first use)."
+    global _workspace
+    with WORKSPACE_LOCK:
+        if _workspace is None:
+            _workspace = Workspace()
+        return _workspace
+
+
+def __getattr__(name: str):
+    "Connect the mailbox on first use of `MAILBOX`, `WORKSPACE` or `FOLDER_IDS`."
+    if name == 'MAILBOX':
+        return get_workspace().mailbox
+    if name == 'WORKSPACE':
+        return get_workspace().folder
+    if name == 'FOLDER_IDS':
+        return get_workspace().folder_ids
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,131 @@
+"""metrics module
+==============
+
+The metrics module records how long every stage of a run takes. The global
+`METRICS` collects the wall time of every call of a stage and counters per
+stage:
+
+- bytes : bytes transferred (downloaded or uploaded attachments)
+- cache_hits, cache_misses : pdfs found (or not found) in the parser cache
+- retries : requests to the mailbox retried after throttling
+
+Stages are timed with the `timed` decorator or the `METRICS.timer` context
+manager; counters are added with `METRICS.count`. Recording is thread-safe, so
+the workers of the `engine` record into the same metrics. Pdfs extracted in
+worker processes record into the metrics of the worker, which are merged into
+`METRICS` (see `parser.extract_contents`).
+
+`Metrics.summary` returns the number of calls, the total time, p50, p95 and
+max per stage and the counters. When the log report is sent, the summary is
+written as json lines next to the logs (one line per stage) and rendered in the
+report (see `script_bbc_forwarder.send_log_report`).
+"""
+
+import contextlib
+import functools
+import json
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+COUNTERS = ['bytes', 'cache_hits', 'cache_misses', 'retries']
+
+
+class Metrics:
+    "Wall times per call and counters per stage."
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.durations = defaultdict(lambda: array('d'))
+            self.counters = defaultdict(Counter)
+        return None
+
+    def add(self, stage: str, seconds: float) -> None:
+        "Record a call of `stage` that took `seconds`."
+        with self.lock:
+            self.durations[stage].append(seconds)
+        return None
+
+    def count(self, stage: str, counter: str, n: int = 1) -> None:
+        "Add `n` to `counter` of `stage`."
+        with self.lock:
+            self.counters[stage][counter] += n
+        return None
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        "Record the wall time of the block as a call of `stage`."
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def export(self) -> dict:
+        "Return the recorded metrics as plain (picklable) data, see `merge`."
+        with self.lock:
+            return {
+                'durations': {k:v.tolist() for k,v in self.durations.items()},
+                'counters': {k:dict(v) for k,v in self.counters.items()},
+            }
+
+    def merge(self, exported: dict) -> None:
+        "Add the metrics `exported` by another `Metrics` (e.g. of a worker process)."
+        with self.lock:
+            for stage, durations in exported['durations'].items():
+                self.durations[stage].extend(durations)
+            for stage, counters in exported['counters'].items():
+                self.counters[stage].update(counters)
+        return None
+
+    def summary(self) -> pd.DataFrame:
+        """Return the number of calls, total time, p50, p95 and max (in ms) and
+        the counters per stage."""
+        with self.lock:
+            stages = list(dict.fromkeys([*self.durations, *self.counters]))
+            rows = {}
+            for stage in stages:
+                durations = np.frombuffer(self.durations.get(stage, array('d')), dtype=float)
+                row = {'aantal': len(durations), 'totaal_s': durations.sum()}
+                if len(durations):
+                    p50, p95 = np.percentile(durations, [50, 95]) * 1e3
+                    row |= {'p50_ms': p50, 'p95_ms': p95, 'max_ms': durations.max() * 1e3}
+                counters = self.counters.get(stage, {})
+                row |= {counter:counters.get(counter, 0) for counter in COUNTERS}
+                rows[stage] = row
+        columns = ['aantal', 'totaal_s', 'p50_ms', 'p95_ms', 'max_ms', *COUNTERS]
+        return pd.DataFrame.from_dict(rows, orient='index', columns=columns).rename_axis('stage')
+
+    def write(self, path: Path) -> None:
+        "Append the summary to `path` as json lines (one line per stage)."
+        created = datetime.now().isoformat(timespec='seconds')
+        summary = self.summary().round(3).astype(object)
+        summary = summary.where(summary.notna(), None).reset_index()
+        with open(path, 'a', encoding='utf8') as f:
+            for record in summary.to_dict('records'):
+                f.write(json.dumps({'created': created} | record) + '\n')
+        return None
+
+
+METRICS = Metrics()
+
+
+def timed(stage: str):
+    "Decorator recording every call of the function as a call of `stage`."
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
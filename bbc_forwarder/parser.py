@@ -15,17 +15,92 @@ The parser module contains the `parser` function which does the following:
     g. If a name is match, store the population record.
 4. Logs this process.
 
+`parse_all_messages` does this in phases: all pdfs are downloaded and
+extracted first (see `extract_contents`), then the candidates for all birth dates are
+fetched with as few queries as possible (see `get_all_kandidaten`) and finally
+the records are created. Extracting text from pdfs is cpu-bound: if
+`CONFIG['parser']['workers']` is set, it is done in a pool of worker processes.
+In snapshot mode the candidates are looked up in a local copy of the population
+instead of OSIRIS (see the `snapshot` module).
+
+If `CONFIG['parser']['client']` is set, the candidates are queried with a
+pooled client that is held for the whole run (see the `client` module) instead
+of through `query.osiris`.
+
+If `CONFIG['parser']['cache']` is set, the extracted text and features are
+stored in a cache keyed by a hash of the attachment (see the `cache` module).
+Attachments that were extracted in an earlier run are not extracted again.
+
+Only the metadata of the attachments is fetched up front; pdfs within the size
+limit in `CONFIG['parser']['attachments']` are streamed to the download folder
+and read from there (see the `attachments` module). Other attachments are never
+downloaded.
+
+If `CONFIG['parser']['duplicates']` is enabled, pdfs that were already
+forwarded (or that are also attached to a message of the run that was received
+earlier) are recognized by their pdf key before extraction and by their text key after
+extraction (see the `duplicates` module). Duplicates are not looked up and not
+matched; their records get the message they are a duplicate of.
+
+In incremental mode (`CONFIG['parser']['state']`) the messages seen in earlier
+runs are kept in a state file (see the `state` module). Only the attachments of
+new messages are downloaded and extracted; known messages are matched again
+against the current candidates using their extracted results from the state.
+
+While parsing all messages the results are held as compact records (message
+fields once per message, matched students as positions in the shared
+candidates) and the DataFrame is created once at the end (see the `records`
+module).
+
 The module further contains several helper functions which the `parser` utilizes during parsing:
 
 - is_pdf :
+- read_pdf :
 - parse_pdf :
+- open_content :
+- read_pages :
+- extract_features :
+- find_features :
+- extract_tiered :
+- get_version :
+- get_cache :
+- extract_contents :
+- extract :
+- get_download_folder :
+- is_selected :
+- get_attachments :
+- get_contents :
+- needs_full_tier :
+- get_attachment_record :
+- collect_records :
+- build_records :
 - remove_whitespace :
 - find_institute :
 - find_amount :
 - replace_months :
 - find_dates :
 - get_earliest :
-- search_name :
+- Matcher :
+- get_client :
+- query_kandidaten :
+- get_matcher :
+- get_kandidaten :
+- get_all_kandidaten :
+- query_population :
+- get_snapshot :
+- get_state :
+- list_messages :
+- list_pages :
+- find_duplicates :
+- without_duplicates :
+
+The regular expressions and the institute matcher are compiled once on import
+(from `CONFIG['parser']`), so searching a text takes a handful of passes instead
+of one pass per institute and per month. `benchmarks/bench_extract.py` measures
+the time per document.
+
+pdfminer and the OSIRIS client are imported on first use (when a pdf is read or
+candidates are queried), so importing the parser is cheap.
 
 More information
 ----------------
@@ -35,18 +110,32 @@ Searching the contents is done using regular expressions:
 """
 
 import base64
+import binascii
+import functools
+import hashlib
+import importlib
+import inspect
 import io
+import json
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator
 
 import pandas as pd
-from pdfminer.high_level import extract_text
 
-from query import osiris as osi
-from bbc_forwarder.config import CONFIG
+from bbc_forwarder.config import CONFIG, PATH
+from bbc_forwarder.cache import Cache, get_key, open_cache
+from bbc_forwarder.client import open_client
+from bbc_forwarder.metrics import METRICS, timed
+from bbc_forwarder import attachments, duplicates
+from bbc_forwarder.attachments import Attachment
+from bbc_forwarder.snapshot import Snapshot
+from bbc_forwarder.records import AttachmentRecord, MessageRecord, RecordBuilder
+from bbc_forwarder.state import State
 
 
-SQL = """
+SQL_POPULATION = """
 select
     studentnummer,
     stud.voorletters,
@@ -79,22 +168,89 @@ from
     left join osiris.ost_opleiding ropl using (opleiding)
 where
     sinh.collegejaar = {{ collegejaar }}
-    and stud.geboortedatum = date '{{ geboortedatum }}'
 """
 
+SQL = SQL_POPULATION + """\
+    and stud.geboortedatum in ({{ geboortedata }})
+"""
+
+SQL_CHANGES = SQL_POPULATION + """\
+    and (
+        sinh.mutatiedatum_actiefcode >= date '{{ sinds }}'
+        or sinh.datum_verzoek_inschr >= date '{{ sinds }}'
+    )
+"""
+
+# maximum number of birth dates per query (oracle allows 1000 items in a list)
+CHUNKSIZE = 500
+
+# layout analysis for the fast tier: no vertical text and no ordering of boxes
+FAST_LAPARAMS = dict(detect_vertical=False, boxes_flow=None)
+
+
+class LazyModule:
+    "Module that is imported on first use of one of its attributes."
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attribute: str):
+        return getattr(importlib.import_module(self.name), attribute)
+
+
+# the OSIRIS client connects to the database on import
+osi = LazyModule('query.osiris')
+
 
 def is_pdf(attachment) -> bool:
     "Return if attachment has extension '.pdf' as boolean."
     return Path(attachment.name).suffix.lower() == '.pdf'
 
 
-def parse_pdf(attachment):
-    """Try to read pdf and return contents as string.
-    Return False if extraction fails.
+def open_content(content: str|Path) -> BinaryIO:
+    """Return a binary file for pdf `content`: the path of a downloaded pdf (see
+    `get_attachments`) or a base64 encoded string."""
+    if isinstance(content, Path):
+        return open(content, 'rb')
+    return io.BytesIO(base64.b64decode(content))
+
+
+def read_pages(doc: BinaryIO, maxpages: int) -> str:
+    """Return the text of the first `maxpages` pages of pdf file `doc`. Uses reduced
+    layout analysis and stops after the first page on which a date is found."""
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    manager = PDFResourceManager()
+    output = io.StringIO()
+    converter = TextConverter(manager, output, laparams=LAParams(**FAST_LAPARAMS))
+    try:
+        interpreter = PDFPageInterpreter(manager, converter)
+        for page in PDFPage.get_pages(doc, maxpages=maxpages):
+            interpreter.process_page(page)
+            text = replace_months(remove_whitespace(output.getvalue()))
+            if find_datestrings(text):
+                break
+    finally:
+        converter.close()
+    return output.getvalue()
+
+
+@timed('read_pdf')
+def read_pdf(content: str|Path, maxpages: int|None = None):
+    """Try to read pdf `content` (see `open_content`) and return contents as
+    string. If `maxpages` is set, only the first pages are read (see
+    `read_pages`). Return False if extraction fails.
     """
+    from pdfminer.high_level import extract_text
+
     try:
-        doc = base64.b64decode(attachment.content)
-        text = extract_text(io.BytesIO(doc))
+        with open_content(content) as doc:
+            if maxpages:
+                text = read_pages(doc, maxpages)
+            else:
+                text = extract_text(doc)
         # return False if parsed text is (mostly) empty
         if len(text) < 24:
             return False
@@ -103,204 +259,917 @@ def parse_pdf(attachment):
         return False
 
 
+def parse_pdf(attachment):
+    """Try to read pdf and return contents as string.
+    Return False if extraction fails.
+    """
+    return read_pdf(attachment.content)
+
+
+WORD_BOUNDARY = re.compile(r"\b")
+
+
+class Matcher:
+    """Search a text for a collection of literal `words` in a single scan.
+
+    The words are escaped and combined into one alternation (longest first).
+    After every match the search resumes at the next position, so overlapping
+    occurrences are found as well. If `boundaries` is True a word only matches
+    as a whole word, as with `\\bword\\b`. The words found are the same as
+    when searching the text for every word separately.
+    """
+    def __init__(self, words, boundaries: bool = True):
+        self.words = list(dict.fromkeys(
+            word for word in words if isinstance(word, str) and word
+        ))
+        self.boundaries = boundaries
+        self.prefixes = {}
+        alternation = '|'.join(
+            re.escape(word) for word in sorted(self.words, key=len, reverse=True)
+        )
+        boundary = r"\b" if boundaries else ''
+        self.regex = re.compile(rf"{boundary}(?:{alternation}){boundary}")
+
+    def get_prefixes(self, word: str) -> list[str]:
+        "Return the other words that `word` starts with."
+        if word not in self.prefixes:
+            self.prefixes[word] = [
+                i for i in self.words if i != word and word.startswith(i)
+            ]
+        return self.prefixes[word]
+
+    def finditer(self, text: str):
+        "Yield (position, word) for every occurrence of a word in `text`."
+        if not self.words:
+            return
+        position = 0
+        while match := self.regex.search(text, position):
+            position, word = match.start(), match.group()
+            # only the longest word is captured at a position; shorter words
+            # that match at the same position are prefixes of that word
+            for prefix in self.get_prefixes(word):
+                end = position + len(prefix)
+                if not self.boundaries or WORD_BOUNDARY.match(text, end):
+                    yield position, prefix
+            yield position, word
+            position += 1
+
+    def find(self, text: str) -> set[str]:
+        "Return the words that occur in `text`."
+        return {word for _, word in self.finditer(text)}
+
+
+WHITESPACE = re.compile(r"[^\S\n\r]{2,}")
+
+AMOUNT = re.compile(
+    r"""
+    €           # euro-teken
+    [^\S\n\r]*  # optionele whitespace, geen newline
+    \d          # cijfer
+    (?:         # non-capturing groep
+    [.,]?       # optionele punt of komma
+    |           # of
+    [^\S\n\r]   # whitespace, geen newline
+    )           #
+    \d+         # ten minste één cijfer
+    [.,]?       # optionele punt of komma
+    \d*         # overige cijfers indien aanwezig
+    """, re.X)
+
+MONTH_NAMES = [
+    ('januari', 'jan'),
+    ('februari', 'feb'),
+    ('maart', 'mrt', 'mar'),
+    ('april', 'apr'),
+    ('mei', 'may'),
+    ('juni', 'jun'),
+    ('juli', 'jul'),
+    ('augustus', 'aug'),
+    ('september', 'sep'),
+    ('oktober', 'okt', 'oct'),
+    ('november', 'nov'),
+    ('december', 'dec'),
+]
+MONTH_NUMBERS = {
+    name:f"{number:02}"
+    for number, names in enumerate(MONTH_NAMES, start=1)
+    for name in names
+}
+
+# a month name must be preceded by a character in the range \x08-\\ (which,
+# because of re.I, also includes the lowercase letters). No month name ends
+# where another one could start, so replacing all months in one pass gives the
+# same result as replacing them one month at a time.
+MONTH_PRECEDING = re.compile(r"[\x08-\\]", re.I)
+MONTHS = re.compile(
+    rf"(?=[adfjmnos])(?<={MONTH_PRECEDING.pattern})(?:"
+    + '|'.join(f"({'|'.join(names)})" for names in MONTH_NAMES)
+    + ")",
+    re.I,
+)
+
+# case-insensitive matching is slow, so `replace_months` searches the lowercased
+# text for the month names and checks the preceding character separately. This
+# is only equivalent if the text contains none of the characters that re.I
+# folds onto the letters of the month names or that change length when lowered.
+MONTHS_LOWER = re.compile('|'.join(MONTH_NUMBERS))
+CASE_FOLDING = re.compile("[\u0130\u0131\u017f\u212a]")
+
+DATESTRING = re.compile(
+    r"""
+    \d{1,2}     # minimaal 1, maximaal 2 cijfers
+    (?:         # non-capturing groep
+    [-/\.]      # streep, backslash, punt
+    |           # of
+    [^\S\n\r]   # whitespace, geen newline
+    )           #
+    \d{1,2}     # minimaal 1, maximaal 2 cijfers
+    (?:         # non-capturing groep
+    [-/\.]      # streep, backslash, punt
+    |           # of
+    [^\S\n\r]   # whitespace, geen newline
+    )           #
+    \d{4}       # 4 cijfers
+    \b          # einde reeks
+    """, re.X)
+
+DATE_SEPARATOR = re.compile(r'(?:[-/\.]|[^\S\n\r])')
+
+
+def is_literal(pattern: str) -> bool:
+    "Return if `pattern` contains no characters with a special meaning in regex."
+    return not any(char in pattern for char in '.^$*+?{}[]\\|()')
+
+
+# institutes are searched with a single matcher, except for the institutes in
+# 'config.json' that are actual regular expressions
+INSTITUTES = Matcher(
+    [i for i in CONFIG['parser']['institutes'] if is_literal(i)],
+    boundaries = False,
+)
+INSTITUTE_PATTERNS = {
+    i:re.compile(i) for i in CONFIG['parser']['institutes'] if not is_literal(i)
+}
+
+
 def remove_whitespace(text) -> str:
     "Remove any redundant whitespace (but not newlines)."
-    regex = r"[^\S\n\r]{2,}"
-    return re.sub(regex, ' ', text)
+    return WHITESPACE.sub(' ', text)
 
 
 def find_amounts(text) -> list[str]:
     "Search text and return any strings matching amount format: € #,####.##"
-    regex = re.compile(
-        r"""
-        €           # euro-teken
-        [^\S\n\r]*  # optionele whitespace, geen newline
-        \d          # cijfer
-        (?:         # non-capturing groep
-        [.,]?       # optionele punt of komma
-        |           # of
-        [^\S\n\r]   # whitespace, geen newline
-        )           #
-        \d+         # ten minste één cijfer
-        [.,]?       # optionele punt of komma
-        \d*         # overige cijfers indien aanwezig
-        """, re.X)
-    return re.findall(regex, text)
+    return AMOUNT.findall(text)
 
 
 def find_institute(text) -> list:
     """Search text after removing newlines and redundant whitespace and return
     any matched institutes (list of institutes is stored in 'config.json'."""
-    found_institutes = []
     text = text.replace('\n', ' ')
     text = remove_whitespace(text)
-    for institute in CONFIG['parser']['institutes']:
-        if re.search(institute, text):
-            found_institutes.append(institute)
-    return found_institutes
+    found = INSTITUTES.find(text)
+    found.update(i for i, regex in INSTITUTE_PATTERNS.items() if regex.search(text))
+    return [i for i in CONFIG['parser']['institutes'] if i in found]
 
 
 def replace_months(text) -> str:
     "Replace month names with month number in string."
-    replacements = {
-        '(?<=[\b-\\\\])(januari|jan)':     '01',
-        '(?<=[\b-\\\\])(februari|feb)':    '02',
-        '(?<=[\b-\\\\])(maart|mrt|mar)':   '03',
-        '(?<=[\b-\\\\])(april|apr)':       '04',
-        '(?<=[\b-\\\\])(mei|may)':         '05',
-        '(?<=[\b-\\\\])(juni|jun)':        '06',
-        '(?<=[\b-\\\\])(juli|jul)':        '07',
-        '(?<=[\b-\\\\])(augustus|aug)':    '08',
-        '(?<=[\b-\\\\])(september|sep)':   '09',
-        '(?<=[\b-\\\\])(oktober|okt|oct)': '10',
-        '(?<=[\b-\\\\])(november|nov)':    '11',
-        '(?<=[\b-\\\\])(december|dec)':    '12',
-    }
-    for pat, repl in replacements.items():
-        text = re.sub(pat, repl, text, count=0, flags=re.I)
-    return text
+    if CASE_FOLDING.search(text):
+        return MONTHS.sub(lambda match: f"{match.lastindex:02}", text)
+
+    lowered = text.lower()
+    parts = []
+    end = position = 0
+    while match := MONTHS_LOWER.search(lowered, position):
+        start = match.start()
+        if start and MONTH_PRECEDING.match(text, start - 1):
+            parts.extend([text[end:start], MONTH_NUMBERS[match.group()]])
+            end = position = match.end()
+        else:
+            position = start + 1
+    parts.append(text[end:])
+    return ''.join(parts)
 
 
 def find_datestrings(text) -> list[str]:
     "Search text and return any strings matching date format: dd-mm-yyyy."
-    regex = re.compile(
-        r"""
-        \d{1,2}     # minimaal 1, maximaal 2 cijfers
-        (?:         # non-capturing groep
-        [-/\.]      # streep, backslash, punt
-        |           # of
-        [^\S\n\r]   # whitespace, geen newline
-        )           #
-        \d{1,2}     # minimaal 1, maximaal 2 cijfers
-        (?:         # non-capturing groep
-        [-/\.]      # streep, backslash, punt
-        |           # of
-        [^\S\n\r]   # whitespace, geen newline
-        )           #
-        \d{4}       # 4 cijfers
-        \b          # einde reeks
-        """, re.X)
-    return re.findall(regex, text)
-
-
-def get_earliest(datestrings) -> pd.Timestamp:
-    "Convert datestrings into timestamps and return earliest date."
+    return DATESTRING.findall(text)
+
+
+def get_earliest(datestrings) -> pd.Timestamp|None:
+    """Convert datestrings into timestamps and return earliest date (None if
+    none of the datestrings is a valid date)."""
     def to_timestamp(datestring) -> pd.Timestamp | None:
-        regex = r'(?:[-/\.]|[^\S\n\r])'
         order = ['day', 'month', 'year']
-        zipped = zip(order, re.split(regex, datestring))
+        zipped = zip(order, DATE_SEPARATOR.split(datestring))
         dateparts = {unit:int(part) for unit, part in zipped}
         try:
             return pd.Timestamp(**dateparts)
         except ValueError:
             return None
     timestamps = [to_timestamp(i) for i in datestrings]
-    return min([i for i in timestamps if i is not None])
+    return min([i for i in timestamps if i is not None], default=None)
 
 
-def search_name(name: str, text: str, population: pd.DataFrame) -> pd.DataFrame:
-    """
-    Search text for name. If match is found, return all records from
-    population database as DataFrame. Return empty DataFrame if no match.
-    """
-    regex = re.compile(rf"\b{name}\b")
-    match = regex.findall(text)
-    if match:
-        query = "achternaam == @name"
-        return population.query(query)
-    else:
-        return pd.DataFrame()
+@functools.cache
+def get_client():
+    """Return the candidate client configured in `CONFIG['parser']['client']`
+    (held for the whole run) or None to query through `query.osiris`."""
+    return open_client(
+        CONFIG['parser'].get('client'),
+        sql = SQL,
+        collegejaar = CONFIG['parser']['collegejaar'],
+        size = CHUNKSIZE,
+        root = PATH,
+    )
 
 
-def get_kandidaten(geboortedatum: pd.Timestamp) -> pd.DataFrame:
+@timed('query_kandidaten')
+def query_kandidaten(geboortedata: list[pd.Timestamp]) -> pd.DataFrame:
+    """Return population records for all `geboortedata` in a single query,
+    with the configured client if set (see `get_client`)."""
+    client = get_client()
+    if client is not None:
+        return client.query(geboortedata)
     result = osi.execute_query(
         SQL,
         collegejaar = CONFIG['parser']['collegejaar'],
-        geboortedatum = f"{geboortedatum:%Y-%m-%d}",
+        geboortedata = ', '.join(f"date '{i:%Y-%m-%d}'" for i in geboortedata),
         squeeze = False,
     )
     return result
 
 
-def parse_attachment(attachment) -> dict:
-    records = []
-    record = {}
-    record['attachment_id'] = attachment.attachment_id
-    record['attachment_name'] = attachment.name
-    record['is_pdf'] = is_pdf(attachment)
-    if not is_pdf(attachment):
-        records.append(record)
-        return records
-    text = parse_pdf(attachment)
-    record['is_parsed'] = bool(text)
+def query_population(sinds: pd.Timestamp|None = None) -> pd.DataFrame:
+    """Return all population records of the collegejaar. If `sinds` is given,
+    only return the records that changed since that date."""
+    if sinds is None:
+        return osi.execute_query(
+            SQL_POPULATION,
+            collegejaar = CONFIG['parser']['collegejaar'],
+            squeeze = False,
+        )
+    return osi.execute_query(
+        SQL_CHANGES,
+        collegejaar = CONFIG['parser']['collegejaar'],
+        sinds = f"{sinds:%Y-%m-%d}",
+        squeeze = False,
+    )
+
+
+@functools.cache
+def get_snapshot() -> Snapshot|None:
+    """Return the refreshed population snapshot or None if snapshot mode is not
+    enabled in `CONFIG['parser']['snapshot']`."""
+    settings = CONFIG['parser'].get('snapshot')
+    if not settings or not settings.get('enabled'):
+        return None
+    snapshot = Snapshot(
+        PATH / settings['path'],
+        collegejaar = CONFIG['parser']['collegejaar'],
+    )
+    snapshot.refresh(
+        query_population,
+        max_age_minutes = settings.get('max_age_minutes', 60),
+        full_refresh_days = settings.get('full_refresh_days', 7),
+    )
+    return snapshot
+
+
+def get_kandidaten(geboortedatum: pd.Timestamp) -> pd.DataFrame:
+    return get_all_kandidaten([geboortedatum])[geboortedatum]
+
+
+@timed('get_kandidaten')
+def get_all_kandidaten(geboortedata) -> dict[pd.Timestamp, pd.DataFrame]:
+    """Return population records for every date in `geboortedata` by date.
+    Dates are deduplicated and queried in chunks of `CHUNKSIZE`, so a run needs
+    one query per chunk instead of one query per attachment. In snapshot mode
+    the records are looked up in the local snapshot instead."""
+    dates = sorted(set(geboortedata))
+    if not dates:
+        return {}
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        population = snapshot.lookup(dates)
+    else:
+        chunks = [dates[i:i+CHUNKSIZE] for i in range(0, len(dates), CHUNKSIZE)]
+        population = pd.concat(
+            [query_kandidaten(chunk) for chunk in chunks],
+            ignore_index = True,
+        )
+    keys = pd.to_datetime(population.geboortedatum).dt.normalize()
+    groups = {
+        date:group.reset_index(drop=True)
+        for date, group in population.groupby(keys)
+    }
+    empty = population.iloc[0:0]
+    return {date:groups.get(date, empty) for date in dates}
+
+
+def extract_features(content: str|Path, tier: str = 'full') -> tuple[str|bool, dict]:
+    """Read pdf `content` (see `open_content`) and search the text for institutes,
+    amounts and dates. Return the (prepared) text and the extracted features.
+
+    If `tier` is 'fast', only the first `CONFIG['parser']['fast_tier_pages']`
+    pages are read with reduced layout analysis. If it is 'full', the whole
+    document is read.
+
+    This is the cpu-bound part of parsing an attachment. It only depends on
+    `content`, so it can be run in a worker process (see `extract_contents`).
+    """
+    maxpages = CONFIG['parser'].get('fast_tier_pages') if tier == 'fast' else None
+    text = read_pdf(content, maxpages=maxpages)
+    return find_features(text, tier=tier)
+
+
+@timed('find_features')
+def find_features(text: str|bool, tier: str = 'full') -> tuple[str|bool, dict]:
+    """Search the `text` of a pdf (read with `tier`) for institutes, amounts and
+    dates. Return the (prepared) text and the extracted features."""
+    features = {'tier': tier}
+    features['is_parsed'] = bool(text)
     if not bool(text):
-        records.append(record)
-        return records
+        return text, features
 
     text = remove_whitespace(text)
 
-    record['instelling'] = frozenset(find_institute(text))
-    record['bedrag'] = frozenset(find_amounts(text))
+    features['instelling'] = frozenset(find_institute(text))
+    features['bedrag'] = frozenset(find_amounts(text))
 
     text = replace_months(text)
     dates = find_datestrings(text)
-    record['n_dates_found'] = len(dates)
+    features['n_dates_found'] = len(dates)
     if not dates:
-        records.append(record)
-        return records
+        return text, features
+
+    earliest = get_earliest(dates)
+    if earliest is not None:
+        features['search_date'] = earliest
+    return text, features
+
+
+def extract_tiered(content: str|Path) -> tuple[str|bool, dict]:
+    """Return `extract_features` of the fast tier, or of the full tier if the
+    fast tier finds no date (or if `CONFIG['parser']['fast_tier_pages']` is not
+    set)."""
+    if not CONFIG['parser'].get('fast_tier_pages'):
+        return extract_features(content, tier='full')
+    text, features = extract_features(content, tier='fast')
+    if 'search_date' in features:
+        return text, features
+    return extract_features(content, tier='full')
+
+
+def get_version() -> str:
+    """Return a hash of the code and settings that `extract_features` depends
+    on. Used as version key in the cache."""
+    functions = [
+        is_literal,
+        read_pages,
+        read_pdf,
+        remove_whitespace,
+        find_amounts,
+        find_institute,
+        replace_months,
+        find_datestrings,
+        get_earliest,
+        extract_features,
+        find_features,
+        extract_tiered,
+    ]
+    patterns = [
+        WHITESPACE,
+        AMOUNT,
+        MONTHS,
+        MONTHS_LOWER,
+        MONTH_PRECEDING,
+        CASE_FOLDING,
+        DATESTRING,
+        DATE_SEPARATOR,
+    ]
+    source = ''.join(inspect.getsource(function) for function in functions)
+    source += ''.join(regex.pattern for regex in patterns)
+    source += inspect.getsource(Matcher)
+    source += json.dumps(CONFIG['parser']['institutes'])
+    source += json.dumps(CONFIG['parser'].get('fast_tier_pages'))
+    source += repr(FAST_LAPARAMS)
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+@functools.cache
+def get_cache() -> Cache|None:
+    "Return the cache for extracted pdfs or None if the cache is not configured."
+    settings = CONFIG['parser'].get('cache')
+    if not settings:
+        return None
+    return open_cache(settings, version=get_version(), root=PATH)
+
+
+def get_content_key(content: str|Path) -> str|None:
+    """Return cache key for pdf `content` (None if it cannot be decoded). The
+    name of a downloaded pdf already is the hash of its content."""
+    if isinstance(content, Path):
+        return content.stem
+    try:
+        return get_key(base64.b64decode(content))
+    except (binascii.Error, ValueError):
+        return None
+
+
+EXTRACTORS = {
+    'tiered': extract_tiered,
+    'full': functools.partial(extract_features, tier='full'),
+}
+
+
+def extract_measured(tier: str, content: str|Path) -> tuple[tuple, dict]:
+    """Extract `content` with the extractor of `tier` in a worker process and
+    return the result with the metrics recorded by the worker."""
+    METRICS.reset()
+    result = EXTRACTORS[tier](content)
+    return result, METRICS.export()
+
+
+@timed('extract_contents')
+def extract_contents(
+    contents: dict,
+    workers: int|None = None,
+    tier: str = 'tiered',
+) -> dict:
+    """Extract pdf `contents` (dictionary of key:content) and
+    return the results by key. If `workers` is set, the pdfs are extracted in a
+    pool of `workers` processes. `tier` is 'tiered' (see `extract_tiered`) or
+    'full'. Pdfs found in the cache are not extracted.
+    """
+    extractor = EXTRACTORS[tier]
+    cache = get_cache()
+    extracted = {}
+    cache_keys = {}
+    if cache is not None:
+        for key, content in contents.items():
+            cache_key = get_content_key(content)
+            if cache_key is None:
+                continue
+            cache_keys[key] = f"{cache_key}:{tier}"
+            cached = cache.get(cache_keys[key])
+            if cached is not None:
+                extracted[key] = cached
+        METRICS.count('extract_contents', 'cache_hits', len(extracted))
+        METRICS.count('extract_contents', 'cache_misses', len(contents) - len(extracted))
+    todo = {k:v for k,v in contents.items() if k not in extracted}
+
+    if todo and workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(functools.partial(extract_measured, tier), todo.values())
+            for key, (result, exported) in zip(todo, results):
+                extracted[key] = result
+                METRICS.merge(exported)
+    else:
+        extracted.update((k, extractor(v)) for k,v in todo.items())
+
+    for key in todo:
+        if key in cache_keys:
+            cache.set(cache_keys[key], extracted[key])
+    return {key:extracted[key] for key in contents}
+
+
+def extract(content: str|Path, tier: str = 'tiered') -> tuple[str|bool, dict]:
+    "Return extracted text and features for `content`, using the cache if set."
+    return extract_contents({None: content}, tier=tier)[None]
+
+
+@functools.cache
+def get_state() -> State|None:
+    """Return the state of earlier runs or None if incremental mode is not
+    enabled in `CONFIG['parser']['state']`."""
+    settings = CONFIG['parser'].get('state')
+    if not settings or not settings.get('enabled'):
+        return None
+    return State(PATH / settings['path'], version=get_version())
+
+
+# message fields used by `parse_message`
+LISTING_FIELDS = [
+    'received_date_time',
+    'parent_folder_id',
+    'sender',
+    'flag',
+    'is_read',
+    'subject',
+    'has_attachments',
+]
+
+
+def list_messages(folder, limit: int|None = None, batch: int|None = None):
+    """Return the messages in `folder` with only the fields the parser uses, so
+    listing a large folder does not transfer the message bodies. If `batch` is
+    set, the messages are fetched in pages of `batch` messages."""
+    query = folder.new_query().select(*LISTING_FIELDS)
+    return folder.get_messages(limit=limit, query=query, batch=batch)
+
+
+def list_pages(folder, page_size: int, exclude: Iterable[str] = ()) -> Iterator[dict]:
+    """Yield the messages in `folder` (see `list_messages`) in pages of at most
+    `page_size` messages by object_id, oldest first. The next page is listed
+    when the previous page was processed, from the receivedDateTime of the last
+    listed message instead of an offset, so messages that were moved out of the
+    folder in the meantime do not make the listing skip messages. Messages in
+    `exclude` are not yielded."""
+    exclude = set(exclude)
+    since = None
+    # the messages received at `since`, they are listed again by the next query
+    listed = set()
+    while True:
+        query = folder.new_query().select(*LISTING_FIELDS)
+        if since is not None:
+            query = query & folder.new_query().greater_equal('received_date_time', since)
+        limit = page_size + len(listed)
+        messages = list(folder.get_messages(limit=limit, query=query, order_by='receivedDateTime'))
+        page = {
+            message.object_id:message for message in messages
+            if message.object_id not in listed and message.object_id not in exclude
+        }
+        if page:
+            yield page
+        if len(messages) < limit:
+            return None
+        since = messages[-1].received
+        listed = {message.object_id for message in messages if message.received == since}
+
+
+def get_download_folder() -> Path:
+    "Return the folder to which attachments are downloaded."
+    settings = CONFIG['parser'].get('attachments', {})
+    return PATH / settings.get('path', 'cache/attachments')
+
+
+def is_selected(attachment: Attachment) -> bool:
+    """Return if `attachment` should be downloaded: it is a pdf and not larger
+    than `CONFIG['parser']['attachments']['max_size_mb']`."""
+    max_size_mb = CONFIG['parser'].get('attachments', {}).get('max_size_mb')
+    if not is_pdf(attachment):
+        return False
+    if max_size_mb is None or attachment.size is None:
+        return True
+    return attachment.size <= max_size_mb * 1024 * 1024
+
+
+def get_attachments(message) -> list[Attachment]:
+    """Return the attachments of `message`. Only pdfs (within the size limit)
+    are downloaded, see `attachments.get_attachments`."""
+    if not message.has_attachments:
+        return []
+    return attachments.get_attachments(
+        message,
+        folder = get_download_folder(),
+        select = is_selected,
+    )
+
+
+def get_contents(messages) -> tuple[dict, dict]:
+    """Get the attachments of all `messages` (see `get_attachments`). Return the
+    attachments by object_id and the content of the downloaded pdfs by
+    (object_id, attachment_id)."""
+    message_attachments = {}
+    contents = {}
+    for message in messages:
+        message_attachments[message.object_id] = get_attachments(message)
+        for attachment in message_attachments[message.object_id]:
+            if attachment.content is not None:
+                key = (message.object_id, attachment.attachment_id)
+                contents[key] = attachment.content
+    return message_attachments, contents
+
+
+def get_matcher(
+    candidates: pd.DataFrame,
+    search_date: pd.Timestamp,
+    matchers: dict|None = None,
+) -> tuple[Matcher, dict]:
+    """Return the matcher for the last names of `candidates` (the candidates
+    for `search_date`) and the rows of the candidates by last name. The
+    matchers of a run are kept in `matchers` by search date (as the candidates
+    in `kandidaten`), so they are built once per date instead of per pdf."""
+    if matchers is not None and search_date in matchers:
+        return matchers[search_date]
+    matcher = (
+        Matcher(candidates.achternaam),
+        candidates.groupby('achternaam', sort=False).indices,
+    )
+    if matchers is not None:
+        matchers[search_date] = matcher
+    return matcher
+
+
+def needs_full_tier(
+    text,
+    features: dict,
+    candidates: pd.DataFrame,
+    matchers: dict|None = None,
+) -> bool:
+    """Return if the fast tier was used but none of the `candidates` could be
+    found in `text`, in which case the complete document should be read."""
+    if features.get('tier') != 'fast':
+        return False
+    matcher, _ = get_matcher(candidates, features['search_date'], matchers)
+    return not matcher.find(text)
 
-    date = get_earliest(dates)
-    record['search_date'] = date
 
-    candidates = get_kandidaten(record['search_date'])
-    record['has_candidates'] = not candidates.empty
+@timed('parse_attachment')
+def get_attachment_record(
+    attachment,
+    extracted: tuple|None = None,
+    kandidaten: dict|None = None,
+    matchers: dict|None = None,
+) -> AttachmentRecord:
+    """Parse `attachment` and return its compact record (see `records`). If the
+    attachment was already extracted (see `extract_contents`), pass the result
+    as `extracted`. If the candidates were already fetched (see
+    `get_all_kandidaten`), pass them as `kandidaten` and the matchers built for
+    them (see `get_matcher`) as `matchers`.
+    """
+    record = AttachmentRecord(
+        attachment_id = attachment.attachment_id,
+        attachment_name = attachment.name,
+        attachment_size = attachment.size,
+        attachment_hash = attachment.hash,
+        is_pdf = is_pdf(attachment),
+    )
+    if not record.is_pdf:
+        return record
+    if extracted is None and attachment.content is None:
+        # not downloaded (too large)
+        record.is_parsed = False
+        return record
+
+    candidates = None
+    if extracted is None:
+        text, features = extract(attachment.content)
+        if 'search_date' in features:
+            candidates = get_kandidaten(features['search_date'])
+            if needs_full_tier(text, features, candidates):
+                text, features = extract(attachment.content, tier='full')
+                candidates = None
+    else:
+        text, features = extracted
+    record.features = features
+    if 'search_date' not in features or 'duplicate_of' in features:
+        return record
+
+    if candidates is None and kandidaten is None:
+        candidates = get_kandidaten(features['search_date'])
+    elif candidates is None:
+        candidates = kandidaten[features['search_date']]
+    record.has_candidates = not candidates.empty
     if candidates.empty:
-        records.append(record)
-        return records
+        return record
 
-    record['found_student'] = False
-    for name in candidates.achternaam.unique():
-        student_data = search_name(name, text, candidates)
-        if not student_data.empty:
-            record['found_student'] = True
-            record['n_sinh'] = len(student_data)
-            for _, row in student_data.iterrows():
-                new_record = record | row.to_dict()
-                records.append(new_record)
-    if not record['found_student']:
-        records.append(record)
-    return records
+    matcher, rows = get_matcher(candidates, features['search_date'], matchers)
+    found = matcher.find(text)
+    record.candidates = candidates
+    record.matches = [rows[name] for name in matcher.words if name in found]
+    record.found_student = bool(record.matches)
+    return record
+
+
+def parse_attachment(
+    attachment,
+    extracted: tuple|None = None,
+    kandidaten: dict|None = None,
+) -> list:
+    """Parse `attachment` and return records (see `get_attachment_record`)."""
+    return get_attachment_record(attachment, extracted, kandidaten).to_dicts()
 
 
-def parse_message(message) -> list:
+@timed('parse_message')
+def parse_message(
+    message,
+    extracted: dict|None = None,
+    kandidaten: dict|None = None,
+    attachments: list|None = None,
+) -> list:
+    """Parse `message` and its attachments and return records. If the
+    attachments were already downloaded and extracted by `extract_contents`, pass
+    its result as `extracted`. Candidates fetched by `get_all_kandidaten` can
+    be passed as `kandidaten`. Attachments that were already fetched (see
+    `get_contents`) or that come from the state can be passed as `attachments`,
+    otherwise they are fetched with `get_attachments`.
+    """
     records = list()
-    record = dict(
-        datum_ontvangst = message.received.strftime("%Y-%m-%d %Hh%Mm%Ss"),
-        object_id       = message.object_id,
-        folder_id       = message.folder_id,
-        zender          = str(message.sender),
-        flag            = message.flag,
-        is_read         = message.is_read,
-        onderwerp       = message.subject,
-        has_attachments = message.has_attachments,
-    )
+    record = MessageRecord.from_message(message).to_dict()
     if not message.has_attachments:
         records.append(record)
         return records
 
-    message.attachments.download_attachments()
-    for attachment in message.attachments:
-        parsed_attachment_data = parse_attachment(attachment)
+    if attachments is None:
+        attachments = get_attachments(message)
+    for attachment in attachments:
+        key = (message.object_id, attachment.attachment_id)
+        parsed_attachment_data = parse_attachment(
+            attachment,
+            extracted = None if extracted is None else extracted.get(key),
+            kandidaten = kandidaten,
+        )
         for parsed_attachment in parsed_attachment_data:
             new_record = record | parsed_attachment
             records.append(new_record)
     return records
 
 
-def parse_all_messages(messages) -> pd.DataFrame:
-    results = []
+def collect_records(
+    messages,
+    message_attachments: dict,
+    extracted: dict,
+    kandidaten: dict,
+    matchers: dict|None = None,
+) -> RecordBuilder:
+    """Match the extracted attachments of `messages` against `kandidaten` and
+    return the compact records in a `RecordBuilder`. The matcher of every
+    search date is built once (kept in `matchers`, see `get_matcher`)."""
+    if matchers is None:
+        matchers = {}
+    builder = RecordBuilder()
     for message in messages:
-        result = parse_message(message)
-        results.extend(result)
-    df = pd.DataFrame(results)
+        with METRICS.timer('parse_message'):
+            attachment_records = None
+            if message.has_attachments:
+                attachment_records = [
+                    get_attachment_record(
+                        attachment,
+                        extracted = extracted.get((message.object_id, attachment.attachment_id)),
+                        kandidaten = kandidaten,
+                        matchers = matchers,
+                    )
+                    for attachment in message_attachments[message.object_id]
+                ]
+            builder.add(MessageRecord.from_message(message), attachment_records)
+    return builder
+
+
+def build_records(
+    messages,
+    message_attachments: dict,
+    extracted: dict,
+    kandidaten: dict,
+    matchers: dict|None = None,
+) -> pd.DataFrame:
+    """Return the records of `messages` as DataFrame (see `collect_records`).
+    The result is identical to the records of `parse_message`."""
+    builder = collect_records(messages, message_attachments, extracted, kandidaten, matchers)
+    return builder.to_frame()
+
+
+def find_duplicates(
+    detector: duplicates.Detector,
+    keys: list[tuple],
+    contents: dict,
+    extract: Callable[[dict], dict],
+) -> dict:
+    """Return the extracted results of the pdfs `keys` ((object_id,
+    attachment_id) in the order of the messages) with their pdf and text key
+    added to the features (see the `duplicates` module). Duplicates found by
+    their pdf key are not extracted: their text is False and their features
+    only hold the keys and the message they are a duplicate of. `extract` is
+    called with the `contents` of the other pdfs and returns their extracted
+    results (also for pdfs without content, like the messages in the state)."""
+    pdf_keys = {key:duplicates.get_pdf_key(contents[key]) for key in keys if key in contents}
+    found = detector.check(pdf_keys, 'pdf')
+    extracted = extract({k:v for k,v in contents.items() if k not in found})
+    text_keys = {}
+    for key in keys:
+        if key in extracted:
+            text, features = extracted[key]
+            text_keys[key] = duplicates.get_text_key(text, features.get('tier'))
+    found |= detector.check(text_keys, 'text')
+    result = {}
+    for key in keys:
+        if key not in extracted and key not in found:
+            continue
+        text, features = extracted.get(key, (False, {}))
+        added = {
+            # pdfs from the state were not downloaded: keep their stored pdf key
+            'pdf_key': pdf_keys.get(key, features.get('pdf_key')),
+            'text_key': text_keys.get(key),
+        }
+        result[key] = (text, features | added | found.get(key, {}))
+    return result
+
+
+def without_duplicates(extracted: dict, object_id: str) -> dict|None:
+    """Return the extracted results of the pdfs of `object_id` in `extracted`
+    without the features of duplicates (see `duplicates.FIELDS`), as they are
+    kept in the state. Return None if a pdf was not extracted (a duplicate by
+    its pdf key): the message is then parsed again in the next run."""
+    results = {}
+    for key, (text, features) in extracted.items():
+        if key[0] != object_id:
+            continue
+        if features.get('duplicate_by') == 'pdf':
+            return None
+        results[key] = (text, {k:v for k,v in features.items() if k not in duplicates.FIELDS})
+    return results
+
+
+def parse_all_messages(
+    messages,
+    workers: int|None = None,
+    state: State|None = None,
+    prune: bool = True,
+) -> pd.DataFrame:
+    """Parse all messages and return the records as DataFrame.
+
+    Parsing is done in phases: first all pdfs are downloaded and extracted,
+    then the candidates for all found birth dates are fetched at once and
+    finally the records are created. Pdfs for which the fast tier found a date
+    but no candidate are extracted again in full (and the candidates for new
+    dates are fetched) before the records are created. If `workers` (default:
+    `CONFIG['parser']['workers']`) is set, the pdfs are extracted in a pool of
+    `workers` processes. The records are identical to (and in the same order
+    as) parsing the messages one by one with `parse_message`.
+
+    If duplicates are recognized (see `find_duplicates`), duplicates are not
+    extracted (if found by their pdf key) and their candidates are not fetched.
+    The pdfs are checked in the order in which the messages were received, so
+    the first message with a bbc is its original.
+
+    In incremental mode (`state`, default: `get_state()`) only the attachments
+    of messages that are not in the state are downloaded and extracted. After
+    parsing, the new messages are added to the state, messages that are no
+    longer in `messages` are pruned (unless `prune` is False, when `messages`
+    is only a page of the folder) and the state is saved.
+    """
+    if workers is None:
+        workers = CONFIG['parser'].get('workers')
+    if state is None:
+        state = get_state()
+
+    def get_dates(extracted):
+        return [
+            features['search_date']
+            for _, features in extracted.values()
+            if 'search_date' in features
+            and 'duplicate_of' not in features
+        ]
+
+    def extract(contents, tier='tiered'):
+        extracted = extract_contents(contents, workers, tier=tier)
+        if tier == 'tiered':
+            for object_id in known:
+                extracted.update(state.get_extracted(object_id))
+        return extracted
+
+    messages = list(messages)
+    known = set() if state is None else {
+        message.object_id for message in messages if message.object_id in state
+    }
+    new = [message for message in messages if message.object_id not in known]
+    message_attachments, contents = get_contents(new)
+    for object_id in known:
+        message_attachments[object_id] = state.get_attachments(object_id)
+    registry = duplicates.get_registry()
+    detector = None if registry is None else duplicates.Detector(registry)
+    if detector is None:
+        extracted = extract(contents)
+    else:
+        # the message that was received first is the original
+        received = sorted(messages, key=lambda message: (message.received is None, message.received or 0))
+        keys = [
+            (message.object_id, attachment.attachment_id)
+            for message in received
+            for attachment in message_attachments[message.object_id]
+        ]
+        extracted = find_duplicates(detector, keys, contents, extract)
+    kandidaten = get_all_kandidaten(get_dates(extracted))
+    matchers = {}
+
+    retry = {
+        key:contents[key]
+        for key, (text, features) in extracted.items()
+        if 'search_date' in features
+        and 'duplicate_of' not in features
+        and key in contents
+        and needs_full_tier(text, features, kandidaten[features['search_date']], matchers)
+    }
+    if retry:
+        if detector is None:
+            extracted_full = extract(retry, tier='full')
+        else:
+            extract_full = functools.partial(extract, tier='full')
+            retry_keys = [key for key in keys if key in retry]
+            extracted_full = find_duplicates(detector, retry_keys, retry, extract_full)
+        extracted.update(extracted_full)
+        new_dates = [i for i in get_dates(extracted_full) if i not in kandidaten]
+        kandidaten.update(get_all_kandidaten(new_dates))
+
+    df = build_records(messages, message_attachments, extracted, kandidaten, matchers)
+
+    if state is not None:
+        for message in new:
+            results = without_duplicates(extracted, message.object_id)
+            if results is not None:
+                state.add(message.object_id, message_attachments[message.object_id], results)
+        if prune:
+            state.prune(message.object_id for message in messages)
+        state.save()
     return df
@@ -0,0 +1,139 @@
+"""pipeline module
+===============
+
+The pipeline module processes the 'to_process' folder in pages instead of all
+at once. Every page of messages passes through the stages as a generator
+pipeline:
+
+1. paginate : list the folder in pages of `page_size` (see `parser.list_pages`)
+or split listed messages into pages
+2. parse : parse the messages of a page (see `parser.parse_all_messages`)
+3. classify : create the dataset of a page (see `dataset.create_dataset`)
+4. forward : process the messages of a page and keep a compact summary
+
+Only one page of messages and records is held at a time; of every processed
+message only a summary (one row) is kept for the log report. The next page is
+listed when the previous page was processed, so the first messages are
+forwarded as soon as the first page is listed and parsed.
+
+The pipeline is configured in `CONFIG['forwarder']['streaming']`:
+
+- enabled : process the folder in pages
+- page_size : number of messages per page
+"""
+
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+import pandas as pd
+
+from bbc_forwarder import attachments, dataset, parser
+
+
+SUMMARY_FIELDS = [
+    'object_id',
+    'datum_ontvangst',
+    'zender',
+    'onderwerp',
+    'status',
+    'soort',
+    'ontvanger',
+]
+
+
+def paginate(messages: Iterable, page_size: int) -> Iterator[dict]:
+    "Split `messages` into pages: dictionaries of message objects by object_id."
+    iterator = iter(messages)
+    while page := list(islice(iterator, page_size)):
+        yield {message.object_id:message for message in page}
+
+
+def parse(pages: Iterable[dict]) -> Iterator[tuple[dict, pd.DataFrame]]:
+    "Parse the messages of every page. The state is pruned by `stream`."
+    for page in pages:
+        yield page, parser.parse_all_messages(page.values(), prune=False)
+
+
+def classify(parsed: Iterable[tuple[dict, pd.DataFrame]]) -> Iterator[tuple[dict, pd.DataFrame]]:
+    "Create the dataset of every parsed page."
+    for page, records in parsed:
+        yield page, dataset.create_dataset(records)
+
+
+def summarize(logs: pd.DataFrame) -> pd.DataFrame:
+    """Return one row per message in `logs` with the fields needed for the log
+    report and the log store: the message fields, the matched studentnummers,
+    the first pdf (attachment_id and extraction tier) and the hash of the first
+    downloaded pdf (with is_pdf, so the log store identifies the bbc by its
+    hash as in a complete run, see `logstore.get_messages`)."""
+    summary = logs.drop_duplicates('object_id').set_index('object_id')
+    summary = summary[[i for i in SUMMARY_FIELDS if i in logs and i != 'object_id']]
+    studentnummers = logs.get('studentnummer', pd.Series(None, index=logs.index, dtype=object))
+    summary['studentnummer'] = (
+        studentnummers.groupby(logs.object_id)
+        .agg(lambda i: ';'.join(i.dropna().unique()))
+        # the dtype of the aggregate depends on the values of the page
+        .astype('string')
+    )
+    if 'is_pdf' not in logs:
+        return summary.reset_index()
+    pdfs = logs.loc[logs.is_pdf.eq(True).fillna(False).astype(bool)]
+    first_pdf = pdfs.drop_duplicates('object_id').set_index('object_id')
+    if 'tier' in logs:
+        summary['attachment_id'] = first_pdf.attachment_id
+        summary['tier'] = first_pdf.tier
+    if 'attachment_hash' in logs:
+        hashed = pdfs.loc[pdfs.attachment_hash.notna()].drop_duplicates('object_id')
+        summary['is_pdf'] = summary.index.isin(first_pdf.index)
+        summary['attachment_hash'] = hashed.set_index('object_id').attachment_hash
+    return summary.reset_index()
+
+
+def forward(
+    classified: Iterable[tuple[dict, pd.DataFrame]],
+    process: Callable[[pd.DataFrame, dict], None],
+) -> Iterator[pd.DataFrame]:
+    """Process the messages of every page with `process(logs, messages)` and
+    yield the summary of the page. Downloaded attachments are removed after
+    every page."""
+    for page, logs in classified:
+        process(logs, page)
+        attachments.clear(parser.get_download_folder())
+        yield summarize(logs)
+
+
+def stream(
+    pages: Iterable[dict],
+    process: Callable[[pd.DataFrame, dict], None],
+) -> Iterator[pd.DataFrame]:
+    """Parse, classify and process `pages` (see `paginate`) one by one and yield
+    the summary of every page as soon as it is processed. In incremental mode
+    the state is pruned once, after all pages."""
+    listed = []
+    def collect(pages):
+        for page in pages:
+            listed.extend(page)
+            yield page
+
+    yield from forward(classify(parse(collect(pages))), process)
+    state = parser.get_state()
+    if state is not None:
+        state.prune(listed)
+        state.save()
+
+
+def combine(summaries: list[pd.DataFrame]) -> pd.DataFrame:
+    "Return the summaries of the pages as one DataFrame."
+    if not summaries:
+        return pd.DataFrame(columns=SUMMARY_FIELDS)
+    # categoricals of different pages are concatenated as strings
+    return pd.concat(summaries, ignore_index=True).pipe(dataset.to_categoricals)
+
+
+def run(
+    messages: Iterable,
+    process: Callable[[pd.DataFrame, dict], None],
+    page_size: int = 100,
+) -> pd.DataFrame:
+    "Process `messages` page by page (see `stream`) and return the summaries of all messages."
+    return combine(list(stream(paginate(messages, page_size), process)))
@@ -0,0 +1,177 @@
+"""records module
+==============
+
+The records module holds the parse results compactly until the DataFrame is
+created. Parsing a message results in one `MessageRecord` and one
+`AttachmentRecord` per attachment. Neither repeats data of the other:
+
+- the message fields are stored once per message
+- the features of an attachment are the dictionary returned by the extraction
+(not a copy)
+- matched students are stored as row positions in the candidates of their
+birth date (which are shared by all attachments with that date)
+
+`RecordBuilder` collects these records in typed arrays (one entry per row of
+the result) and creates the DataFrame column by column at the end. The result
+is identical to creating the DataFrame from the dictionaries returned by
+`parser.parse_message` (see `MessageRecord.to_dict` and
+`AttachmentRecord.to_dicts`).
+"""
+
+from array import array
+from dataclasses import dataclass, field, fields
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    "Message fields of the records of a message."
+    datum_ontvangst: str
+    object_id: str
+    folder_id: str
+    zender: str
+    flag: dict
+    is_read: bool
+    onderwerp: str
+    has_attachments: bool
+
+    @classmethod
+    def from_message(cls, message) -> 'MessageRecord':
+        return cls(
+            datum_ontvangst = message.received.strftime("%Y-%m-%d %Hh%Mm%Ss"),
+            object_id       = message.object_id,
+            folder_id       = message.folder_id,
+            zender          = str(message.sender),
+            flag            = message.flag,
+            is_read         = message.is_read,
+            onderwerp       = message.subject,
+            has_attachments = message.has_attachments,
+        )
+
+    def to_dict(self) -> dict:
+        return {name:getattr(self, name) for name in MESSAGE_FIELDS}
+
+
+MESSAGE_FIELDS = [i.name for i in fields(MessageRecord)]
+
+
+@dataclass(slots=True)
+class AttachmentRecord:
+    """Parse result of an attachment. Fields that are None are not part of the
+    records. `matches` holds the row positions in `candidates` per matched
+    name; every position results in one record."""
+    attachment_id: str
+    attachment_name: str
+    attachment_size: int|None
+    attachment_hash: str|None
+    is_pdf: bool
+    is_parsed: bool|None = None
+    features: dict|None = None
+    has_candidates: bool|None = None
+    found_student: bool|None = None
+    candidates: pd.DataFrame|None = None
+    matches: list[np.ndarray] = field(default_factory=list)
+
+    def items(self) -> list[tuple]:
+        "Return the (field, value) pairs shared by all records of the attachment."
+        items = [
+            ('attachment_id', self.attachment_id),
+            ('attachment_name', self.attachment_name),
+            ('attachment_size', self.attachment_size),
+            ('attachment_hash', self.attachment_hash),
+            ('is_pdf', self.is_pdf),
+        ]
+        if self.is_parsed is not None:
+            items.append(('is_parsed', self.is_parsed))
+        if self.features is not None:
+            items.extend(self.features.items())
+        if self.has_candidates is not None:
+            items.append(('has_candidates', self.has_candidates))
+        if self.found_student is not None:
+            items.append(('found_student', self.found_student))
+        return items
+
+    def to_dicts(self) -> list[dict]:
+        "Return the records of the attachment as dictionaries."
+        record = dict(self.items())
+        if not self.matches:
+            return [record]
+        return [
+            record | {'n_sinh': len(rows)} | self.candidates.iloc[row].to_dict()
+            for rows in self.matches
+            for row in rows
+        ]
+
+
+class RecordBuilder:
+    """Columnar builder for the records of parsed messages. Every row holds the
+    position of its message, its attachment (shared by the rows of the
+    attachment), the number of sinh ids of the matched name and the position of
+    its candidate."""
+    def __init__(self):
+        self.messages = []
+        self.attachments = []
+        self.message_index = array('q')
+        self.n_sinh = array('q')
+        self.candidate_index = array('q')
+        self.columns = dict.fromkeys(MESSAGE_FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.message_index)
+
+    def add_row(self, attachment: AttachmentRecord|None, n_sinh: int = -1, candidate: int = -1) -> None:
+        self.message_index.append(len(self.messages) - 1)
+        self.attachments.append(attachment)
+        self.n_sinh.append(n_sinh)
+        self.candidate_index.append(candidate)
+        return None
+
+    def add(self, message: MessageRecord, attachments: list[AttachmentRecord]|None) -> None:
+        """Add the records of `message` and its `attachments` (None if the
+        message has no attachments)."""
+        self.messages.append(message)
+        if attachments is None:
+            self.add_row(None)
+            return None
+        for attachment in attachments:
+            self.columns.update(dict.fromkeys(key for key, _ in attachment.items()))
+            if not attachment.matches:
+                self.add_row(attachment)
+                continue
+            self.columns.update(dict.fromkeys(['n_sinh', *attachment.candidates.columns]))
+            for rows in attachment.matches:
+                for row in rows:
+                    self.add_row(attachment, len(rows), row)
+        return None
+
+    def to_frame(self) -> pd.DataFrame:
+        "Create the DataFrame of all records (missing values are NaN)."
+        if not len(self):
+            return pd.DataFrame()
+        columns = {}
+        for name in MESSAGE_FIELDS:
+            columns[name] = [getattr(self.messages[i], name) for i in self.message_index]
+        for name in self.columns:
+            columns.setdefault(name, [np.nan] * len(self))
+
+        candidate_records = {}
+        previous, items = None, []
+        for row, attachment in enumerate(self.attachments):
+            if attachment is None:
+                continue
+            if attachment is not previous:
+                previous, items = attachment, attachment.items()
+            for key, value in items:
+                columns[key][row] = value
+            if self.candidate_index[row] < 0:
+                continue
+            columns['n_sinh'][row] = self.n_sinh[row]
+            # the candidates of a birth date are converted once
+            frame = id(attachment.candidates)
+            if frame not in candidate_records:
+                candidate_records[frame] = attachment.candidates.to_dict('records')
+            for key, value in candidate_records[frame][self.candidate_index[row]].items():
+                columns[key][row] = value
+        return pd.DataFrame(columns, columns=list(self.columns))
@@ -0,0 +1,179 @@
+"""snapshot module
+===============
+
+The snapshot module keeps a local copy of the population (all enrolment records
+of the collegejaar) in a SQLite database with an index on `geboortedatum`.
+When snapshot mode is enabled the parser looks up candidates in the snapshot
+instead of querying OSIRIS for every run.
+
+The snapshot is refreshed by the parser (see `parser.get_snapshot`):
+
+- a full refresh loads the complete population; it is done when the snapshot
+is empty, when the collegejaar changed or when the last full refresh is older
+than `full_refresh_days`.
+- an incremental refresh only loads the records that changed since the last
+refresh (based on `mutatiedatum_actiefcode` and `datum_verzoek`); it is done
+when the last refresh is older than `max_age_minutes`.
+
+If refreshing fails (OSIRIS is slow or unavailable) the existing snapshot is
+used. The candidates it returns are then flagged as 'snapshot_verouderd' in the
+`bron` column instead of 'snapshot'.
+
+The snapshot is configured in `CONFIG['parser']['snapshot']`:
+
+- enabled : use the snapshot for candidate lookups
+- path : location of the database (relative to the project folder)
+- max_age_minutes : refresh incrementally if the snapshot is older than this
+- full_refresh_days : refresh completely if the snapshot is older than this
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+
+SCHEMA = """
+create table if not exists meta (
+    key   text primary key,
+    value text
+)
+"""
+
+# maximum number of parameters per lookup query
+CHUNKSIZE = 500
+
+
+def to_storage(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    """Convert datetime columns in `df` to iso strings so they can be stored and
+    compared in SQLite. Return the converted frame and the datetime columns."""
+    df = df.copy()
+    dates = df.select_dtypes(include=['datetime', 'datetimetz']).columns.to_list()
+    for column in dates:
+        df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+    if 'geboortedatum' in df:
+        df['geboortedatum'] = (
+            pd.to_datetime(df['geboortedatum']).dt.strftime('%Y-%m-%d')
+        )
+        if 'geboortedatum' not in dates:
+            dates.append('geboortedatum')
+    return df, dates
+
+
+class Snapshot:
+    "Local, indexed copy of the population of the collegejaar."
+    def __init__(self, path: Path, collegejaar: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(SCHEMA)
+        self.collegejaar = collegejaar
+        self.stale = False
+
+    def get_meta(self, key: str):
+        row = self.connection.execute(
+            "select value from meta where key = ?",
+            (key,),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_meta(self, **items) -> None:
+        for key, value in items.items():
+            self.connection.execute(
+                "insert or replace into meta values (?, ?)",
+                (key, json.dumps(value)),
+            )
+        return None
+
+    @property
+    def refreshed(self) -> pd.Timestamp|None:
+        "Time of the last (full or incremental) refresh."
+        refreshed = self.get_meta('refreshed')
+        return None if refreshed is None else pd.Timestamp(refreshed)
+
+    @property
+    def is_empty(self) -> bool:
+        "True if the snapshot holds no population for the collegejaar."
+        return self.get_meta('collegejaar') != self.collegejaar
+
+    def load(self, population: pd.DataFrame, now: pd.Timestamp) -> None:
+        "Replace the snapshot with `population`."
+        df, dates = to_storage(population)
+        with self.connection:
+            df.to_sql('population', self.connection, if_exists='replace', index=False)
+            self.connection.execute(
+                "create index if not exists ix_geboortedatum "
+                "on population (geboortedatum)"
+            )
+            self.set_meta(
+                collegejaar = self.collegejaar,
+                dates = dates,
+                refreshed = now.isoformat(),
+                full_refresh = now.isoformat(),
+            )
+        return None
+
+    def update(self, changes: pd.DataFrame, now: pd.Timestamp) -> None:
+        "Replace records in the snapshot by the records (by sinh_id) in `changes`."
+        df, _ = to_storage(changes)
+        sinh_ids = [(i,) for i in df.sinh_id.unique().tolist()]
+        with self.connection:
+            self.connection.executemany(
+                "delete from population where sinh_id = ?",
+                sinh_ids,
+            )
+            df.to_sql('population', self.connection, if_exists='append', index=False)
+            self.set_meta(refreshed = now.isoformat())
+        return None
+
+    def refresh(
+        self,
+        query: Callable[[pd.Timestamp|None], pd.DataFrame],
+        max_age_minutes: float = 60,
+        full_refresh_days: float = 7,
+    ) -> None:
+        """Refresh the snapshot with `query` if it is outdated. `query` returns the
+        complete population when called with None or the records changed since
+        the date it is called with. If refreshing fails, the existing snapshot is
+        used and flagged as stale."""
+        now = pd.Timestamp.now()
+        full_refresh = self.get_meta('full_refresh')
+        try:
+            if (
+                self.is_empty
+                or now - pd.Timestamp(full_refresh) > pd.Timedelta(days=full_refresh_days)
+            ):
+                self.load(query(None), now)
+            elif now - self.refreshed > pd.Timedelta(minutes=max_age_minutes):
+                # dates in osiris have no time component: include the day itself
+                self.update(query(self.refreshed.normalize()), now)
+            self.stale = False
+        except Exception as error:
+            if self.is_empty:
+                raise
+            self.stale = True
+            print(
+                "\nSNAPSHOT VEROUDERD :\n"
+                f"Refresh failed ({error!r}), "
+                f"using snapshot of {self.refreshed:%Y-%m-%d %H:%M}."
+            )
+        return None
+
+    def lookup(self, geboortedata) -> pd.DataFrame:
+        "Return all records in the snapshot with a birth date in `geboortedata`."
+        dates = sorted({f"{i:%Y-%m-%d}" for i in geboortedata})
+        frames = []
+        for i in range(0, max(len(dates), 1), CHUNKSIZE):
+            chunk = dates[i:i+CHUNKSIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            frames.append(pd.read_sql(
+                f"select * from population where geboortedatum in ({placeholders})",
+                self.connection,
+                params = chunk,
+                parse_dates = self.get_meta('dates'),
+            ))
+        population = pd.concat(frames, ignore_index=True)
+        population['bron'] = 'snapshot_verouderd' if self.stale else 'snapshot'
+        return population
@@ -0,0 +1,93 @@
+"""state module
+============
+
+The state module keeps track of the messages in the 'to_process' folder that
+were already parsed in an earlier run. For every known message the state holds
+the attachments (metadata) and the text and features extracted from its
+pdfs. In incremental mode the parser only downloads and extracts the attachments
+of new messages; known messages are matched again against the current
+candidates using the extracted results from the state.
+
+Messages that are no longer in the folder (forwarded, archived or removed) are
+pruned from the state at the end of every run. The state is stored together
+with a version key (see `parser.get_version`); a state of another version is
+discarded, so changing the extraction code causes a complete run.
+
+The state is configured in `CONFIG['parser']['state']`:
+
+- enabled : parse incrementally
+- path : location of the state file (relative to the project folder)
+"""
+
+import os
+import pickle
+from pathlib import Path
+
+from bbc_forwarder.attachments import Attachment
+
+
+class State:
+    "Attachments and extracted results of the messages seen in earlier runs."
+    def __init__(self, path: Path, version: str):
+        self.path = Path(path)
+        self.version = version
+        self.messages = {}
+        if self.path.exists():
+            with open(self.path, 'rb') as f:
+                stored = pickle.load(f)
+            if stored.get('version') == version:
+                self.messages = stored['messages']
+
+    def __contains__(self, object_id: str) -> bool:
+        return object_id in self.messages
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def get_attachments(self, object_id: str) -> list[Attachment]:
+        "Return the attachments of `object_id` (without content)."
+        return [
+            Attachment(attachment_id, name, None, size, content_type, hash)
+            for attachment_id, name, size, content_type, hash
+            in self.messages[object_id]['attachments']
+        ]
+
+    def get_extracted(self, object_id: str) -> dict:
+        "Return the extracted results of `object_id` keyed by (object_id, attachment_id)."
+        return {
+            (object_id, attachment_id):extracted
+            for attachment_id, extracted in self.messages[object_id]['extracted'].items()
+        }
+
+    def add(self, object_id: str, attachments, extracted: dict) -> None:
+        """Store `attachments` of `object_id` and their extracted results from
+        `extracted` (keyed by (object_id, attachment_id))."""
+        self.messages[object_id] = dict(
+            attachments = [
+                (i.attachment_id, i.name, i.size, i.content_type, i.hash)
+                for i in attachments
+            ],
+            extracted = {
+                attachment_id:value
+                for (message_id, attachment_id), value in extracted.items()
+                if message_id == object_id
+            },
+        )
+        return None
+
+    def prune(self, object_ids) -> int:
+        "Remove all messages not in `object_ids`. Return the number of removed messages."
+        keep = set(object_ids)
+        removed = [i for i in self.messages if i not in keep]
+        for object_id in removed:
+            del self.messages[object_id]
+        return len(removed)
+
+    def save(self) -> None:
+        "Write the state to disk (replacing the previous state at once)."
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(temp, 'wb') as f:
+            pickle.dump(dict(version=self.version, messages=self.messages), f)
+        os.replace(temp, self.path)
+        return None
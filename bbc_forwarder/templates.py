@@ -2,12 +2,23 @@
 ================
 
 The templates module loads a Jinja `Environment` in a global variable. Similarly the subject lines and filenames belonging to the templates are loaded in a global dictionary (`SUBJECTS` and `FILENAME`) from `CONFIG` (these are stored in 'config.json').
+
+The templates in the templates folder are compiled once on import (`TEMPLATES`, see `get_template`). If `CONFIG['forwarder']['template_cache']` is set, the compiled templates are stored in a bytecode cache, so a new process does not compile them again:
+
+- path : location of the bytecode cache (relative to the project folder)
+
+The tables in the message templates are `Table`s: the fields of the records of a message as rows, with the values of every record as columns. `Table.to_html` renders the same html as `DataFrame.to_html(header=False)` on the transposed records, without creating and formatting a DataFrame. Where pandas versions print cells differently (frozensets, repeated spaces and tabs in string columns), the style of the installed pandas is read once from `DataFrame.to_html` (see `get_style`).
 """
 
+import functools
+import re
+from collections import namedtuple
 from pathlib import Path
 from string import Template
 
-from jinja2 import Environment, FileSystemLoader
+import numpy as np
+import pandas as pd
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from bbc_forwarder.config import to_namedtuple, CONFIG, PATH
 
@@ -20,12 +31,184 @@ def name(path):
     return Path(path).suffixes[0].strip('.').strip('_')
 
 
+def get_bytecode_cache() -> FileSystemBytecodeCache|None:
+    "Return the bytecode cache of the templates or None if it is not configured."
+    settings = CONFIG['forwarder'].get('template_cache')
+    if not settings:
+        return None
+    folder = PATH / settings['path']
+    folder.mkdir(parents=True, exist_ok=True)
+    return FileSystemBytecodeCache(str(folder))
+
+
 ENV = Environment(
     loader = FileSystemLoader(searchpath = PATH / 'templates'),
     trim_blocks = True,
-    lstrip_blocks = True
+    lstrip_blocks = True,
+    bytecode_cache = get_bytecode_cache(),
 )
 
+TEMPLATES = {name:ENV.get_template(name) for name in ENV.list_templates(extensions=['html'])}
+
+
+def get_template(name: str):
+    """Return the compiled template `name` from `TEMPLATES` (loaded from `ENV`
+    if it was added after import)."""
+    template = TEMPLATES.get(name)
+    if template is None:
+        template = ENV.get_template(name)
+    return template
+
+
 SUBJECTS = {k:Template(v) for k,v in CONFIG['forwarder']['subjects'].items()}
 
 FILENAME = Template(CONFIG['forwarder']['filename'])
+
+
+# characters escaped in the values and in the html of `DataFrame.to_html`
+ESCAPE_CHARS = str.maketrans({'\t': r'\t', '\r': r'\r', '\n': r'\n'})
+ESCAPE_HTML = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# how the installed pandas prints the cells that differ between its versions
+Style = namedtuple('Style', ['frozenset', 'nbsp', 'escape_strings'])
+
+
+def render_cells(values: list, dtype) -> list[str]:
+    "Return the cells of `values` (with `dtype`) as rendered by `DataFrame.to_html`."
+    html = pd.DataFrame({'value': values}, dtype=dtype).T.to_html(header=False)
+    return re.findall(r'<td>(.*)</td>', html)
+
+
+@functools.cache
+def get_style() -> Style:
+    """Return how the installed pandas prints frozensets (the text around the
+    items), if it renders repeated spaces as non-breaking spaces and if it
+    escapes tabs and newlines in string columns."""
+    frozenset_cell, nbsp_cell = render_cells([frozenset(['x']), 'a  b'], object)
+    string_cell, = render_cells(['a\tb'], 'string')
+    return Style(
+        frozenset = tuple(frozenset_cell.split('x')),
+        nbsp = nbsp_cell != 'a  b',
+        escape_strings = string_cell != 'a\tb',
+    )
+
+
+def format_float(value: float) -> str:
+    "Return `value` formatted with the display precision of pandas."
+    text = f"{value:.{pd.get_option('display.precision')}f}".rstrip('0')
+    return text + '0' if text.endswith('.') else text
+
+
+def format_thing(value) -> str:
+    """Return `value` printed as pandas prints the objects in a column: the
+    items of sets, lists and tuples without quotes, other values as `str`."""
+    if isinstance(value, frozenset):
+        prefix, suffix = get_style().frozenset
+        return prefix + ', '.join(format_thing(i) for i in value) + suffix
+    if isinstance(value, set):
+        return '{' + ', '.join(format_thing(i) for i in value) + '}'
+    if isinstance(value, list):
+        return '[' + ', '.join(format_thing(i) for i in value) + ']'
+    if isinstance(value, tuple):
+        items = [format_thing(i) for i in value]
+        return '(' + ', '.join(items) + (',)' if len(items) == 1 else ')')
+    if isinstance(value, dict):
+        return '{' + ', '.join(f"{k!r}: {v!r}" for k, v in value.items()) + '}'
+    return str(value)
+
+
+def format_value(value, na_rep: str, dtype: str = 'object') -> str:
+    """Return `value` formatted as a cell in a column with `dtype` ('object' or
+    'string') of `DataFrame.to_html`: missing values by their kind (`na_rep`
+    for NaN), floats with the display precision and other values as pandas
+    prints them (see `format_thing` and `get_style`)."""
+    style = get_style()
+    if value is pd.NA:
+        text = '<NA>'
+    elif dtype == 'string':
+        text = value.translate(ESCAPE_CHARS) if style.escape_strings else value
+    elif isinstance(value, str):
+        text = value.translate(ESCAPE_CHARS)
+    elif value is None:
+        text = 'None'
+    elif value is pd.NaT:
+        text = 'NaT'
+    elif isinstance(value, (float, np.floating)):
+        text = na_rep if np.isnan(value) else format_float(value)
+    else:
+        text = format_thing(value).translate(ESCAPE_CHARS)
+    text = text.translate(ESCAPE_HTML).strip()
+    return text.replace('  ', '&nbsp;&nbsp;') if style.nbsp else text
+
+
+def get_column_dtype(dtypes: list) -> str|None:
+    """Return the dtype of the columns of the transposed DataFrame with fields
+    of `dtypes`: 'string' if all fields are strings, 'object' if they are mixed
+    with object, categorical or string fields and None otherwise."""
+    unique = set(dtypes)
+    if len(unique) == 1:
+        dtype, = unique
+        if isinstance(dtype, pd.StringDtype) and dtype.na_value is pd.NA:
+            return 'string'
+        return 'object' if dtype == object else None
+    if all(isinstance(i, pd.StringDtype) for i in unique):
+        return None
+    if any(i == object or isinstance(i, (pd.CategoricalDtype, pd.StringDtype)) for i in unique):
+        return 'object'
+    return None
+
+
+class Table:
+    """Fields (`labels`) of records (`records`, tuples with a value per field)
+    to render as a table with a row per field and a column per record.
+    `dtype` is the dtype of the columns of the transposed DataFrame ('object'
+    or 'string'); other tables are kept as `frame` and rendered by pandas."""
+    __slots__ = ('labels', 'records', 'dtype', 'frame')
+
+    def __init__(
+        self,
+        labels: tuple[str, ...],
+        records: list[tuple],
+        dtype: str = 'object',
+        frame: pd.DataFrame|None = None,
+    ):
+        self.labels = labels
+        self.records = records
+        self.dtype = dtype
+        self.frame = frame
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fields: list[str], unique: bool = False) -> 'Table':
+        """Return the `fields` of the records in `df`. If `unique` is True,
+        repeated records are left out (like `DataFrame.drop_duplicates`)."""
+        dtype = get_column_dtype([df[field].dtype for field in fields])
+        if dtype is None:
+            frame = df[fields].drop_duplicates() if unique else df[fields]
+            return cls(tuple(fields), [], dtype, frame.T)
+        columns = [df[field].to_numpy(dtype=object) for field in fields]
+        records = list(zip(*columns))
+        if unique:
+            first = {}
+            for record in records:
+                key = tuple(None if value is pd.NA or value != value else value for value in record)
+                first.setdefault(key, record)
+            records = list(first.values())
+        return cls(tuple(fields), records, dtype)
+
+    def to_html(self, header: bool = False, na_rep: str = 'NaN') -> str:
+        "Return the table as html, identical to `DataFrame.to_html` of the transposed records."
+        if header:
+            raise ValueError("a Table is rendered without header")
+        if self.frame is not None:
+            return self.frame.to_html(header=False, na_rep=na_rep)
+        lines = ['<table border="1" class="dataframe">', '  <tbody>']
+        for i, label in enumerate(self.labels):
+            lines.append('    <tr>')
+            lines.append(f"      <th>{format_value(label, na_rep)}</th>")
+            lines.extend(
+                f"      <td>{format_value(record[i], na_rep, self.dtype)}</td>"
+                for record in self.records
+            )
+            lines.append('    </tr>')
+        lines.extend(['  </tbody>', '</table>'])
+        return '\n'.join(lines)
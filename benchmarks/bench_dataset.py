@@ -0,0 +1,54 @@
+"""bench_dataset
+=============
+
+Benchmark of the classification of the parsed records (status, soort and
+ontvanger per message) in `dataset.create_dataset`. Compares the vectorized
+implementation against applying the rules per message
+(`tests.reference_dataset.create_dataset_per_message`) and checks that both
+give identical results.
+
+Run with: `python -m benchmarks.bench_dataset [rows]`
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from bbc_forwarder import dataset
+from benchmarks.corpus import make_records
+from tests import reference_dataset
+
+
+def get_records(rows: int, seed: int = 0) -> pd.DataFrame:
+    "Return the records of random messages, about `rows` records in total."
+    records = make_records(rows, seed=seed)
+    messages = records.object_id.iloc[:rows].unique()
+    return records.loc[records.object_id.isin(messages)]
+
+
+def main(rows: int = 100_000) -> pd.DataFrame:
+    records = get_records(rows)
+    results = {}
+    datasets = {}
+    for name, function in [
+        ('per_message', reference_dataset.create_dataset_per_message),
+        ('vectorized', dataset.create_dataset),
+    ]:
+        start = time.perf_counter()
+        datasets[name] = function(records.copy())
+        results[name] = {'seconds': time.perf_counter() - start}
+    pd.testing.assert_frame_equal(datasets['per_message'], datasets['vectorized'])
+
+    results = pd.DataFrame(results).T
+    results['speedup'] = results.loc['per_message', 'seconds'] / results.seconds
+    results.attrs['rows'] = len(records)
+    results.attrs['messages'] = records.object_id.nunique()
+    return results
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    results = main(rows)
+    print(f"{results.attrs['rows']} records, {results.attrs['messages']} messages")
+    print(results.round(2))
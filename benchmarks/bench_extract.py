@@ -0,0 +1,113 @@
+"""bench_extract
+=============
+
+Micro-benchmark of the feature extraction of the parser (institutes, amounts
+and dates from the text of a pdf). Compares the precompiled patterns against
+the previous implementation, which compiled the patterns on every call and ran
+a separate pass per institute and per month. Also checks that both give the
+same results.
+
+Run with: `python -m benchmarks.bench_extract`
+"""
+
+import re
+import timeit
+
+import pandas as pd
+
+from bbc_forwarder import parser
+from bbc_forwarder.config import CONFIG
+from benchmarks.corpus import make_texts
+
+
+def legacy_remove_whitespace(text) -> str:
+    return re.sub(r"[^\S\n\r]{2,}", ' ', text)
+
+
+def legacy_find_amounts(text) -> list[str]:
+    regex = re.compile(r"€[^\S\n\r]*\d(?:[.,]?|[^\S\n\r])\d+[.,]?\d*")
+    return re.findall(regex, text)
+
+
+def legacy_find_institute(text) -> list:
+    found_institutes = []
+    text = text.replace('\n', ' ')
+    text = legacy_remove_whitespace(text)
+    for institute in CONFIG['parser']['institutes']:
+        if re.search(institute, text):
+            found_institutes.append(institute)
+    return found_institutes
+
+
+def legacy_replace_months(text) -> str:
+    replacements = {
+        '(?<=[\b-\\\\])(januari|jan)':     '01',
+        '(?<=[\b-\\\\])(februari|feb)':    '02',
+        '(?<=[\b-\\\\])(maart|mrt|mar)':   '03',
+        '(?<=[\b-\\\\])(april|apr)':       '04',
+        '(?<=[\b-\\\\])(mei|may)':         '05',
+        '(?<=[\b-\\\\])(juni|jun)':        '06',
+        '(?<=[\b-\\\\])(juli|jul)':        '07',
+        '(?<=[\b-\\\\])(augustus|aug)':    '08',
+        '(?<=[\b-\\\\])(september|sep)':   '09',
+        '(?<=[\b-\\\\])(oktober|okt|oct)': '10',
+        '(?<=[\b-\\\\])(november|nov)':    '11',
+        '(?<=[\b-\\\\])(december|dec)':    '12',
+    }
+    for pat, repl in replacements.items():
+        text = re.sub(pat, repl, text, count=0, flags=re.I)
+    return text
+
+
+def legacy_find_datestrings(text) -> list[str]:
+    regex = re.compile(r"\d{1,2}(?:[-/\.]|[^\S\n\r])\d{1,2}(?:[-/\.]|[^\S\n\r])\d{4}\b")
+    return re.findall(regex, text)
+
+
+def legacy_features(text) -> dict:
+    "Features as extracted by the previous implementation."
+    text = legacy_remove_whitespace(text)
+    features = {
+        'instelling': frozenset(legacy_find_institute(text)),
+        'bedrag': frozenset(legacy_find_amounts(text)),
+    }
+    text = legacy_replace_months(text)
+    features['dates'] = legacy_find_datestrings(text)
+    features['text'] = text
+    return features
+
+
+def features(text) -> dict:
+    "Features as extracted by the parser."
+    text = parser.remove_whitespace(text)
+    features = {
+        'instelling': frozenset(parser.find_institute(text)),
+        'bedrag': frozenset(parser.find_amounts(text)),
+    }
+    text = parser.replace_months(text)
+    features['dates'] = parser.find_datestrings(text)
+    features['text'] = text
+    return features
+
+
+def main(n: int = 1000, repeat: int = 5) -> pd.DataFrame:
+    texts = make_texts(n)
+    mismatches = [
+        i for i, text in enumerate(texts)
+        if legacy_features(text) != features(text)
+    ]
+    if mismatches:
+        raise AssertionError(f"results differ for texts {mismatches[:10]}")
+
+    results = {}
+    for name, function in [('legacy', legacy_features), ('parser', features)]:
+        timer = timeit.Timer(lambda: [function(text) for text in texts])
+        best = min(timer.repeat(repeat=repeat, number=1))
+        results[name] = {'us_per_document': best / n * 1e6}
+    results = pd.DataFrame(results).T
+    results['speedup'] = results.loc['legacy', 'us_per_document'] / results.us_per_document
+    return results
+
+
+if __name__ == '__main__':
+    print(main().round(2))
@@ -0,0 +1,88 @@
+"""bench_records
+=============
+
+Benchmark of the memory used by the parse results of many messages. Compares
+creating the DataFrame from the dictionaries returned by `parser.parse_message`
+(one dictionary per record) against collecting compact records in a
+`RecordBuilder` (`parser.build_records`) and checks that both give identical
+results. The memory held by the collected records (before the DataFrame is
+created) and the peak memory are traced; the memory of the dataset is measured
+with and without categoricals.
+
+Run with: `python -m benchmarks.bench_records [messages]`
+"""
+
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from bbc_forwarder import dataset, parser
+from bbc_forwarder.records import RecordBuilder
+from benchmarks.corpus import make_parse_inputs
+
+
+MB = 1024 * 1024
+
+
+def collect_dicts(messages, message_attachments, extracted, kandidaten) -> list[dict]:
+    "Return the records of `messages` as dictionaries (see `parser.parse_message`)."
+    return [
+        record
+        for message in messages
+        for record in parser.parse_message(
+            message,
+            extracted = extracted,
+            kandidaten = kandidaten,
+            attachments = message_attachments[message.object_id],
+        )
+    ]
+
+
+def measure(collect, to_frame, inputs) -> tuple[pd.DataFrame, dict]:
+    """Collect the records of `inputs` with `collect` and create the DataFrame
+    with `to_frame`. Return the DataFrame, the time, the memory held by the
+    collected records and the peak traced memory."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    collected = collect(*inputs)
+    held, _ = tracemalloc.get_traced_memory()
+    result = to_frame(collected)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'held_mb': held / MB, 'peak_mb': peak / MB}
+
+
+def main(n: int = 50_000) -> pd.DataFrame:
+    inputs = make_parse_inputs(n)
+    results = {}
+    records = {}
+    for name, collect, to_frame in [
+        ('dicts', collect_dicts, pd.DataFrame),
+        ('builder', parser.collect_records, RecordBuilder.to_frame),
+    ]:
+        records[name], results[name] = measure(collect, to_frame, inputs)
+        results[name]['records_mb'] = records[name].memory_usage(deep=True).sum() / MB
+    pd.testing.assert_frame_equal(records['dicts'], records['builder'])
+
+    logs = dataset.create_dataset(records['builder'])
+    categoricals = logs.memory_usage(deep=True).sum() / MB
+    for column in dataset.CATEGORICALS:
+        if column in logs:
+            logs[column] = logs[column].astype(object)
+    results['builder']['dataset_mb'] = categoricals
+    results['dicts']['dataset_mb'] = logs.memory_usage(deep=True).sum() / MB
+
+    results = pd.DataFrame(results).T
+    results.attrs['rows'] = len(records['builder'])
+    results.attrs['messages'] = n
+    return results
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    results = main(n)
+    print(f"{results.attrs['rows']} records, {results.attrs['messages']} messages")
+    print(results.round(2))
@@ -0,0 +1,238 @@
+"""bench_stages
+============
+
+Benchmark of all stages of a run on a synthetic mailbox, without network
+access. The messages are generated with `corpus.make_mailbox` in an in-memory
+mailbox, the candidates are looked up in a SQLite population
+(`client.SQLiteClient`) and the forwarded messages are sent to the in-memory
+mailbox. The stages are timed separately, each on the output of the previous
+stage:
+
+- list : list the messages in the 'to_process' folder
+- download : list and download the attachments (`parser.get_contents`)
+- extract : read the text of the pdfs (first pages, as the fast tier)
+- features : search the texts for institutes, amounts and dates
+- lookup : fetch the candidates for all birth dates
+- match : match the texts against the candidates and create the records
+- dataset : classify the records (`dataset.create_dataset`)
+- render : render the body and subject of every message
+- forward : create, send and archive the messages (`process_tasks`)
+
+The pdf cache, the snapshot and the state are disabled, so every stage does all
+of its work. The results are saved as json in `benchmarks/results` and compared
+with the previous results (ratio of the seconds per stage).
+
+Run with: `python -m benchmarks.bench_stages [messages ...]` (default 100, 1000
+and 10000 messages)
+"""
+
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from string import Template
+from unittest import mock
+
+import pandas as pd
+
+import script_bbc_forwarder as script
+from bbc_forwarder import dataset, forwarder, journal, mailbox, parser
+from bbc_forwarder.client import SQLiteClient
+from bbc_forwarder.config import CONFIG, PATH
+from bbc_forwarder.templates import get_template
+from benchmarks.corpus import make_mailbox, make_population
+from tests.fakes import make_workspace
+
+
+RESULTS = PATH / 'benchmarks/results'
+
+SIZES = [100, 1_000, 10_000]
+
+# templates and queries per task, if not set in `CONFIG['forwarder']['tasks']`
+TASKS = {
+    'template.forward.jinja.html': ["soort == 'faculteit'"],
+    'template.annotated.jinja.html': ["soort == 'csa'"],
+    'template.issues.jinja.html': ["soort == 'issue'"],
+}
+
+# subjects per soort (the subjects in the example config are not set)
+SUBJECTS = {
+    soort:Template('$status $onderwerp $studentnummer $opleiding')
+    for soort in ['faculteit', 'csa', 'issue']
+}
+
+# messages are sent, if not set in `CONFIG['forwarder']['settings']`
+SAVE_AS_DRAFT = {soort:False for soort in SUBJECTS}
+
+
+class Timer:
+    "Collects the seconds per stage."
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+
+
+def render(logs: pd.DataFrame, tasks: dict) -> list[tuple[str, str]]:
+    "Return the subject and body of every message, as in `process_message`."
+    rendered = []
+    for template_path, queries in tasks.items():
+        template = get_template(template_path)
+        for query in queries:
+            for _, message_logs in logs.query(query).groupby('object_id', sort=False):
+                data = forwarder.get_message_data(message_logs)
+                subject = SUBJECTS[data['soort']].substitute(
+                    status        = data['status'],
+                    onderwerp     = data['onderwerp'],
+                    studentnummer = data['studentnummer'],
+                    opleiding     = data['opleiding'],
+                )
+                rendered.append((subject, template.render(**data)))
+    return rendered
+
+
+def run_stages(n: int, seed: int = 0) -> dict[str, float]:
+    """Run all stages on a mailbox with `n` messages and return the seconds
+    per stage."""
+    population = make_population(max(n // 2, 10), seed=seed)
+    box = make_mailbox(n, population, seed=seed)
+    tasks = CONFIG['forwarder'].get('tasks', TASKS)
+    save_as_draft = CONFIG['forwarder']['settings'].get('save_as_draft', SAVE_AS_DRAFT)
+    timer = Timer()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = SQLiteClient(Path(tmp) / 'population.sqlite3', size=parser.CHUNKSIZE)
+        client.load(population)
+        steps = journal.Journal(Path(tmp) / 'journal.sqlite3')
+        patches = [
+            mock.patch.object(journal, 'get_journal', return_value=steps),
+            mock.patch.object(parser, 'get_cache', return_value=None),
+            mock.patch.object(parser, 'get_snapshot', return_value=None),
+            mock.patch.object(parser, 'get_state', return_value=None),
+            mock.patch.object(parser, 'get_client', return_value=client),
+            mock.patch.object(parser, 'get_download_folder', return_value=Path(tmp) / 'downloads'),
+            mock.patch.object(mailbox, '_workspace', make_workspace(box.box)),
+            mock.patch.object(forwarder, 'SUBJECTS', SUBJECTS),
+            mock.patch.dict(CONFIG['forwarder'], tasks=tasks),
+            mock.patch.dict(CONFIG['forwarder']['settings'], save_as_draft=save_as_draft),
+        ]
+        with contextlib.ExitStack() as stack:
+            for patch in patches:
+                stack.enter_context(patch)
+
+            with timer.stage('list'):
+                messages = box.get_messages()
+            with timer.stage('download'):
+                message_attachments, contents = parser.get_contents(messages)
+            with timer.stage('extract'):
+                maxpages = CONFIG['parser'].get('fast_tier_pages')
+                texts = {
+                    key:parser.read_pdf(content, maxpages=maxpages)
+                    for key, content in contents.items()
+                }
+            with timer.stage('features'):
+                extracted = {
+                    key:parser.find_features(text, tier='fast')
+                    for key, text in texts.items()
+                }
+            with timer.stage('lookup'):
+                kandidaten = parser.get_all_kandidaten(
+                    features['search_date']
+                    for _, features in extracted.values()
+                    if 'search_date' in features
+                )
+            with timer.stage('match'):
+                records = parser.build_records(messages, message_attachments, extracted, kandidaten)
+            with timer.stage('dataset'):
+                logs = dataset.create_dataset(records)
+            with timer.stage('render'):
+                render(logs, tasks)
+            with timer.stage('forward'):
+                script.process_tasks(logs, {i.object_id:i for i in messages})
+        client.close()
+        steps.close()
+    return timer.seconds
+
+
+def get_commit() -> str|None:
+    "Return the current commit of the repository (None if unknown)."
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd = PATH,
+            capture_output = True,
+            text = True,
+            check = True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(results: pd.DataFrame, folder: Path = RESULTS) -> Path:
+    "Save `results` with the commit and platform as json in `folder`."
+    folder.mkdir(parents=True, exist_ok=True)
+    now = datetime.now()
+    path = folder / f"stages.{now:%Y%m%d-%H%M%S}.json"
+    data = {
+        'created': now.isoformat(timespec='seconds'),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results.to_dict('records'),
+    }
+    path.write_text(json.dumps(data, indent=2))
+    return path
+
+
+def load(path: Path) -> pd.DataFrame:
+    "Return the results saved in `path`."
+    data = json.loads(Path(path).read_text())
+    return pd.DataFrame(data['results']).assign(commit=data['commit'])
+
+
+def compare(results: pd.DataFrame, baseline: pd.DataFrame) -> pd.DataFrame:
+    """Return the seconds per stage and size of `results` next to `baseline`
+    and their ratio (above 1 is slower than the baseline)."""
+    keys = ['messages', 'stage']
+    merged = results[keys + ['seconds']].merge(
+        baseline[keys + ['seconds']],
+        on = keys,
+        suffixes = ('', '_baseline'),
+    )
+    merged['ratio'] = merged.seconds / merged.seconds_baseline
+    return merged.set_index(keys)
+
+
+def main(sizes: list[int] = SIZES) -> pd.DataFrame:
+    results = []
+    for n in sizes:
+        for stage, seconds in run_stages(n).items():
+            results.append({
+                'messages': n,
+                'stage': stage,
+                'seconds': seconds,
+                'ms_per_message': seconds / n * 1e3,
+            })
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    sizes = [int(i) for i in sys.argv[1:]] or SIZES
+    previous = sorted(RESULTS.glob('stages.*.json'))
+    results = main(sizes)
+    path = save(results)
+    table = results.pivot(index='stage', columns='messages', values='ms_per_message')
+    print(table.reindex(results.stage.unique()).round(3))
+    print(f"saved to {path.relative_to(PATH)}")
+    compared = compare(results, load(previous[-1])) if previous else None
+    if compared is not None and not compared.empty:
+        print(f"compared to {previous[-1].name}")
+        print(compared.round(3))
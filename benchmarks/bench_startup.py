@@ -0,0 +1,67 @@
+"""bench_startup
+=============
+
+Benchmark of the cold start: the time to import the modules of the
+bbc-forwarder in a fresh interpreter. Importing does not connect the mailbox;
+pdfminer, O365, requests and the OSIRIS client are only imported on first use. Reports
+the median time per module and which of these heavy dependencies were loaded.
+
+Run with: `python -m benchmarks.bench_startup [repeats]`
+"""
+
+import json
+import statistics
+import subprocess
+import sys
+
+import pandas as pd
+
+from bbc_forwarder.config import PATH
+
+
+MODULES = [
+    'bbc_forwarder.mailbox',
+    'bbc_forwarder.parser',
+    'bbc_forwarder.forwarder',
+    'script_bbc_forwarder',
+]
+
+DEPENDENCIES = ['pandas', 'pdfminer', 'O365', 'requests', 'query']
+
+PROGRAM = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+loaded = [name for name in {dependencies} if name in sys.modules]
+print(json.dumps({{'seconds': seconds, 'loaded': loaded}}))
+"""
+
+
+def measure(module: str) -> dict:
+    "Import `module` in a fresh interpreter and return the time and loaded dependencies."
+    program = PROGRAM.format(module=module, dependencies=DEPENDENCIES)
+    output = subprocess.run(
+        [sys.executable, '-c', program],
+        cwd = PATH,
+        capture_output = True,
+        text = True,
+        check = True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(repeats: int = 5) -> pd.DataFrame:
+    results = {}
+    for module in MODULES:
+        runs = [measure(module) for _ in range(repeats)]
+        results[module] = {
+            'seconds': statistics.median(run['seconds'] for run in runs),
+            'loaded': ', '.join(runs[-1]['loaded']),
+        }
+    return pd.DataFrame(results).T
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(main(repeats).to_string())
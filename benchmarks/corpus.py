@@ -0,0 +1,383 @@
+"""corpus module
+=============
+
+Generator of synthetic bbc texts for the benchmarks. The texts vary in
+institute, date format, month names, amounts and amount of noise.
+
+`make_records` generates the parsed records of random messages (as returned by
+the parser) covering all message statuses, for the dataset benchmark.
+
+`make_parse_inputs` generates random messages with their attachments, extracted
+features and candidates (the input of `parser.build_records`), for the records
+benchmark.
+
+`make_population` and `make_mailbox` generate a population with all columns of
+the candidate query and an in-memory mailbox (`tests.fakes.InMemoryMailbox`)
+with bbc pdfs of students in (and outside) that population, for the benchmark
+of all stages.
+"""
+
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+
+from bbc_forwarder.attachments import Attachment
+from bbc_forwarder.config import CONFIG
+from tests.fakes import FakeAttachment, InMemoryMailbox, make_pdf
+
+
+SURNAMES = [
+    'Vries', 'Jong', 'Bakker', 'Visser', 'Smit', 'Meijer', 'Mulder', 'Bos',
+    'Vos', 'Peters', 'Hendriks', 'Dekker', 'Brouwer', 'Dijkstra', 'Smits',
+    "O'Brien", 'Smit-Jansen', 'Yılmaz', 'Nguyen', 'Kaya',
+]
+
+MONTHS = [
+    'januari', 'februari', 'maart', 'april', 'mei', 'juni', 'juli',
+    'augustus', 'september', 'oktober', 'november', 'december',
+    'jan', 'feb', 'mrt', 'Mar', 'apr', 'May', 'jun', 'jul', 'aug', 'Sep',
+    'okt', 'Oct', 'nov', 'DEC',
+]
+
+MONTH_NAMES = {
+    1: ['januari', 'jan'],
+    2: ['februari', 'feb'],
+    3: ['maart', 'mrt', 'Mar'],
+    4: ['april', 'apr'],
+    5: ['mei', 'May'],
+    6: ['juni', 'jun'],
+    7: ['juli', 'jul'],
+    8: ['augustus', 'aug'],
+    9: ['september', 'Sep'],
+    10: ['oktober', 'okt', 'Oct'],
+    11: ['november', 'nov'],
+    12: ['december', 'DEC'],
+}
+
+WORDS = (
+    'verklaring bewijs betaald collegegeld de het een student heeft voor '
+    'inschrijving wettelijk instellingscollegegeld studiejaar opleiding '
+    'bachelor master handtekening datum kenmerk pagina'
+).split()
+
+
+def make_date(rng: random.Random, date: datetime|None = None) -> str:
+    "Return `date` (random if None) in one of the formats found in bbc's."
+    if date is None:
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(1995, 2005)
+    else:
+        day, month, year = date.day, date.month, date.year
+    separator = rng.choice(['-', '/', '.', ' '])
+    if rng.random() < 0.4:
+        names = MONTHS if date is None else MONTH_NAMES[month]
+        return f"{day} {rng.choice(names)} {year}"
+    if rng.random() < 0.5:
+        return f"{day:02}{separator}{month:02}{separator}{year}"
+    return f"{day}{separator}{month}{separator}{year}"
+
+
+def make_amount(rng: random.Random) -> str:
+    "Return an amount in one of the formats found in bbc's."
+    amount = rng.choice(['2.168,00', '2168', '1 084,00', '2,168.00', '314,-'])
+    return f"€{rng.choice(['', ' '])}{amount}"
+
+
+def make_text(
+    rng: random.Random,
+    n_lines: int = 40,
+    achternaam: str|None = None,
+    geboortedatum: datetime|None = None,
+) -> str:
+    """Return the text of a synthetic bbc with `n_lines` lines of noise, for
+    the student `achternaam` born on `geboortedatum` (random if None). If
+    `geboortedatum` is given, the other dates in the text are later dates (of
+    payment or signing), as in real bbc's."""
+    institutes = CONFIG['parser']['institutes']
+    lines = [
+        'Bewijs  betaald   collegegeld',
+        f"{rng.choice(institutes)} verklaart hierbij dat",
+        f"{rng.choice('ABCDEJKLMPS')}. {achternaam or rng.choice(SURNAMES)}",
+        f"geboren op {make_date(rng, geboortedatum)}",
+        f"het collegegeld van {make_amount(rng)} heeft voldaan",
+    ]
+    for _ in range(n_lines):
+        words = rng.choices(WORDS, k=rng.randint(3, 12))
+        if rng.random() < 0.1 and geboortedatum is None:
+            words.append(make_date(rng))
+        elif rng.random() < 0.1:
+            words.append(make_date(rng, datetime(2021, rng.randint(1, 12), rng.randint(1, 28))))
+        if rng.random() < 0.05:
+            words.append(make_amount(rng))
+        lines.append('   '.join(words) if rng.random() < 0.2 else ' '.join(words))
+    rng.shuffle(lines[3:])
+    return '\n'.join(lines)
+
+
+def make_texts(n: int, seed: int = 0) -> list[str]:
+    "Return `n` synthetic bbc texts."
+    rng = random.Random(seed)
+    return [make_text(rng) for _ in range(n)]
+
+
+OPLEIDINGEN = ['B Wiskunde', 'B Rechten', 'M Geowetenschappen', 'UCU', 'GST', 'B Taalwetenschap']
+AGGREGATEN_2 = [None, None, 'UCU', 'UCR', 'Liberal Arts']
+AGGREGATEN_1 = [None, 'BETA', 'GEO', 'GW', 'REBO', 'SW', 'Onbekend']
+FACULTEITEN = ['BETA', 'GEO', 'GW', 'REBO', 'SW', 'GNK', 'DGK', 'XX']
+
+OUTCOMES = {
+    'no_attachments': 5,
+    'no_pdfs': 5,
+    'not_parsed': 5,
+    'no_date': 5,
+    'no_candidates': 5,
+    'not_matched': 10,
+    'matched': 50,
+    'two_pdfs': 5,
+    'two_students': 5,
+    'two_sinh_ids': 5,
+}
+
+
+def make_sinh(rng: random.Random, studentnummer: str, sinh_id: int) -> dict:
+    "Return a random enrolment record."
+    return dict(
+        studentnummer = studentnummer,
+        sinh_id = sinh_id,
+        achternaam = rng.choice(SURNAMES),
+        soort_inschrijving = rng.choice(['S', 'D', 'D']),
+        opleiding = rng.choice(OPLEIDINGEN),
+        aggregaat_2 = rng.choice(AGGREGATEN_2),
+        aggregaat_1 = rng.choice(AGGREGATEN_1),
+        faculteit = rng.choice(FACULTEITEN),
+    )
+
+
+def make_pdf_records(rng: random.Random, attachment_id: str, outcome: str) -> list[dict]:
+    "Return the records the parser creates for a pdf with `outcome`."
+    record = dict(
+        attachment_id = attachment_id,
+        attachment_name = 'bbc.pdf',
+        attachment_size = rng.randint(10_000, 500_000),
+        is_pdf = True,
+        tier = rng.choice(['fast', 'full']),
+        is_parsed = outcome != 'not_parsed',
+    )
+    if outcome == 'not_parsed':
+        return [record]
+    record['n_dates_found'] = 0 if outcome == 'no_date' else rng.randint(1, 4)
+    if outcome == 'no_date':
+        return [record]
+    record['search_date'] = pd.Timestamp(2000, 1, 1) + pd.Timedelta(days=rng.randint(0, 3650))
+    record['has_candidates'] = outcome != 'no_candidates'
+    if outcome == 'no_candidates':
+        return [record]
+    record['found_student'] = outcome != 'not_matched'
+    if outcome == 'not_matched':
+        return [record]
+
+    studentnummer = f"{rng.randint(1_000_000, 9_999_999)}"
+    sinhs = [make_sinh(rng, studentnummer, rng.randint(1, 10**9))]
+    if outcome == 'two_sinh_ids':
+        sinhs.append(make_sinh(rng, studentnummer, rng.randint(1, 10**9)))
+    if outcome == 'two_students':
+        sinhs.append(make_sinh(rng, f"{rng.randint(1_000_000, 9_999_999)}", rng.randint(1, 10**9)))
+    record['n_sinh'] = len(sinhs)
+    return [record | sinh for sinh in sinhs]
+
+
+def make_records(n: int, seed: int = 0) -> pd.DataFrame:
+    """Return the parsed records of `n` random messages, as created by
+    `parser.parse_all_messages`."""
+    rng = random.Random(seed)
+    outcomes, weights = zip(*OUTCOMES.items())
+    records = []
+    for i in range(n):
+        outcome = rng.choices(outcomes, weights)[0]
+        message = dict(
+            datum_ontvangst = f"2021-08-{rng.randint(1, 31):02} 12h00m00s",
+            object_id = f"msg-{i}",
+            folder_id = 'to_process',
+            zender = 'bbc@instelling.nl',
+            flag = None,
+            is_read = rng.random() < 0.5,
+            onderwerp = 'bbc',
+            has_attachments = outcome != 'no_attachments',
+        )
+        if outcome == 'no_attachments':
+            records.append(message)
+            continue
+        attachments = []
+        if outcome == 'no_pdfs' or rng.random() < 0.2:
+            attachments.append(dict(
+                attachment_id = f"att-{i}-logo",
+                attachment_name = 'logo.png',
+                attachment_size = rng.randint(1_000, 50_000),
+                is_pdf = False,
+            ))
+        if outcome == 'two_pdfs':
+            attachments.extend(make_pdf_records(rng, f"att-{i}-1", 'matched'))
+            attachments.extend(make_pdf_records(rng, f"att-{i}-2", 'not_matched'))
+        elif outcome != 'no_pdfs':
+            attachments.extend(make_pdf_records(rng, f"att-{i}", outcome))
+        records.extend(message | attachment for attachment in attachments)
+    return pd.DataFrame(records)
+
+
+PARSE_OUTCOMES = {
+    'no_attachments': 5,
+    'no_pdfs': 5,
+    'no_date': 10,
+    'not_matched': 20,
+    'matched': 60,
+}
+
+
+def make_kandidaten(rng: random.Random, n_dates: int, per_date: int = 20) -> dict:
+    "Return candidates (enrolment records) for `n_dates` random birth dates."
+    kandidaten = {}
+    for i in range(n_dates):
+        date = pd.Timestamp(2000, 1, 1) + pd.Timedelta(days=i)
+        records = [
+            make_sinh(rng, f"{rng.randint(1_000_000, 9_999_999)}", rng.randint(1, 10**9))
+            for _ in range(per_date)
+        ]
+        kandidaten[date] = pd.DataFrame(records).assign(
+            geboortedatum = date,
+            instelling_sinh = 'UU',
+            examentype = rng.choice(['B', 'M']),
+        )
+    return kandidaten
+
+
+def make_parse_inputs(n: int, seed: int = 0, n_dates: int = 500) -> tuple:
+    """Return `n` random messages, their attachments by object_id, the
+    extracted features by (object_id, attachment_id) and the candidates by
+    birth date: the input of `parser.build_records`."""
+    rng = random.Random(seed)
+    kandidaten = make_kandidaten(rng, n_dates)
+    dates = list(kandidaten)
+    institutes = CONFIG['parser']['institutes']
+    outcomes, weights = zip(*PARSE_OUTCOMES.items())
+    messages, message_attachments, extracted = [], {}, {}
+    for i in range(n):
+        outcome = rng.choices(outcomes, weights)[0]
+        message = SimpleNamespace(
+            object_id = f"msg-{i}",
+            received = datetime(2021, 8, rng.randint(1, 31), 12),
+            folder_id = 'to_process',
+            sender = 'bbc@instelling.nl',
+            flag = {'flag_status': 'notFlagged'},
+            is_read = rng.random() < 0.5,
+            subject = f"bbc {i}",
+            has_attachments = outcome != 'no_attachments',
+        )
+        messages.append(message)
+        attachments = []
+        if outcome == 'no_pdfs' or rng.random() < 0.2:
+            attachments.append(Attachment(f"att-{i}-logo", 'logo.png', None, rng.randint(1_000, 50_000)))
+        if outcome not in ['no_attachments', 'no_pdfs']:
+            attachment = Attachment(f"att-{i}", 'bbc.pdf', None, rng.randint(10_000, 500_000))
+            attachments.append(attachment)
+            date = rng.choice(dates)
+            names = rng.sample(SURNAMES, 3)
+            if outcome == 'matched':
+                names.append(rng.choice(kandidaten[date].achternaam.tolist()))
+            features = {
+                'tier': 'fast',
+                'is_parsed': True,
+                'instelling': frozenset([rng.choice(institutes)]),
+                'bedrag': frozenset([make_amount(rng)]),
+                'n_dates_found': 0 if outcome == 'no_date' else 1,
+            }
+            if outcome != 'no_date':
+                features['search_date'] = date
+            text = ' '.join(rng.choices(WORDS, k=20) + names)
+            extracted[(message.object_id, attachment.attachment_id)] = (text, features)
+        message_attachments[message.object_id] = attachments
+    return messages, message_attachments, extracted, kandidaten
+
+
+def make_population(n_dates: int, per_date: int = 3, seed: int = 0) -> pd.DataFrame:
+    """Return a population with `per_date` enrolment records for each of
+    `n_dates` random birth dates, with the columns of the candidate query."""
+    rng = random.Random(seed)
+    dates = rng.sample(list(pd.date_range('1995-01-01', '2005-12-31')), n_dates)
+    records = []
+    for date in dates:
+        for _ in range(per_date):
+            studentnummer = f"{rng.randint(1_000_000, 9_999_999)}"
+            records.append(make_sinh(rng, studentnummer, rng.randint(1, 10**9)) | dict(
+                voorletters = rng.choice('ABCDEJKLMPS') + '.',
+                voorvoegsels = rng.choice([None, None, 'de', 'van', 'van der']),
+                geboortedatum = date,
+                croho = f"{rng.randint(50_000, 70_000)}",
+                actiefcode = rng.choice(['A', 'I']),
+                datum_actiefcode = date + pd.Timedelta(days=6_000),
+                inschrijvingstatus = rng.choice(['I', 'V', 'S']),
+                datum_verzoek = pd.Timestamp(2021, 5, 1) + pd.Timedelta(days=rng.randint(0, 90)),
+                datum_intrekking = None,
+                ingangsdatum = pd.Timestamp(2021, 9, 1),
+                afloopdatum = pd.Timestamp(2022, 8, 31),
+                examentype = rng.choice(['B', 'M']),
+            ))
+    return pd.DataFrame(records)
+
+
+MAILBOX_OUTCOMES = {
+    'no_attachments': 3,
+    'noise_only': 3,
+    'unreadable': 2,
+    'unknown_student': 10,
+    'two_pdfs': 4,
+    'matched': 78,
+}
+
+
+def make_bbc(rng: random.Random, population: pd.DataFrame, known: bool = True) -> bytes:
+    """Return a synthetic bbc pdf of a student in `population` (or of an
+    unknown student) with one to three pages."""
+    if known:
+        student = population.iloc[rng.randrange(len(population))]
+        achternaam, geboortedatum = student.achternaam, student.geboortedatum
+    else:
+        achternaam, geboortedatum = 'Onbekend', None
+    pages = [make_text(rng, n_lines=rng.randint(10, 40), achternaam=achternaam, geboortedatum=geboortedatum)]
+    for _ in range(rng.choice([0, 0, 0, 1, 2])):
+        pages.append('\n'.join(
+            ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))
+            for _ in range(rng.randint(10, 40))
+        ))
+    # the pdf font has no glyphs outside cp1252 (like in some scanned bbc's)
+    return make_pdf(*[page.encode('cp1252', 'replace').decode('cp1252') for page in pages])
+
+
+def make_mailbox(n: int, population: pd.DataFrame, seed: int = 0) -> InMemoryMailbox:
+    """Return an in-memory mailbox with `n` random messages in the 'to_process'
+    folder: bbc's of students in `population` (possibly with a logo), of
+    unknown students, messages with two bbc's, with only a logo, with an
+    unreadable pdf or without attachments."""
+    rng = random.Random(seed)
+    logo = b'\x89PNG' + rng.randbytes(2_000)
+    outcomes, weights = zip(*MAILBOX_OUTCOMES.items())
+    mailbox = InMemoryMailbox()
+    for i in range(n):
+        outcome = rng.choices(outcomes, weights)[0]
+        attachments = []
+        if outcome == 'noise_only' or rng.random() < 0.2:
+            attachments.append(FakeAttachment(f"att-{i}-logo", 'logo.png', logo))
+        if outcome == 'unreadable':
+            attachments.append(FakeAttachment(f"att-{i}", 'scan.pdf', rng.randbytes(5_000)))
+        if outcome in ['matched', 'unknown_student', 'two_pdfs']:
+            doc = make_bbc(rng, population, known=outcome != 'unknown_student')
+            attachments.append(FakeAttachment(f"att-{i}", 'bbc.pdf', doc))
+        if outcome == 'two_pdfs':
+            attachments.append(FakeAttachment(f"att-{i}-2", 'bbc.pdf', make_bbc(rng, population)))
+        mailbox.add_message(
+            f"msg-{i}",
+            attachments,
+            subject = f"bbc {i}",
+            received = datetime(2021, 8, rng.randint(1, 31), rng.randint(8, 17)),
+        )
+    return mailbox
@@ -0,0 +1,162 @@
+"""daemon bbc_forwarder
+====================
+
+This script runs the bbc forwarding routine (see `script_bbc_forwarder`) as a
+long-running process instead of on a schedule:
+
+1. Every `interval_seconds` the ids of the messages in the 'to_process' folder
+are listed. If it contains a message that was not seen before (not in an
+earlier run of the daemon, nor in the state of the parser in incremental mode),
+the messages are parsed and processed. Unmatched bbc's stay in the folder, so
+they do not start a run on every check. Messages that left the folder are
+forgotten.
+2. Every `full_run_minutes` (and at the start of the daemon) the messages are
+processed even if there are no new messages, so unmatched bbc's are retried
+and interrupted messages (see `bbc_forwarder.journal`) are resumed.
+3. Once a day, at `report_time`, the logs of all runs since the last log report
+are sent in one report (if 'send_log_report' is set to True in config). The
+logs and the metrics (see `bbc_forwarder.metrics`) of every run are stored in
+the log store (see `bbc_forwarder.logstore`), and so is the date of the last
+report. A restarted daemon therefore neither sends the report of a day twice
+nor loses the runs before the restart. The daemon needs a configured log
+store.
+
+The account, the resolved folders, the OSIRIS client, the compiled regular
+expressions, the templates and the parser caches stay loaded between runs, so
+a bbc is handled within one interval. The population snapshot (snapshot mode)
+is opened again before every run, so it is refreshed when it is older than
+`max_age_minutes`.
+
+The settings in config.json are read again before every check. If killswitch
+is set to True, the daemon keeps running but does not process messages until
+it is set to False again. Errors during a run are printed and the daemon
+continues with the next check. Stop the daemon with ctrl+c.
+
+Change notifications (webhook subscriptions) of Microsoft Graph need a public
+https endpoint, so the daemon polls the folder instead.
+
+The daemon is configured in `CONFIG['forwarder']['daemon']`:
+
+- interval_seconds : seconds between checks of the 'to_process' folder
+- full_run_minutes : minutes between runs without new messages
+- report_time : time of the daily log report (HH:MM)
+"""
+
+import time
+import traceback
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+import script_bbc_forwarder as script
+from bbc_forwarder.config import CONFIG, PATH, read_json_from_path
+from bbc_forwarder import logstore, mailbox, parser
+from bbc_forwarder.metrics import METRICS, Metrics
+
+
+def read_settings() -> dict:
+    """Read the settings from config.json again and update
+    `CONFIG['forwarder']['settings']` with them."""
+    settings = read_json_from_path(PATH / "config.json")['forwarder']['settings']
+    CONFIG['forwarder']['settings'].update(settings)
+    return CONFIG['forwarder']['settings']
+
+
+def list_ids() -> set[str]:
+    "Return the object_ids of the messages in the 'to_process' folder (only the ids are listed)."
+    folder = mailbox.get_workspace().get_folder('to_process')
+    query = folder.new_query().select('id')
+    return {message.object_id for message in folder.get_messages(limit=None, query=query, batch=999)}
+
+
+def get_new_messages(ids: set[str], seen: set[str]) -> set[str]:
+    """Return the object_ids in `ids` (the 'to_process' folder) that are not in
+    `seen` (the messages of earlier runs of the daemon) and not in the state of
+    the parser (incremental mode)."""
+    state = parser.get_state()
+    known = seen if state is None else seen | set(state.messages)
+    return ids - known
+
+
+def reload_snapshot() -> None:
+    "Open the population snapshot again in the next run (refreshed if it is too old)."
+    parser.get_snapshot.cache_clear()
+    return None
+
+
+def is_full_run_due(now: datetime, full_run_minutes: float, last_run: datetime|None) -> bool:
+    "Return if the messages should be processed at `now` without new messages."
+    return last_run is None or now - last_run >= timedelta(minutes=full_run_minutes)
+
+
+def is_report_due(now: datetime, report_time: str, last_report: date|None) -> bool:
+    "Return if the log report of today should be sent at `now`."
+    hour, minute = map(int, report_time.split(':'))
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return now >= scheduled and last_report != now.date()
+
+
+def send_report(store: logstore.LogStore, report_date: date, send: bool) -> None:
+    """Send the log report of the runs since the last report (if `send` and
+    there are runs) and record it as the report of `report_date` in `store`."""
+    logs = store.unreported()
+    if send and not logs.empty:
+        metrics = Metrics()
+        for exported in store.unreported_metrics():
+            metrics.merge(exported)
+        script.send_log_report(logs, metrics)
+    store.mark_reported(report_date)
+    return None
+
+
+def main(
+    max_checks: int|None = None,
+    sleep: Callable[[float], None] = time.sleep,
+    now: Callable[[], datetime] = datetime.now,
+) -> None:
+    """Check the 'to_process' folder every interval and process its messages.
+    Stops after `max_checks` checks (runs until interrupted if None)."""
+    settings = CONFIG['forwarder'].get('daemon', {})
+    interval = settings.get('interval_seconds', 60)
+    report_time = settings.get('report_time', '17:00')
+    full_run_minutes = settings.get('full_run_minutes', 60)
+
+    store = logstore.get_store()
+    if store is None:
+        raise ValueError("the daemon needs a log store (see CONFIG['forwarder']['logstore'])")
+    script.install_throttle()
+    seen = set()
+    last_run = None
+    checks = 0
+    while max_checks is None or checks < max_checks:
+        checks += 1
+        current = now()
+        try:
+            settings = read_settings()
+            if not settings['killswitch']:
+                ids = list_ids()
+                seen &= ids
+                new_messages = get_new_messages(ids, seen)
+                if new_messages or is_full_run_due(current, full_run_minutes, last_run):
+                    reload_snapshot()
+                    last_run = current
+                    METRICS.reset()
+                    try:
+                        run_logs = script.run(send_report=False, test_run=settings['test_run'])
+                    finally:
+                        store.append_metrics(METRICS.export())
+                    seen |= new_messages
+                    if 'object_id' in run_logs:
+                        seen.update(run_logs.object_id.dropna().astype(str))
+            if is_report_due(current, report_time, store.last_report()):
+                send_report(store, current.date(), settings['send_log_report'])
+        except Exception:
+            traceback.print_exc()
+        sleep(interval)
+    return None
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        print('bbc-forwarder daemon stopped')
@@ -4,80 +4,306 @@
 This script will run the complete bbc forwarding routine:
 
 1. Parse all emails in the 'to_process' folder
-2. Create a report and send logs to 'logs' folder (if 'send_log_report' is set
-to True in config)
-3. Process all messages:
+2. Process all messages:
     - Forward to faculty if record pertains to decentral enrolment application.
     - Send to csa mailbox if record pertains to central enrolment application.
     - Send to csa mailbox if record contains an issue.
+    - Archive duplicates of bbc's that were already forwarded (see
+    `bbc_forwarder.duplicates`).
+    Messages are processed concurrently, all requests to the mailbox share one
+    rate limit (see `bbc_forwarder.engine`).
+3. Create a report and send logs to 'logs' folder (if 'send_log_report' is set
+to True in config), also if processing stopped with an error
+
+Messages of which the processing was interrupted in an earlier run (a crash
+after the message was sent, but before it was archived) are finished first,
+without parsing and forwarding them again (see `bbc_forwarder.journal`).
+
+If streaming is enabled in config, the messages are parsed and processed in
+pages (see `bbc_forwarder.pipeline`).
+
+The log report contains the time per stage of the run (see
+`bbc_forwarder.metrics`), which is also stored as json lines next to the logs.
+
+The logs of every run are appended to the log store (see
+`bbc_forwarder.logstore`). The Excel file attached to the log report is
+exported from the store (if 'excel' is set in config).
 
 If killswitch is set to True in config, the script will not run.
 """
 
+import traceback
 from datetime import date
 
 import pandas as pd
 
 from bbc_forwarder.config import CONFIG, PATH
-from bbc_forwarder.mailbox import WORKSPACE, FOLDER_IDS
-from bbc_forwarder.templates import ENV, SUBJECTS
-from bbc_forwarder import parser, dataset, forwarder
+from bbc_forwarder.metrics import METRICS, Metrics
+from bbc_forwarder.templates import SUBJECTS, get_template
+from bbc_forwarder import (
+    mailbox, parser, dataset, forwarder, attachments, engine, pipeline, logstore, journal,
+    duplicates,
+)
 
 
 def process_messages(
     template: str,
     logs: pd.DataFrame,
+    messages: dict,
     test_run: bool=False,
 ) -> None:
-    for message_id in logs.object_id.unique():
-        forwarder.process_message(message_id, template, logs, test_run=test_run)
+    """Process the messages in `logs` concurrently (see the `engine` module).
+    `messages` is the index of message objects (by object_id) that were fetched
+    for parsing."""
+    jobs = [
+        (messages[message_id], template, message_logs)
+        for message_id, message_logs in logs.groupby('object_id', sort=False)
+    ]
+    engine.run(
+        forwarder.process_message,
+        jobs,
+        workers = CONFIG['forwarder'].get('engine', {}).get('workers', 1),
+        test_run = test_run,
+    )
     return None
 
 
-def send_log_report(logs) -> None:
+def archive_duplicates(logs: pd.DataFrame, messages: dict, test_run: bool=False) -> None:
+    """Archive the duplicates in `logs` without forwarding them (see
+    `bbc_forwarder.duplicates`). A duplicate of which the original was not
+    forwarded (a message in the same run that was not forwarded) is left in
+    the folder."""
+    if 'soort' not in logs:
+        return None
+    registry = duplicates.get_registry()
+    copies = logs.loc[logs.soort == 'duplicate']
+    jobs = [
+        (messages[message_id], message_logs)
+        for message_id, message_logs in copies.groupby('object_id', sort=False)
+        if test_run or registry is None or duplicates.is_forwarded(registry, message_logs)
+    ]
+    engine.run(
+        forwarder.archive_message,
+        jobs,
+        workers = CONFIG['forwarder'].get('engine', {}).get('workers', 1),
+        test_run = test_run,
+    )
+    return None
+
+
+def process_tasks(logs: pd.DataFrame, messages: dict, test_run: bool=False) -> None:
+    """Process the messages in `logs` for every task (template and queries) in
+    config and archive the duplicates."""
+    tasks = CONFIG['forwarder']['tasks']
+    for template, queries in tasks.items():
+        for query in queries:
+            df = logs.query(query)
+            process_messages(template, df, messages, test_run=test_run)
+    archive_duplicates(logs, messages, test_run=test_run)
+    return None
+
+
+def resume_messages(messages: dict, test_run: bool=False) -> dict:
+    """Finish the messages in `messages` (by object_id) of which the processing
+    was interrupted in an earlier run and return the messages that still have
+    to be parsed and processed. Interrupted messages that are no longer in the
+    folder are removed from the journal.
+
+    A message that can not be resumed is not processed again (it may already
+    have been forwarded): it is moved to the 'issue' folder and removed from
+    the journal. If it can not be moved either, it stays in the journal and is
+    resumed in the next run."""
+    store = journal.get_journal()
+    if store is None or test_run:
+        return messages
+    messages = dict(messages)
+    for object_id in store.pending():
+        message = messages.get(object_id)
+        entry = store.entry(object_id)
+        if message is None:
+            entry.clear()
+            continue
+        try:
+            resumed = forwarder.resume_message(message, entry)
+        except Exception as error:
+            del messages[object_id]
+            try:
+                message.move(mailbox.FOLDER_IDS['issue'])
+            except Exception:
+                print(
+                    "\nHERVATTEN MISLUKT :\n"
+                    f"Resuming message {object_id} failed ({error!r}), "
+                    "it is resumed again in the next run."
+                )
+                continue
+            entry.clear()
+            print(
+                "\nHERVATTEN MISLUKT :\n"
+                f"Resuming message {object_id} failed ({error!r}), "
+                "it was moved to the 'issue' folder."
+            )
+            continue
+        if resumed:
+            del messages[object_id]
+    return messages
+
+
+def get_pending_messages(folder) -> dict:
+    """Return the messages in `folder` (by object_id) of which the processing
+    was interrupted in an earlier run (see `resume_messages`). Used when the
+    folder is listed in pages, so they are resumed before the first page."""
+    store = journal.get_journal()
+    if store is None:
+        return {}
+    import requests
+
+    messages = {}
+    query = folder.new_query().select(*parser.LISTING_FIELDS)
+    for object_id in store.pending():
+        try:
+            message = folder.get_message(object_id, query=query)
+        except requests.HTTPError as error:
+            if not forwarder.is_not_found(error):
+                raise
+            continue
+        if message is not None and message.folder_id == folder.folder_id:
+            messages[object_id] = message
+    return messages
+
+
+def send_log_report(logs, metrics: Metrics = METRICS) -> None:
+    """Send the log report of `logs` with the time per stage in `metrics`
+    (default the metrics of this process)."""
     # get data
     today = str(date.today())
     n_records = logs.object_id.nunique()
     per_soort = logs.pipe(forwarder.get_stats, 'soort')
     issues = logs.query("soort == 'issue'").pipe(forwarder.get_stats, 'status')
+    per_tier = forwarder.get_tier_stats(logs)
+    summary = metrics.summary()
 
-    # store logs and keep filename
+    # export logs (of all runs of today) and store metrics
     filename = PATH / f"logs/{today}.logs.bbc_forwarder.xlsx"
-    logs.to_excel(filename)
+    store = logstore.get_store()
+    settings = CONFIG['forwarder'].get('logstore') or {}
+    if store is None:
+        logs.to_excel(filename)
+    elif settings.get('excel'):
+        store.export_excel(filename, run_date=today)
+    else:
+        filename = None
+    metrics.write(PATH / f"logs/{today}.metrics.bbc_forwarder.jsonl")
 
     # create subject and body from templates
     subject = SUBJECTS['logs'].substitute(date=today, nrecords=n_records)
-    template = ENV.get_template('template.logs.jinja.html')
+    template = get_template('template.logs.jinja.html')
     body = template.render(
         n_records = n_records,
         per_soort = per_soort,
         issues = issues,
+        per_tier = per_tier,
+        metrics = summary,
         today = today,
     )
 
     # create and send message
-    msg = WORKSPACE.get_folder(folder_id=FOLDER_IDS['logs']).new_message()
+    msg = mailbox.get_workspace().get_folder('logs').new_message()
     msg.subject = subject
     msg.body = body
-    msg.attachments.add(filename)
+    if filename is not None:
+        msg.attachments.add(filename)
     msg.to.add(CONFIG['forwarder']['address']['csa'])
     msg.send()
     return None
 
 
-if __name__ == '__main__' and not CONFIG['forwarder']['settings']['killswitch']:
-    # create and send logs
-    folder = WORKSPACE.get_folder(folder_id=FOLDER_IDS['to_process'])
-    messages = folder.get_messages(limit=None)
-    parsed_messages = parser.parse_all_messages(messages)
+def install_throttle() -> None:
+    "Send all requests to the mailbox through the shared throttle."
+    throttle = engine.Throttle.from_config(CONFIG['forwarder'].get('engine', {}))
+    throttle.install(mailbox.MAILBOX.con)
+    return None
+
+
+def store_logs(logs: pd.DataFrame) -> None:
+    "Append the logs of the run to the log store (if configured)."
+    store = logstore.get_store()
+    if store is not None:
+        store.append(logs)
+    return None
+
+
+def finish_run(logs: pd.DataFrame, store: bool, send_report: bool, failed: bool) -> None:
+    """Store `logs` in the log store (if `store`), send the log report (if
+    `send_report`) and remove the downloaded attachments. If the processing
+    `failed`, an error while storing or reporting is printed instead of raised,
+    so it does not replace the error of the processing."""
+    try:
+        if store:
+            store_logs(logs)
+        if send_report:
+            send_log_report(logs)
+    except Exception:
+        if not failed:
+            raise
+        print(
+            "\nRAPPORTAGE MISLUKT :\n"
+            "Storing or reporting the logs failed after the processing failed:"
+        )
+        traceback.print_exc()
+    finally:
+        attachments.clear(parser.get_download_folder())
+    return None
+
+
+def run(send_report: bool=True, test_run: bool=False) -> pd.DataFrame:
+    """Parse and process all messages in the 'to_process' folder and return the
+    logs. The logs are appended to the log store. If `send_report` is True the
+    log report is sent."""
+    folder = mailbox.get_workspace().get_folder('to_process')
+    streaming = CONFIG['forwarder'].get('streaming', {})
+
+    if streaming.get('enabled'):
+        # list, parse and process messages page by page, then send logs
+        page_size = streaming.get('page_size', 100)
+        pending = {} if test_run else get_pending_messages(folder)
+        resumed = set(pending) - set(resume_messages(pending, test_run=test_run))
+        summaries = []
+        failed = True
+        try:
+            for summary in pipeline.stream(
+                parser.list_pages(folder, page_size, exclude=resumed),
+                lambda page_logs, page: process_tasks(page_logs, page, test_run=test_run),
+            ):
+                summaries.append(summary)
+            failed = False
+        finally:
+            # also store and report the pages that were processed before an error
+            logs = pipeline.combine(summaries)
+            finish_run(logs, store=True, send_report=send_report, failed=failed)
+        return logs
+
+    # parse messages
+    messages = {message.object_id:message for message in parser.list_messages(folder)}
+    messages = resume_messages(messages, test_run=test_run)
+    parsed_messages = parser.parse_all_messages(messages.values())
     logs = dataset.create_dataset(parsed_messages)
-    if CONFIG['forwarder']['settings']['send_log_report']:
-        send_log_report(logs)
+    store_logs(logs)
 
     # process messages
-    test_run = CONFIG['forwarder']['settings']['test_run']
-    tasks = CONFIG['forwarder']['tasks']
-    for template, queries in tasks.items():
-        for query in queries:
-            df = logs.query(query)
-            process_messages(template, df, test_run=test_run)
\ No newline at end of file
+    failed = True
+    try:
+        process_tasks(logs, messages, test_run=test_run)
+        failed = False
+    finally:
+        # send logs (after processing, so the metrics include the forwarding,
+        # also if processing stopped with an error)
+        finish_run(logs, store=False, send_report=send_report, failed=failed)
+    return logs
+
+
+if __name__ == '__main__' and not CONFIG['forwarder']['settings']['killswitch']:
+    install_throttle()
+    run(
+        send_report = CONFIG['forwarder']['settings']['send_log_report'],
+        test_run = CONFIG['forwarder']['settings']['test_run'],
+    )
@@ -0,0 +1,467 @@
+"""fakes module
+============
+
+Offline stand-ins for the objects the bbc-forwarder normally gets from the
+mailbox (O365 messages and attachments) and from OSIRIS, together with a
+minimal pdf writer, so that the parser can be tested without network access.
+`FakeMailboxServer` is a local http server with latency and throttling for
+testing the forwarding engine.
+"""
+
+import datetime as dt
+import http.server
+import re
+import threading
+import time
+import types
+import urllib.parse
+
+import pandas as pd
+import requests
+
+
+def escape(line: str) -> str:
+    "Escape characters with a special meaning in pdf strings."
+    return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(*pages: str) -> bytes:
+    """Return a minimal pdf document with one page per item in `pages`. Every
+    line of text in a page is written as a separate line in Helvetica."""
+    n_pages = len(pages)
+    font_id = 3 + 2 * n_pages
+    page_ids = [3 + 2 * i for i in range(n_pages)]
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: (
+            f"<< /Type /Pages /Count {n_pages} "
+            f"/Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] >>"
+        ).encode(),
+        font_id: (
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+            b"/Encoding /WinAnsiEncoding >>"
+        ),
+    }
+    for page_id, page in zip(page_ids, pages):
+        lines = [f"({escape(line)}) Tj T*" for line in page.splitlines()]
+        stream = "\n".join(['BT /F1 11 Tf 14 TL 50 780 Td', *lines, 'ET'])
+        stream = stream.encode('cp1252')
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> "
+            f"/Contents {page_id + 1} 0 R >>"
+        ).encode()
+        objects[page_id + 1] = (
+            f"<< /Length {len(stream)} >>\nstream\n".encode()
+            + stream
+            + b"\nendstream"
+        )
+
+    doc = b"%PDF-1.4\n"
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(doc)
+        doc += f"{object_id} 0 obj\n".encode() + objects[object_id] + b"\nendobj\n"
+    xref = len(doc)
+    size = max(objects) + 1
+    doc += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for object_id in range(1, size):
+        doc += f"{offsets[object_id]:010d} 00000 n \n".encode()
+    doc += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return doc
+
+
+class FakeAttachment:
+    "Stand-in for an attachment of a message in the mailbox."
+    def __init__(self, attachment_id: str, name: str, doc: bytes):
+        self.attachment_id = attachment_id
+        self.name = name
+        self.doc = doc
+        self.size = len(doc)
+        self.content_type = (
+            'application/pdf' if name.lower().endswith('.pdf')
+            else 'application/octet-stream'
+        )
+
+
+class FakeResponse:
+    "Stand-in for `requests.Response`."
+    def __init__(self, data: dict|None = None, content: bytes = b''):
+        self.data = data
+        self.content = content
+
+    def json(self) -> dict:
+        return self.data
+
+    def iter_content(self, chunk_size: int = 1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i+chunk_size]
+
+
+class FakeConnection:
+    """Stand-in for `O365.connection.Connection`. Answers the requests for the
+    attachments of one message and keeps the requested urls."""
+    def __init__(self, attachments):
+        self.attachments = {i.attachment_id:i for i in attachments}
+        self.requests = []
+
+    @property
+    def n_downloads(self) -> int:
+        return sum(url.endswith('/$value') for url in self.requests)
+
+    def get(self, url, params=None, **kwargs) -> FakeResponse:
+        self.requests.append(url)
+        parts = url.split('/')
+        if parts[-1] == '$value':
+            return FakeResponse(content=self.attachments[parts[-2]].doc)
+        return FakeResponse(data={'value': [
+            {
+                'id': i.attachment_id,
+                'name': i.name,
+                'size': i.size,
+                'contentType': i.content_type,
+            }
+            for i in self.attachments.values()
+        ]})
+
+
+class FakeMessage:
+    "Stand-in for `O365.message.Message`."
+    def __init__(self, object_id: str, attachments=(), subject='bbc'):
+        self.object_id = object_id
+        self.folder_id = 'to_process'
+        self.received = dt.datetime(2021, 8, 1, 12, 0, 0)
+        self.sender = 'bbc@instelling.nl'
+        self.flag = None
+        self.is_read = False
+        self.subject = subject
+        self.attachments = list(attachments)
+        self.con = FakeConnection(attachments)
+        self.has_attachments = bool(attachments)
+
+    def build_url(self, endpoint: str) -> str:
+        return endpoint
+
+
+BBC = """Bewijs betaald collegegeld
+Universiteit Leiden verklaart dat
+{naam}, geboren op {geboortedatum},
+voor het collegejaar 2021-2022 het wettelijk collegegeld
+van € 2.168,00 heeft betaald.
+Leiden, 1 juli 2021"""
+
+
+def make_messages() -> list[FakeMessage]:
+    "Return a small set of messages covering the different parse outcomes."
+    bbc = make_pdf(BBC.format(naam='J. de Vries', geboortedatum='3 maart 2001'))
+    other = make_pdf(BBC.format(naam='P. Bakker', geboortedatum='12-11-2000'))
+    no_dates = make_pdf("Bewijs betaald collegegeld\nzonder geboortedatum")
+    return [
+        FakeMessage('msg-1', [FakeAttachment('att-1', 'bbc.pdf', bbc)]),
+        FakeMessage('msg-2'),
+        FakeMessage('msg-3', [
+            FakeAttachment('att-2', 'logo.png', b'not a pdf'),
+            FakeAttachment('att-3', 'bbc.PDF', other),
+        ]),
+        FakeMessage('msg-4', [FakeAttachment('att-4', 'scan.pdf', b'garbage')]),
+        FakeMessage('msg-5', [FakeAttachment('att-5', 'bbc.pdf', no_dates)]),
+    ]
+
+
+POPULATION = pd.DataFrame({
+    'studentnummer': ['1234567', '7654321', '1111111'],
+    'achternaam': ['Vries', 'Bakker', 'Smit'],
+    'geboortedatum': pd.to_datetime(['2001-03-03', '2000-11-12', '2001-03-03']),
+    'sinh_id': [1, 2, 3],
+})
+
+
+class FakeOsiris:
+    """Stand-in for the `query.osiris` module. Answers the candidate queries of
+    the parser from `population` and counts the number of queries. Queries
+    without birth dates return the complete population."""
+    def __init__(self, population: pd.DataFrame = POPULATION):
+        self.population = population
+        self.n_queries = 0
+
+    def execute_query(self, sql, squeeze=False, **kwargs) -> pd.DataFrame:
+        self.n_queries += 1
+        if 'geboortedata' not in kwargs:
+            return self.population.copy()
+        dates = re.findall(r"date '(\d{4}-\d{2}-\d{2})'", kwargs['geboortedata'])
+        mask = self.population.geboortedatum.isin(pd.to_datetime(dates))
+        return self.population.loc[mask].reset_index(drop=True)
+
+
+class FakeMailboxServer:
+    """Local http server standing in for the Graph api of the mailbox. Every
+    request is answered after `latency` seconds with a json object with a new
+    id (as for a created message).
+    Every `throttle_every`-th request is answered with `throttle_status` and a
+    `Retry-After` header of `retry_after` seconds instead. The retry of a
+    throttled request is not throttled again (unless `throttle_every` is 1).
+    All requests are logged as (start, end, method, path, status) and their
+    bodies as (method, path, body) in `requests`. Upload sessions are answered
+    with an upload url on the server; chunk ranges are kept in `ranges`.
+    Requests of which the path ends with one of `failing` are answered with
+    `failing_status` (default 503, a failure of the mailbox)."""
+    def __init__(
+        self,
+        latency: float = 0.01,
+        throttle_every: int|None = None,
+        throttle_status: int = 429,
+        retry_after: float = 0.1,
+        failing: set[str]|None = None,
+        failing_status: int = 503,
+    ):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.throttle_status = throttle_status
+        self.retry_after = retry_after
+        self.failing = failing or set()
+        self.failing_status = failing_status
+        self.log = []
+        self.requests = []
+        self.ranges = []
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.throttled = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def handle_request(self):
+                start = time.monotonic()
+                with server.lock:
+                    server.n_requests += 1
+                    n = server.n_requests
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length)
+                with server.lock:
+                    server.requests.append((self.command, self.path, data))
+                    if 'Content-Range' in self.headers:
+                        server.ranges.append((self.path, self.headers['Content-Range']))
+                time.sleep(server.latency)
+                with server.lock:
+                    # a retried request is not throttled twice in a row
+                    throttled = (
+                        server.throttle_every
+                        and n % server.throttle_every == 0
+                        and (server.throttle_every == 1 or self.path not in server.throttled)
+                    )
+                    if throttled:
+                        server.throttled.add(self.path)
+                    else:
+                        server.throttled.discard(self.path)
+                status = server.throttle_status if throttled else 200
+                if any(self.path.endswith(path) for path in server.failing):
+                    status = server.failing_status
+                if self.path.endswith('/createUploadSession'):
+                    body = f'{{"uploadUrl": "{server.url}/upload/{n}"}}'.encode()
+                else:
+                    body = f'{{"id": "id-{n}", "isDraft": true}}'.encode()
+                # the request is done before the client can read the response
+                with server.lock:
+                    server.in_flight -= 1
+                self.send_response(status)
+                if throttled:
+                    self.send_header('Retry-After', str(server.retry_after))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server.lock:
+                    server.log.append((start, time.monotonic(), self.command, self.path, status))
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            request_queue_size = 128
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(
+            target = self.httpd.serve_forever,
+            kwargs = {'poll_interval': 0.05},
+            daemon = True,
+        )
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeServerConnection:
+    """Stand-in for `O365.connection.Connection` that sends its requests to a
+    `FakeMailboxServer` (without authentication)."""
+    def __init__(self, url: str):
+        self.url = url
+        self.requests_delay = 200
+        self.request_retries = 3
+        self.session = None
+        self.naive_session = None
+
+    def oauth_request(self, url, method, **kwargs):
+        if self.session is None:
+            self.session = requests.Session()
+        # absolute urls (as built by O365) are sent to the server as well
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+        response = self.session.request(method, self.url + path, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def naive_request(self, url, method, **kwargs):
+        return self.oauth_request(url, method, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.oauth_request(url, 'get', params=params, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'post', json=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'patch', json=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'put', data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.oauth_request(url, 'delete', **kwargs)
+
+
+FOLDER_IDS = {
+    'to_process': 'folder-to_process',
+    'faculteit': 'folder-faculteit',
+    'csa': 'folder-csa',
+    'issue': 'folder-issue',
+    'logs': 'folder-logs',
+    'archived': 'folder-archived',
+}
+
+
+def make_workspace(mailbox=None):
+    """Return a `Workspace` on `mailbox` with the folders in `FOLDER_IDS`
+    already resolved, so nothing is connected or resolved in tests."""
+    from bbc_forwarder.mailbox import Workspace
+    workspace = Workspace(connect=lambda: types.SimpleNamespace(mailbox=lambda: mailbox))
+    workspace._workspace_id = 'folder-workspace'
+    workspace._folder_ids = dict(FOLDER_IDS)
+    return workspace
+
+
+class InMemoryMailbox:
+    """In-memory stand-in for the Graph api of the mailbox, used as connection
+    of real O365 mailbox, folder and message objects (see `box`). Answers the
+    requests of the parser (listing the messages of a folder, listing and
+    downloading attachments) from the messages added with `add_message`, and
+    accepts the requests of the forwarder (drafts, forwards, sends, moves and
+    upload sessions) with a json object with a new id. All requests are kept in
+    `requests` as (method, path)."""
+    def __init__(self):
+        from O365.connection import MSGraphProtocol
+        from O365.mailbox import MailBox
+        self.protocol = MSGraphProtocol()
+        self.box = MailBox(con=self, protocol=self.protocol, main_resource='me')
+        self.messages = {}
+        self.attachments = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.requests_delay = 0
+        self.request_retries = 0
+        self.session = None
+        self.naive_session = None
+
+    def add_message(
+        self,
+        object_id: str,
+        attachments=(),
+        subject: str = 'bbc',
+        folder_id: str = FOLDER_IDS['to_process'],
+        received: dt.datetime = dt.datetime(2021, 8, 1, 12, 0, 0),
+    ) -> dict:
+        "Add a message with `attachments` (`FakeAttachment`) to `folder_id`."
+        self.messages[object_id] = {
+            'id': object_id,
+            'receivedDateTime': f"{received:%Y-%m-%dT%H:%M:%SZ}",
+            'parentFolderId': folder_id,
+            'from': {'emailAddress': {'address': 'bbc@instelling.nl'}},
+            'flag': {'flagStatus': 'notFlagged'},
+            'isRead': False,
+            'subject': subject,
+            'hasAttachments': bool(attachments),
+            'isDraft': False,
+        }
+        self.attachments[object_id] = {i.attachment_id:i for i in attachments}
+        return self.messages[object_id]
+
+    def get_folder(self, folder_id: str = FOLDER_IDS['to_process']):
+        "Return the O365 folder `folder_id`."
+        return self.box.folder_constructor(
+            parent = self.box,
+            main_resource = self.box.main_resource,
+            **{self.box._cloud_data_key: {'id': folder_id, 'displayName': folder_id}},
+        )
+
+    def get_messages(self, folder_id: str = FOLDER_IDS['to_process']) -> list:
+        "Return the O365 messages in `folder_id`."
+        return list(self.get_folder(folder_id).get_messages(limit=None))
+
+    def respond(self, method: str, parts: list[str], params: dict) -> FakeResponse:
+        if method == 'get' and parts[-1] == '$value':
+            return FakeResponse(content=self.attachments[parts[-4]][parts[-2]].doc)
+        if method == 'get' and parts[-1] == 'attachments':
+            return FakeResponse(data={'value': [
+                {
+                    'id': i.attachment_id,
+                    'name': i.name,
+                    'size': i.size,
+                    'contentType': i.content_type,
+                }
+                for i in self.attachments[parts[-2]].values()
+            ]})
+        if method == 'get' and parts[-1] == 'messages':
+            messages = [i for i in self.messages.values() if i['parentFolderId'] == parts[-2]]
+            top = int(params.get('$top', len(messages)))
+            return FakeResponse(data={'value': messages[:top]})
+        with self.lock:
+            n = len(self.requests)
+        if parts[-1] == 'createUploadSession':
+            return FakeResponse(data={'uploadUrl': f"memory://upload/{n}"})
+        return FakeResponse(data={'id': f"id-{n}", 'isDraft': True})
+
+    def oauth_request(self, url, method, params=None, **kwargs) -> FakeResponse:
+        method = method.lower()
+        path = urllib.parse.urlsplit(url).path.removeprefix('/v1.0/me')
+        with self.lock:
+            self.requests.append((method.upper(), path))
+        return self.respond(method, path.split('/'), params or {})
+
+    def naive_request(self, url, method, **kwargs):
+        return self.oauth_request(url, method, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.oauth_request(url, 'get', params=params, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'post', **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'patch', **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.oauth_request(url, 'put', **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.oauth_request(url, 'delete', **kwargs)
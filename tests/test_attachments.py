@@ -0,0 +1,85 @@
+import hashlib
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from O365.connection import MSGraphProtocol
+from O365.mailbox import MailBox
+from O365.message import Message
+
+from bbc_forwarder import attachments
+from tests.fakes import (
+    FakeAttachment, FakeMailboxServer, FakeMessage, FakeServerConnection, make_pdf,
+)
+
+
+class Test_Attachments(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        self.doc = make_pdf('Bewijs betaald collegegeld\n' * 200)
+        self.message = FakeMessage('msg', [
+            FakeAttachment('att-1', 'logo.png', b'not a pdf'),
+            FakeAttachment('att-2', 'bbc.PDF', self.doc),
+        ])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_list_attachments(self):
+        result = attachments.list_attachments(self.message)
+        self.assertListEqual(
+            [(i.attachment_id, i.name, i.content, i.size) for i in result],
+            [('att-1', 'logo.png', None, 9), ('att-2', 'bbc.PDF', None, len(self.doc))],
+        )
+        self.assertEqual(self.message.con.n_downloads, 0)
+
+    def test_download(self):
+        attachment = attachments.list_attachments(self.message)[1]
+        path = attachments.download(self.message, attachment, self.folder)
+        self.assertEqual(path.read_bytes(), self.doc)
+        self.assertEqual(path.name, f"{hashlib.sha256(self.doc).hexdigest()}.pdf")
+        self.assertListEqual(list(self.folder.iterdir()), [path])
+
+    def test_get_attachments(self):
+        result = attachments.get_attachments(
+            self.message,
+            self.folder,
+            select = lambda i: i.content_type == 'application/pdf',
+        )
+        self.assertIsNone(result[0].content)
+        self.assertEqual(result[1].content.read_bytes(), self.doc)
+        self.assertEqual(self.message.con.n_downloads, 1)
+        attachments.clear(self.folder)
+        self.assertFalse(self.folder.exists())
+
+
+class Test_Upload(unittest.TestCase):
+    def test_chunks(self):
+        doc = bytes(range(256)) * 4000
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            FakeMailboxServer(latency=0) as server,
+        ):
+            path = Path(tmp) / 'bbc.pdf'
+            path.write_bytes(doc)
+            connection = FakeServerConnection(server.url)
+            mailbox = MailBox(con=connection, protocol=MSGraphProtocol(), main_resource='me')
+            message = Message(parent=mailbox, __cloud_data__={'id': 'draft-1'})
+            n_chunks = attachments.upload(message, path, '20_1234567.pdf', chunksize=320 * 1024)
+
+        self.assertEqual(n_chunks, 4)
+        method, session, body = server.requests[0]
+        self.assertEqual((method, session), ('POST', '/v1.0/me/messages/draft-1/attachments/createUploadSession'))
+        self.assertDictEqual(json.loads(body)['AttachmentItem'], {
+            'attachmentType': 'file', 'name': '20_1234567.pdf', 'size': len(doc),
+        })
+        self.assertListEqual([range for _, range in server.ranges], [
+            'bytes 0-327679/1024000',
+            'bytes 327680-655359/1024000',
+            'bytes 655360-983039/1024000',
+            'bytes 983040-1023999/1024000',
+        ])
+        chunks = [body for method, _, body in server.requests[1:]]
+        self.assertEqual(b''.join(chunks), doc)
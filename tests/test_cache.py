@@ -0,0 +1,74 @@
+import base64
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from bbc_forwarder import parser
+from bbc_forwarder.cache import Cache, get_key
+from tests.fakes import make_messages
+
+
+class Test_Cache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'cache.sqlite3'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_get_set(self):
+        cache = Cache(self.path, version='1')
+        key = get_key(b'%PDF')
+        self.assertIsNone(cache.get(key))
+        cache.set(key, ('text', {'is_parsed': True}))
+        self.assertEqual(cache.get(key), ('text', {'is_parsed': True}))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_version(self):
+        Cache(self.path, version='1').set('key', 'value')
+        cache = Cache(self.path, version='2')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_evict_age(self):
+        cache = Cache(self.path, version='1', max_age_days=1)
+        cache.set('old', 'value')
+        cache.set('new', 'value')
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        cache.connection.execute(
+            "update extracted set accessed = ? where key = 'old'",
+            (two_days_ago,),
+        )
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(cache.get('new'), 'value')
+
+    def test_evict_size(self):
+        cache = Cache(self.path, version='1', max_size_mb=1.5)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, b'x' * 1024 * 1024)
+            time.sleep(0.01)
+        cache.get('a')
+        self.assertEqual(cache.evict(), 2)
+        self.assertIsNotNone(cache.get('a'))
+
+
+class Test_ExtractCached(unittest.TestCase):
+    def test_extract_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = Cache(Path(tmp) / 'cache.sqlite3', version=parser.get_version())
+            extract_features = mock.Mock(wraps=parser.extract_features)
+            with (
+                mock.patch.object(parser, 'get_cache', return_value=cache),
+                mock.patch.object(parser, 'extract_features', extract_features),
+            ):
+                messages = make_messages()
+                content = base64.b64encode(messages[0].attachments[0].doc).decode()
+                first = parser.extract(content)
+                second = parser.extract(content)
+            self.assertEqual(first, second)
+            self.assertEqual(extract_features.call_count, 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
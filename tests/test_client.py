@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import parser
+from bbc_forwarder.client import SQLiteClient, open_client, pad
+from tests.fakes import POPULATION, FakeOsiris, make_messages
+
+
+class Test_SQLiteClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = SQLiteClient(Path(self.tmp.name) / 'population.sqlite3', size=4)
+        self.client.load(POPULATION)
+
+    def tearDown(self):
+        self.client.close()
+        self.tmp.cleanup()
+
+    def test_query(self):
+        dates = [pd.Timestamp('2001-03-03'), pd.Timestamp('1999-01-01')]
+        result = self.client.query(dates)
+        expected = FakeOsiris().execute_query(
+            parser.SQL,
+            geboortedata = ', '.join(f"date '{i:%Y-%m-%d}'" for i in dates),
+        )
+        self.assertListEqual(
+            sorted(result.studentnummer),
+            sorted(expected.studentnummer),
+        )
+        self.assertEqual(result.geboortedatum.dtype, 'datetime64[ns]')
+        self.assertEqual(result.sinh_id.dtype, 'Int64')
+        self.assertEqual(result.studentnummer.dtype, 'string')
+
+    def test_null_values(self):
+        population = POPULATION.assign(
+            voorvoegsels = ['de', None, None],
+            faculteit = [None, 'REBO', None],
+        )
+        self.client.load(population)
+        result = self.client.query([pd.Timestamp('2001-03-03')])
+        self.assertEqual(result.voorvoegsels.dtype, 'string')
+        self.assertListEqual(result.voorvoegsels.isna().tolist(), [False, True])
+        self.assertListEqual(result.faculteit.isna().tolist(), [True, True])
+        self.assertNotIn('None', result.voorvoegsels.dropna().tolist())
+
+    def test_no_records(self):
+        result = self.client.query([pd.Timestamp('1999-01-01')])
+        self.assertTrue(result.empty)
+        self.assertListEqual(result.columns.to_list(), POPULATION.columns.to_list())
+
+    def test_too_many_dates(self):
+        with self.assertRaises(ValueError):
+            self.client.query(pd.date_range('2000-01-01', periods=5))
+        self.assertListEqual(pad([1], 3), [1, None, None])
+
+    @mock.patch.object(parser, 'get_cache', return_value=None)
+    def test_parse_all_messages(self, _):
+        with (
+            mock.patch.object(parser, 'get_client', return_value=self.client),
+            mock.patch.object(parser, 'CHUNKSIZE', 4),
+        ):
+            result = parser.parse_all_messages(make_messages(), workers=0)
+        self.assertListEqual(
+            result.studentnummer.dropna().tolist(),
+            ['1234567', '7654321'],
+        )
+
+
+class Test_OpenClient(unittest.TestCase):
+    def test_osiris(self):
+        self.assertIsNone(open_client(None, parser.SQL, 2021, 500, Path('.')))
+        self.assertIsNone(open_client({'type': 'osiris'}, parser.SQL, 2021, 500, Path('.')))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            open_client({'type': 'mssql'}, parser.SQL, 2021, 500, Path('.'))
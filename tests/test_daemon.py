@@ -0,0 +1,194 @@
+import tempfile
+import unittest
+from datetime import date, datetime
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+import daemon_bbc_forwarder as daemon
+from bbc_forwarder.logstore import LogStore
+
+
+def make_settings(killswitch=False, send_log_report=True):
+    return dict(killswitch=killswitch, send_log_report=send_log_report, test_run=False)
+
+
+def use_store(test: unittest.TestCase) -> LogStore:
+    "Return a log store in a temporary folder, used by the daemon during `test`."
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    store = LogStore(Path(tmp.name) / 'logs.sqlite3')
+    test.addCleanup(store.close)
+    patch = mock.patch.object(daemon.logstore, 'get_store', return_value=store)
+    patch.start()
+    test.addCleanup(patch.stop)
+    return store
+
+
+class Test_IsReportDue(unittest.TestCase):
+    def test(self):
+        cases = [
+            (datetime(2021, 8, 2, 16, 59), None, False),
+            (datetime(2021, 8, 2, 17, 0), None, True),
+            (datetime(2021, 8, 2, 18, 0), date(2021, 8, 2), False),
+            (datetime(2021, 8, 3, 17, 30), date(2021, 8, 2), True),
+        ]
+        for now, last_report, expected in cases:
+            with self.subTest(now=now):
+                self.assertEqual(daemon.is_report_due(now, '17:00', last_report), expected)
+
+
+class Test_Main(unittest.TestCase):
+    def setUp(self):
+        self.runs = []
+        self.reports = []
+        self.store = use_store(self)
+        patches = [
+            mock.patch.object(daemon.script, 'install_throttle'),
+            mock.patch.object(daemon.script, 'run', side_effect=self.run_script),
+            mock.patch.object(daemon.script, 'send_log_report', side_effect=self.send_log_report),
+            mock.patch.object(daemon, 'list_ids', return_value=set()),
+            mock.patch.object(daemon, 'get_new_messages', side_effect=self.get_new_messages),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_new_messages(self, ids, seen):
+        return {f"msg-{len(self.runs) + 1}"}
+
+    def run_script(self, send_report, test_run):
+        self.assertFalse(send_report)
+        self.runs.append(len(self.runs))
+        logs = pd.DataFrame({'object_id': [f"msg-{len(self.runs)}"]})
+        daemon.METRICS.count('process_message', 'bytes', 100)
+        self.store.append(logs)
+        return logs
+
+    def send_log_report(self, logs, metrics):
+        self.reports.append((logs, metrics.summary()))
+
+    def main(self, settings, times):
+        sleep = mock.Mock()
+        with mock.patch.object(daemon, 'read_settings', side_effect=settings):
+            daemon.main(max_checks=len(settings), sleep=sleep, now=iter(times).__next__)
+        return sleep
+
+    def test_killswitch_is_honoured_live(self):
+        settings = [make_settings(), make_settings(killswitch=True), make_settings()]
+        times = [datetime(2021, 8, 2, 9)] * 3
+        sleep = self.main(settings, times)
+        self.assertListEqual(self.runs, [0, 1])
+        self.assertEqual(sleep.call_count, 3)
+        self.assertListEqual(self.reports, [])
+
+    def test_daily_report(self):
+        settings = [make_settings()] * 4
+        times = [
+            datetime(2021, 8, 2, 16, 58),
+            datetime(2021, 8, 2, 16, 59),
+            datetime(2021, 8, 2, 17, 1),
+            datetime(2021, 8, 2, 17, 2),
+        ]
+        self.main(settings, times)
+        self.assertEqual(len(self.reports), 1)
+        logs, metrics = self.reports[0]
+        self.assertListEqual(logs.object_id.tolist(), ['msg-1', 'msg-2', 'msg-3'])
+        self.assertEqual(metrics.loc['process_message', 'bytes'], 300)
+        self.assertEqual(self.store.last_report(), date(2021, 8, 2))
+
+    def test_restart_after_report(self):
+        self.main([make_settings()] * 2, [datetime(2021, 8, 2, 16, 59), datetime(2021, 8, 2, 17, 1)])
+        self.main([make_settings()] * 2, [datetime(2021, 8, 2, 18, 0), datetime(2021, 8, 3, 17, 1)])
+        self.assertEqual(len(self.reports), 2)
+        # the runs after the report of a day are in the report of the next day
+        self.assertListEqual(self.reports[1][0].object_id.tolist(), ['msg-3', 'msg-4'])
+
+    def test_restart_before_report(self):
+        # the daemon stopped before sending the report: the runs before the restart are reported
+        self.main([make_settings()] * 2, [datetime(2021, 8, 2, 9), datetime(2021, 8, 2, 9, 1)])
+        self.main([make_settings()], [datetime(2021, 8, 2, 18, 0)])
+        self.assertEqual(len(self.reports), 1)
+        logs, metrics = self.reports[0]
+        self.assertListEqual(logs.object_id.tolist(), ['msg-1', 'msg-2', 'msg-3'])
+        self.assertEqual(metrics.loc['process_message', 'bytes'], 300)
+
+    def test_store_is_needed(self):
+        with (
+            mock.patch.object(daemon.logstore, 'get_store', return_value=None),
+            self.assertRaises(ValueError),
+        ):
+            self.main([make_settings()], [datetime(2021, 8, 2, 9)])
+
+    def test_errors_do_not_stop_the_daemon(self):
+        settings = [make_settings()] * 2
+        times = [datetime(2021, 8, 2, 9)] * 2
+        daemon.script.run.side_effect = [RuntimeError('graph unavailable'), pd.DataFrame()]
+        with mock.patch('traceback.print_exc') as print_exc:
+            self.main(settings, times)
+        print_exc.assert_called_once()
+        self.assertEqual(daemon.script.run.call_count, 2)
+
+    def test_full_run_without_new_messages(self):
+        daemon.get_new_messages.side_effect = None
+        daemon.get_new_messages.return_value = set()
+        times = [
+            datetime(2021, 8, 2, 9),
+            datetime(2021, 8, 2, 9, 30),
+            datetime(2021, 8, 2, 10),
+            datetime(2021, 8, 2, 10, 1),
+        ]
+        # a full run at the start and after full_run_minutes (60)
+        self.main([make_settings()] * 4, times)
+        self.assertListEqual(self.runs, [0, 1])
+
+    def test_snapshot_is_reloaded_before_every_run(self):
+        with mock.patch.object(daemon.parser.get_snapshot, 'cache_clear') as cache_clear:
+            self.main([make_settings()] * 2, [datetime(2021, 8, 2, 9)] * 2)
+        self.assertEqual(cache_clear.call_count, 2)
+
+
+class Test_GetNewMessages(unittest.TestCase):
+    def setUp(self):
+        use_store(self)
+        self.ids = {'msg-1', 'msg-2'}
+        patch = mock.patch.object(daemon, 'list_ids', side_effect=lambda: set(self.ids))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_only_unseen_messages(self):
+        with mock.patch.object(daemon.parser, 'get_state', return_value=None):
+            self.assertSetEqual(daemon.get_new_messages(self.ids, set()), {'msg-1', 'msg-2'})
+            self.assertSetEqual(daemon.get_new_messages(self.ids, {'msg-1', 'msg-2'}), set())
+            self.ids.add('msg-3')
+            self.assertSetEqual(daemon.get_new_messages(self.ids, {'msg-1', 'msg-2'}), {'msg-3'})
+
+    def test_messages_in_state_are_known(self):
+        state = mock.Mock(messages={'msg-1': {}})
+        with mock.patch.object(daemon.parser, 'get_state', return_value=state):
+            self.assertSetEqual(daemon.get_new_messages(self.ids, set()), {'msg-2'})
+
+    def test_unmatched_messages_do_not_start_runs(self):
+        settings = [make_settings()] * 3
+        with (
+            mock.patch.object(daemon.parser, 'get_state', return_value=None),
+            mock.patch.object(daemon, 'read_settings', side_effect=settings),
+            mock.patch.object(daemon.script, 'install_throttle'),
+            mock.patch.object(daemon.script, 'run', return_value=pd.DataFrame({'object_id': ['msg-1', 'msg-2']})) as run,
+        ):
+            daemon.main(max_checks=3, sleep=mock.Mock(), now=lambda: datetime(2021, 8, 2, 9))
+        self.assertEqual(run.call_count, 1)
+
+    def test_messages_that_left_the_folder_are_forgotten(self):
+        folders = [{'msg-1'}, set(), {'msg-1'}]
+        daemon.list_ids.side_effect = folders
+        with (
+            mock.patch.object(daemon.parser, 'get_state', return_value=None),
+            mock.patch.object(daemon, 'read_settings', side_effect=[make_settings()] * 3),
+            mock.patch.object(daemon.script, 'install_throttle'),
+            mock.patch.object(daemon.script, 'run', return_value=pd.DataFrame({'object_id': ['msg-1']})) as run,
+        ):
+            daemon.main(max_checks=3, sleep=mock.Mock(), now=lambda: datetime(2021, 8, 2, 9))
+        # msg-1 was moved back into the folder after it was forgotten
+        self.assertEqual(run.call_count, 2)
@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import dataset
+from bbc_forwarder.config import CONFIG
+from benchmarks.corpus import make_records
+from tests import reference_dataset
+
+
+ADDRESS = CONFIG['forwarder']['address'] | {
+    'csa': 'csa@uu.nl',
+    'beta': 'beta@uu.nl',
+    'geo': 'geo@uu.nl',
+    'ucu': 'ucu@uu.nl',
+    'gw': None,
+}
+
+
+@mock.patch.dict(CONFIG['forwarder'], address=ADDRESS)
+class Test_CreateDataset(unittest.TestCase):
+    def test_equals_per_message(self):
+        for seed in range(5):
+            records = make_records(200, seed=seed)
+            expected = reference_dataset.create_dataset_per_message(records.copy())
+            result = dataset.create_dataset(records.copy())
+            pd.testing.assert_frame_equal(result, expected)
+
+    def test_categoricals(self):
+        result = dataset.create_dataset(make_records(200))
+        for column in ['status', 'soort', 'soort_inschrijving', 'faculteit']:
+            self.assertIsInstance(result[column].dtype, pd.CategoricalDtype)
+
+    def test_without_matches(self):
+        records = make_records(200)
+        records = (
+            records
+            .loc[records.found_student.ne(True)]
+            .dropna(axis=1, how='all')
+        )
+        self.assertNotIn('soort_inschrijving', records)
+        expected = reference_dataset.create_dataset_per_message(records.copy())
+        result = dataset.create_dataset(records.copy())
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_addresses(self):
+        df = pd.DataFrame({
+            'opleiding': ['UCU', 'B Wiskunde', 'B Rechten', None],
+            'faculteit': ['BETA', 'Beta', 'GW', 'GEO'],
+        })
+        result = dataset.get_addresses(df, ['opleiding', 'faculteit'])
+        expected = [
+            reference_dataset.get_address(row.dropna().to_list())
+            for _, row in df.iterrows()
+        ]
+        self.assertListEqual(result.to_list(), expected)
+        self.assertListEqual(expected, ['ucu@uu.nl', 'beta@uu.nl', None, 'geo@uu.nl'])
@@ -0,0 +1,223 @@
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+import script_bbc_forwarder as script
+from bbc_forwarder import dataset, duplicates, parser
+from bbc_forwarder.state import State
+from tests.fakes import BBC, POPULATION, FakeAttachment, FakeMessage, FakeOsiris, make_pdf
+
+
+def setUpModule():
+    global DOWNLOADS, PATCH_DOWNLOADS
+    DOWNLOADS = tempfile.TemporaryDirectory()
+    PATCH_DOWNLOADS = mock.patch.object(
+        parser, 'get_download_folder', return_value=Path(DOWNLOADS.name),
+    )
+    PATCH_DOWNLOADS.start()
+
+
+def tearDownModule():
+    PATCH_DOWNLOADS.stop()
+    DOWNLOADS.cleanup()
+
+
+VRIES = BBC.format(naam='J. de Vries', geboortedatum='3 maart 2001')
+BAKKER = BBC.format(naam='P. Bakker', geboortedatum='12-11-2000')
+
+# the dataset needs the enrolment of matched students
+STUDENTS = POPULATION.assign(
+    soort_inschrijving = 'F',
+    opleiding = 'B Wiskunde',
+    aggregaat_2 = None,
+    aggregaat_1 = None,
+    faculteit = 'BETA',
+)
+
+
+def with_metadata(doc: bytes, created: str) -> bytes:
+    "Return pdf `doc` with an info dictionary and document id created at `created`."
+    info = f"/Info << /Producer (Scanner {created}) /CreationDate (D:{created}) >>"
+    return doc.replace(b"trailer\n<<", f"trailer\n<< {info} /ID [<{created}><{created}>]".encode())
+
+
+def make_message(object_id: str, doc: bytes, subject: str = 'bbc') -> FakeMessage:
+    return FakeMessage(object_id, [FakeAttachment(f"att-{object_id}", 'bbc.pdf', doc)], subject=subject)
+
+
+class Test_Keys(unittest.TestCase):
+    def test_pdf_key_ignores_metadata(self):
+        doc = make_pdf(VRIES)
+        first = with_metadata(doc, '20210801120000')
+        second = with_metadata(doc, '20210902093000')
+        self.assertNotEqual(first, second)
+        self.assertEqual(duplicates.normalize_pdf(first), duplicates.normalize_pdf(second))
+        other = with_metadata(make_pdf(BAKKER), '20210801120000')
+        self.assertNotEqual(duplicates.normalize_pdf(first), duplicates.normalize_pdf(other))
+
+    def test_text_key(self):
+        key = duplicates.get_text_key('J. de  Vries\ngeboren', 'fast')
+        self.assertEqual(key, duplicates.get_text_key('j. de vries geboren', 'fast'))
+        self.assertNotEqual(key, duplicates.get_text_key('j. de vries geboren', 'full'))
+        self.assertIsNone(duplicates.get_text_key(False, 'full'))
+
+
+class Test_Registry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.registry = duplicates.Registry(Path(self.tmp.name) / 'duplicates.sqlite3')
+
+    def tearDown(self):
+        self.registry.close()
+        self.tmp.cleanup()
+
+    def make_logs(self, object_id: str, soort: str) -> pd.DataFrame:
+        return pd.DataFrame([
+            dict(object_id=object_id, is_pdf=False, pdf_key=None, text_key=None),
+            dict(
+                object_id = object_id,
+                is_pdf = True,
+                pdf_key = 'pdf-1',
+                text_key = 'fast:text-1',
+                studentnummer = '1234567',
+            ),
+        ]).assign(soort=soort, ontvanger='beta@uu.nl')
+
+    def test_register(self):
+        forwarded = datetime(2021, 8, 2, 9)
+        self.assertEqual(self.registry.register(self.make_logs('msg-1', 'faculteit'), forwarded), 2)
+        self.assertEqual(self.registry.register(self.make_logs('msg-2', 'csa')), 0)
+        found = self.registry.find(['pdf-1', 'fast:text-1', 'other', None])
+        self.assertListEqual(sorted(found), ['fast:text-1', 'pdf-1'])
+        self.assertDictEqual(found['pdf-1'], {
+            'key': 'pdf-1',
+            'kind': 'pdf',
+            'object_id': 'msg-1',
+            'soort': 'faculteit',
+            'studentnummer': '1234567',
+            'ontvanger': 'beta@uu.nl',
+            'forwarded': '2021-08-02T09:00:00',
+        })
+
+    def test_issues_are_not_registered(self):
+        self.assertEqual(self.registry.register(self.make_logs('msg-1', 'issue')), 0)
+        self.assertEqual(len(self.registry), 0)
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+class Test_ParseAllMessages(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.registry = duplicates.Registry(Path(self.tmp.name) / 'duplicates.sqlite3')
+        self.patch = mock.patch.object(duplicates, 'get_registry', return_value=self.registry)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.registry.close()
+        self.tmp.cleanup()
+
+    def parse(self, messages, osiris=None):
+        with mock.patch.object(parser, 'osi', osiris or FakeOsiris(STUDENTS)):
+            return parser.parse_all_messages(messages, workers=0)
+
+    def forward(self, records):
+        logs = dataset.create_dataset(records)
+        for _, message_logs in logs.groupby('object_id', sort=False):
+            self.registry.register(message_logs)
+        return logs
+
+    def test_copy_in_same_run(self, _):
+        doc = make_pdf(VRIES)
+        messages = [
+            make_message('msg-1', with_metadata(doc, '20210801120000')),
+            make_message('msg-2', make_pdf(BAKKER)),
+            make_message('msg-3', with_metadata(doc, '20210802120000'), subject='bbc (2)'),
+        ]
+        with mock.patch.object(parser, 'extract_features', wraps=parser.extract_features) as extract:
+            result = self.parse(messages)
+        self.assertEqual(extract.call_count, 2)
+        logs = dataset.create_dataset(result).set_index('object_id')
+        self.assertEqual(logs.loc['msg-1', 'status'], 'one_matched_sinh_id')
+        self.assertEqual(logs.loc['msg-3', 'status'], 'duplicate')
+        self.assertEqual(logs.loc['msg-3', 'soort'], 'duplicate')
+        self.assertEqual(logs.loc['msg-3', 'duplicate_of'], 'msg-1')
+        self.assertEqual(logs.loc['msg-3', 'duplicate_by'], 'pdf')
+        self.assertTrue(pd.isna(logs.loc['msg-3', 'ontvanger']))
+
+    def test_copy_of_forwarded_bbc(self, _):
+        self.forward(self.parse([make_message('msg-1', make_pdf(VRIES))]))
+        osiris = FakeOsiris(STUDENTS)
+        result = self.parse([make_message('msg-2', make_pdf(VRIES))], osiris)
+        self.assertEqual(osiris.n_queries, 0)
+        record = dataset.create_dataset(result).iloc[0]
+        self.assertEqual(record['status'], 'duplicate')
+        self.assertEqual(record['duplicate_of'], 'msg-1')
+        self.assertEqual(record['duplicate_by'], 'pdf')
+
+    def test_same_text_other_bytes(self, _):
+        self.forward(self.parse([make_message('msg-1', make_pdf(VRIES))]))
+        osiris = FakeOsiris(STUDENTS)
+        spaced = make_pdf(VRIES.replace('J. de Vries', 'J.  de  Vries'))
+        result = self.parse([make_message('msg-2', spaced)], osiris)
+        self.assertEqual(osiris.n_queries, 0)
+        record = dataset.create_dataset(result).iloc[0]
+        self.assertEqual(record['status'], 'duplicate')
+        self.assertEqual(record['duplicate_by'], 'text')
+        self.assertEqual(record['duplicate_of'], 'msg-1')
+
+    def test_unmatched_bbc_is_parsed_again(self, _):
+        without_vries = FakeOsiris(STUDENTS.query("achternaam != 'Vries'"))
+        logs = self.forward(self.parse([make_message('msg-1', make_pdf(VRIES))], without_vries))
+        self.assertListEqual(logs.status.astype(str).to_list(), ['no_student_matched'])
+        result = self.parse([make_message('msg-2', make_pdf(VRIES))])
+        self.assertListEqual(result.studentnummer.to_list(), ['1234567'])
+
+    def test_original_is_received_first(self, _):
+        doc = make_pdf(VRIES)
+        newer = make_message('msg-new', with_metadata(doc, '20210802120000'))
+        newer.received = datetime(2021, 8, 2, 12)
+        older = make_message('msg-old', with_metadata(doc, '20210801120000'))
+        # the mailbox lists the newest message first
+        logs = dataset.create_dataset(self.parse([newer, older])).set_index('object_id')
+        self.assertEqual(logs.loc['msg-old', 'status'], 'one_matched_sinh_id')
+        self.assertEqual(logs.loc['msg-new', 'duplicate_of'], 'msg-old')
+
+    def test_copy_is_archived_after_original_is_forwarded(self, _):
+        without_vries = FakeOsiris(STUDENTS.query("achternaam != 'Vries'"))
+        messages = [make_message('msg-1', make_pdf(VRIES)), make_message('msg-2', make_pdf(VRIES))]
+        logs = self.forward(self.parse(messages, without_vries))
+        self.assertListEqual(logs.status.astype(str).to_list(), ['no_student_matched', 'duplicate'])
+        jobs = []
+        index = {message.object_id:message for message in messages}
+        with mock.patch.object(script.engine, 'run', side_effect=lambda f, j, **kwargs: jobs.extend(j)):
+            # the original was not forwarded: the copy stays in the folder
+            script.archive_duplicates(logs, index)
+            self.assertListEqual(jobs, [])
+            logs = self.forward(self.parse(messages))
+            script.archive_duplicates(logs, index)
+        self.assertListEqual([message.object_id for message, _ in jobs], ['msg-2'])
+
+    def test_duplicate_features_are_not_in_state(self, _):
+        state = State(Path(self.tmp.name) / 'state.pickle', version=parser.get_version())
+        spaced = make_pdf(VRIES.replace('J. de Vries', 'J.  de  Vries'))
+        messages = [
+            make_message('msg-1', make_pdf(VRIES)),
+            make_message('msg-2', make_pdf(VRIES)),
+            make_message('msg-3', spaced),
+        ]
+        with mock.patch.object(parser, 'osi', FakeOsiris(STUDENTS)):
+            logs = dataset.create_dataset(parser.parse_all_messages(messages, workers=0, state=state))
+        self.assertListEqual(logs.status.astype(str).to_list(), ['one_matched_sinh_id', 'duplicate', 'duplicate'])
+        # the copy by pdf key was not extracted: it is parsed again in the next run
+        self.assertNotIn('msg-2', state)
+        [(_, features)] = state.get_extracted('msg-3').values()
+        self.assertNotIn('duplicate_of', features)
+        # without its original, the copy in the state is a bbc of its own
+        with mock.patch.object(parser, 'osi', FakeOsiris(STUDENTS)):
+            logs = dataset.create_dataset(parser.parse_all_messages(messages[2:], workers=0, state=state))
+        self.assertListEqual(logs.status.astype(str).to_list(), ['one_matched_sinh_id'])
@@ -0,0 +1,200 @@
+import email.utils
+import threading
+import time
+import unittest
+
+from requests.exceptions import HTTPError
+
+from bbc_forwarder import engine
+from tests.fakes import FakeMailboxServer, FakeServerConnection
+
+
+def forward(connection, object_id: str) -> None:
+    "The requests for forwarding one message, in order."
+    connection.post(f"/messages/{object_id}/createForward")
+    connection.oauth_request(f"/messages/fwd-{object_id}", 'patch', json={})
+    connection.post(f"/messages/fwd-{object_id}/send")
+    connection.post(f"/messages/{object_id}/move")
+
+
+STEPS = ['createForward', 'fwd', 'send', 'move']
+
+
+class FakeClock:
+    """Stand-in for `time.monotonic` and `time.sleep`: sleeping advances the
+    clock at once. The sleeps are recorded in `sleeps`."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class Throttled:
+    "Stand-in for the response of Graph to a throttled request."
+    def __init__(self, status: int, retry_after: str):
+        self.status_code = status
+        self.headers = {'Retry-After': retry_after}
+
+
+class Test_Engine(unittest.TestCase):
+    def run_engine(self, server, n_messages=20, workers=4, **settings):
+        connection = FakeServerConnection(server.url)
+        throttle = engine.Throttle(**({'rate': 1000, 'burst': 1000} | settings))
+        throttle.install(connection)
+        jobs = [(connection, f"msg-{i}") for i in range(n_messages)]
+        engine.run(forward, jobs, workers=workers)
+        return throttle
+
+    def assert_steps_in_order(self, log, n_messages):
+        for i in range(n_messages):
+            paths = [
+                path for _, _, _, path, status in sorted(log)
+                if status == 200 and path.split('/')[2].endswith(f"msg-{i}")
+            ]
+            steps = [path.split('/')[-1].split('-')[0] for path in paths]
+            self.assertListEqual(steps, STEPS)
+
+    def test_steps_in_order(self):
+        with FakeMailboxServer(latency=0.005) as server:
+            self.run_engine(server, max_in_flight=4)
+        self.assert_steps_in_order(server.log, 20)
+        self.assertEqual(len(server.log), 80)
+
+    def test_retried_steps_in_order(self):
+        for status in engine.RETRY_STATUS:
+            with FakeMailboxServer(throttle_every=7, throttle_status=status, retry_after=0) as server:
+                throttle = self.run_engine(server)
+            throttled = [code for *_, code in server.log if code == status]
+            self.assertEqual(throttle.n_throttled, len(throttled))
+            self.assertGreater(len(throttled), 0)
+            self.assert_steps_in_order(server.log, 20)
+
+    def test_give_up(self):
+        with FakeMailboxServer(throttle_every=1, retry_after=0) as server:
+            with self.assertRaises(HTTPError):
+                self.run_engine(server, n_messages=2, max_retries=2)
+
+
+class Test_Throttle(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.calls = []
+
+    def make_throttle(self, **settings) -> engine.Throttle:
+        return engine.Throttle(**(
+            {'rate': 1000, 'burst': 1000, 'clock': self.clock, 'sleep': self.clock.sleep}
+            | settings
+        ))
+
+    def test_concurrent(self):
+        # every request waits until 4 requests are in flight at the same time
+        barrier = threading.Barrier(4, timeout=10)
+        def send(url, method):
+            self.calls.append(url)
+            barrier.wait()
+
+        throttle = self.make_throttle(max_in_flight=4)
+        jobs = [(send, f"/messages/msg-{i}", 'post') for i in range(8)]
+        engine.run(throttle.request, jobs, workers=4)
+        self.assertCountEqual(self.calls, [url for _, url, _ in jobs])
+        self.assertListEqual(self.clock.sleeps, [])
+
+    def test_max_in_flight(self):
+        lock = threading.Lock()
+        in_flight = []
+        barrier = threading.Barrier(2, timeout=10)
+        def send(url, method):
+            with lock:
+                in_flight.append(url)
+                self.calls.append(len(in_flight))
+            barrier.wait()
+            with lock:
+                in_flight.remove(url)
+
+        throttle = self.make_throttle(max_in_flight=2)
+        jobs = [(send, f"/messages/msg-{i}", 'post') for i in range(8)]
+        engine.run(throttle.request, jobs, workers=8)
+        self.assertEqual(len(self.calls), 8)
+        self.assertEqual(max(self.calls), 2)
+
+    def test_retry_after(self):
+        for status in engine.RETRY_STATUS:
+            with self.subTest(status=status):
+                self.setUp()
+                responses = [HTTPError(response=Throttled(status, '3')), None]
+                def send(url, method):
+                    self.calls.append((self.clock(), url))
+                    response = responses.pop(0)
+                    if response is not None:
+                        raise response
+                    return url
+
+                throttle = self.make_throttle()
+                self.assertEqual(throttle.request(send, '/messages/msg-1', 'post'), '/messages/msg-1')
+                self.assertListEqual(self.calls, [(0, '/messages/msg-1'), (3, '/messages/msg-1')])
+                self.assertListEqual(self.clock.sleeps, [3])
+                self.assertEqual(throttle.n_throttled, 1)
+
+    def test_retry_after_is_shared(self):
+        # a request of another worker waits for the Retry-After of a throttled request
+        throttle = self.make_throttle()
+        throttle.bucket.pause(3)
+        throttle.request(lambda url, method: self.calls.append((self.clock(), url)), '/messages/msg-2', 'post')
+        self.assertListEqual(self.calls, [(3, '/messages/msg-2')])
+        self.assertListEqual(self.clock.sleeps, [3])
+
+    def test_backoff_without_retry_after(self):
+        def send(url, method):
+            self.calls.append(self.clock())
+            raise HTTPError(response=Throttled(429, None))
+
+        throttle = self.make_throttle(max_retries=3)
+        with self.assertRaises(HTTPError):
+            throttle.request(send, '/messages/msg-1', 'post')
+        self.assertListEqual(self.clock.sleeps, [1, 2, 4])
+        self.assertListEqual(self.calls, [0, 1, 3, 7])
+
+
+class Test_TokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_rate(self):
+        bucket = engine.TokenBucket(rate=4, capacity=1, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(11):
+            bucket.acquire()
+        self.assertListEqual(self.clock.sleeps, [0.25] * 10)
+
+    def test_burst(self):
+        bucket = engine.TokenBucket(rate=1, capacity=5, clock=self.clock, sleep=self.clock.sleep)
+        for _ in range(5):
+            bucket.acquire()
+        self.assertListEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        self.assertListEqual(self.clock.sleeps, [1])
+
+    def test_pause(self):
+        bucket = engine.TokenBucket(rate=1000, capacity=10, clock=self.clock, sleep=self.clock.sleep)
+        bucket.pause(0.1)
+        bucket.acquire()
+        self.assertListEqual(self.clock.sleeps, [0.1])
+
+
+class Test_GetRetryAfter(unittest.TestCase):
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    def test(self):
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertEqual(engine.get_retry_after(self.Response({'Retry-After': '3'}), 1), 3)
+        self.assertAlmostEqual(
+            engine.get_retry_after(self.Response({'Retry-After': date}), 1), 30, delta=2,
+        )
+        self.assertEqual(engine.get_retry_after(self.Response({}), 1), 1)
@@ -0,0 +1,189 @@
+import base64
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from string import Template
+from unittest import mock
+
+import pandas as pd
+from O365.mailbox import MailBox
+from O365.message import Message
+from O365.connection import MSGraphProtocol
+
+from bbc_forwarder import duplicates, forwarder, journal, mailbox, parser
+from tests.fakes import (
+    FakeMailboxServer, FakeServerConnection, make_pdf, make_workspace,
+)
+
+
+PDF = make_pdf('Bewijs betaald collegegeld')
+
+SUBJECTS = {
+    soort:Template('$status $onderwerp $studentnummer')
+    for soort in ['faculteit', 'csa', 'issue']
+}
+
+
+def make_logs(soort: str, attachment_hash: str|None) -> pd.DataFrame:
+    "Return the records of one message with a pdf as created by `create_dataset`."
+    fields = [
+        'datum_ontvangst', 'zender', 'onderwerp', 'instelling', 'bedrag',
+        'voorletters', 'voorvoegsels', 'achternaam', 'geboortedatum',
+        'soort_inschrijving', 'opleiding', 'faculteit', 'inschrijvingstatus',
+        'datum_verzoek', 'datum_intrekking', 'ingangsdatum', 'afloopdatum',
+        'examentype',
+    ]
+    records = [
+        {field:'-' for field in fields} | dict(
+            object_id = 'msg-1',
+            attachment_id = 'att-1',
+            attachment_name = 'logo.png',
+            is_pdf = False,
+        ),
+        {field:'-' for field in fields} | dict(
+            object_id = 'msg-1',
+            attachment_id = 'att-2',
+            attachment_name = 'bbc.PDF',
+            attachment_hash = attachment_hash,
+            is_pdf = True,
+            studentnummer = '1234567',
+        ),
+    ]
+    status = 'one_matched_sinh_id' if soort != 'issue' else 'too_many_pdfs'
+    return pd.DataFrame(records).assign(
+        status = status,
+        soort = soort,
+        ontvanger = 'faculteit@uu.nl',
+    )
+
+
+class Test_ProcessMessage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        self.server = FakeMailboxServer(latency=0).__enter__()
+        connection = FakeServerConnection(self.server.url)
+        box = MailBox(con=connection, protocol=MSGraphProtocol(), main_resource='me')
+        self.message = Message(parent=box, __cloud_data__={'id': 'msg-1', 'isDraft': False})
+        self.patches = [
+            mock.patch.object(mailbox, '_workspace', make_workspace(box)),
+            mock.patch.object(forwarder, 'SUBJECTS', SUBJECTS),
+            mock.patch.object(parser, 'get_download_folder', return_value=self.folder),
+            mock.patch.object(journal, 'get_journal', return_value=None),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.server.__exit__()
+        self.tmp.cleanup()
+
+    def process(self, soort, attachment_hash=None, save_as_draft=False):
+        settings = {'save_as_draft': {soort: save_as_draft}}
+        with mock.patch.dict(forwarder.CONFIG['forwarder']['settings'], settings):
+            forwarder.process_message(
+                self.message,
+                'template.forward.jinja.html',
+                make_logs(soort, attachment_hash),
+            )
+        return [(method, path.removeprefix('/v1.0/me')) for method, path, _ in self.server.requests]
+
+    def get_body(self, i) -> dict:
+        return json.loads(self.server.requests[i][2])
+
+    def test_send_with_pdf_from_parser(self):
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        requests = self.process('faculteit', attachment_hash='abc')
+        self.assertListEqual(requests, [
+            ('POST', '/mailFolders/Drafts/messages'),
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+        message = self.get_body(0)
+        self.assertEqual(message['toRecipients'][0]['emailAddress']['address'], 'faculteit@uu.nl')
+        [attachment] = message['attachments']
+        self.assertEqual(attachment['name'], '20_1234567.pdf')
+        self.assertEqual(base64.b64decode(attachment['contentBytes']), PDF)
+
+    def test_save_as_draft(self):
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        requests = self.process('csa', attachment_hash='abc', save_as_draft=True)
+        self.assertListEqual(requests, [
+            ('POST', '/mailFolders/folder-csa/messages'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+        self.assertEqual(len(self.get_body(0)['attachments']), 1)
+
+    def test_pdf_not_downloaded(self):
+        requests = self.process('faculteit')
+        self.assertListEqual(requests, [
+            ('GET', '/messages/msg-1/attachments/att-2/$value'),
+            ('POST', '/mailFolders/Drafts/messages'),
+            ('POST', '/messages/id-2/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_issue_is_forwarded(self):
+        requests = self.process('issue')
+        self.assertListEqual([method for method, _ in requests], ['POST', 'PATCH', 'POST', 'POST'])
+        self.assertTrue(requests[0][1].endswith('/messages/msg-1/createForward'))
+        self.assertTrue(requests[-1][1].endswith('/messages/msg-1/move'))
+
+    def test_upload_large_pdf(self):
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        with (
+            mock.patch.object(forwarder.attachments, 'UPLOAD_LIMIT', 100),
+            mock.patch.object(forwarder.attachments, 'UPLOAD_CHUNKSIZE', 320),
+        ):
+            requests = self.process('faculteit', attachment_hash='abc')
+        n_chunks = -(-len(PDF) // 320)
+        self.assertListEqual(requests, [
+            ('POST', '/mailFolders/Drafts/messages'),
+            ('POST', '/messages/id-1/attachments/createUploadSession'),
+            *[('PUT', '/upload/2')] * n_chunks,
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+        self.assertNotIn('attachments', self.get_body(0))
+        self.assertEqual(b''.join(body for method, _, body in self.server.requests if method == 'PUT'), PDF)
+
+    def test_no_ontvanger(self):
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        logs = make_logs('faculteit', attachment_hash='abc').assign(ontvanger=pd.NA)
+        settings = {'save_as_draft': {'faculteit': False}}
+        with mock.patch.dict(forwarder.CONFIG['forwarder']['settings'], settings):
+            forwarder.process_message(self.message, 'template.forward.jinja.html', logs)
+        requests = [(method, path.removeprefix('/v1.0/me')) for method, path, _ in self.server.requests]
+        self.assertListEqual(requests, [
+            ('POST', '/mailFolders/folder-faculteit/messages'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_no_pdf(self):
+        self.assertIsNone(forwarder.get_pdf(self.message, make_logs('csa', None).iloc[:1]))
+
+    def test_forwarded_bbc_is_registered(self):
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        registry = duplicates.Registry(self.folder / 'duplicates.sqlite3')
+        logs = make_logs('faculteit', attachment_hash='abc').assign(pdf_key='pdf-1')
+        settings = {'save_as_draft': {'faculteit': False}}
+        with (
+            mock.patch.object(duplicates, 'get_registry', return_value=registry),
+            mock.patch.dict(forwarder.CONFIG['forwarder']['settings'], settings),
+        ):
+            forwarder.process_message(self.message, 'template.forward.jinja.html', logs)
+        self.assertEqual(registry.find(['pdf-1'])['pdf-1']['object_id'], 'msg-1')
+        registry.close()
+
+    def test_duplicate_is_archived(self):
+        logs = make_logs('faculteit', attachment_hash='abc').assign(
+            status = 'duplicate',
+            soort = 'duplicate',
+            duplicate_of = 'msg-0',
+        )
+        forwarder.archive_message(self.message, logs)
+        requests = [(method, path.removeprefix('/v1.0/me')) for method, path, _ in self.server.requests]
+        self.assertListEqual(requests, [('POST', '/messages/msg-1/move')])
@@ -0,0 +1,255 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+from O365.mailbox import MailBox
+from O365.message import Message
+from O365.connection import MSGraphProtocol
+
+import script_bbc_forwarder as script
+from bbc_forwarder import forwarder, journal, mailbox, parser
+from tests.fakes import FakeMailboxServer, FakeServerConnection, make_workspace
+from tests.test_forwarder import PDF, SUBJECTS, make_logs
+
+
+class Test_Journal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = journal.Journal(Path(self.tmp.name) / 'journal.sqlite3')
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def test_record_steps(self):
+        self.journal.record('msg-1', 'started', {'kind': 'forward', 'folder_id': None})
+        self.journal.record('msg-1', 'draft', 'id-1')
+        self.journal.record('msg-2', 'started', {'kind': 'message'})
+        self.assertDictEqual(self.journal.steps('msg-1'), {
+            'started': {'kind': 'forward', 'folder_id': None},
+            'draft': 'id-1',
+        })
+        self.assertListEqual(list(self.journal.pending()), ['msg-1', 'msg-2'])
+        self.assertEqual(len(self.journal), 2)
+
+    def test_steps_survive_reopening(self):
+        self.journal.record('msg-1', 'delivered')
+        self.journal.close()
+        self.journal = journal.Journal(self.journal.path)
+        self.assertDictEqual(self.journal.pending(), {'msg-1': {'delivered': None}})
+
+    def test_clear(self):
+        entry = self.journal.entry('msg-1')
+        entry.record('started', {})
+        entry.record('delivered')
+        entry.clear()
+        self.assertDictEqual(entry.steps(), {})
+        self.assertEqual(len(self.journal), 0)
+
+    def test_unknown_step(self):
+        with self.assertRaises(ValueError):
+            self.journal.record('msg-1', 'archived')
+
+    def test_without_journal(self):
+        entry = journal.Entry(None, 'msg-1')
+        entry.record('started', {})
+        self.assertDictEqual(entry.steps(), {})
+
+
+class Test_Resume(unittest.TestCase):
+    "Interrupt the processing of a message by a failing request and resume it."
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        self.journal = journal.Journal(self.folder / 'journal.sqlite3')
+        self.server = FakeMailboxServer(latency=0).__enter__()
+        connection = FakeServerConnection(self.server.url)
+        self.box = MailBox(con=connection, protocol=MSGraphProtocol(), main_resource='me')
+        self.message = self.get_message('msg-1')
+        (self.folder / 'abc.pdf').write_bytes(PDF)
+        patches = [
+            mock.patch.object(mailbox, '_workspace', make_workspace(self.box)),
+            mock.patch.object(forwarder, 'SUBJECTS', SUBJECTS),
+            mock.patch.object(parser, 'get_download_folder', return_value=self.folder),
+            mock.patch.object(journal, 'get_journal', return_value=self.journal),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.journal.close()
+        self.tmp.cleanup()
+
+    def get_message(self, object_id: str) -> Message:
+        return Message(parent=self.box, __cloud_data__={'id': object_id, 'isDraft': False})
+
+    def get_requests(self) -> list[tuple[str, str]]:
+        requests = [(method, path.removeprefix('/v1.0/me')) for method, path, _ in self.server.requests]
+        self.server.requests.clear()
+        return requests
+
+    def crash(self, soort: str, failing: str, save_as_draft: bool = False) -> list[tuple[str, str]]:
+        "Process msg-1 while requests ending with `failing` fail and return the requests."
+        self.server.failing.add(failing)
+        settings = {'save_as_draft': {soort: save_as_draft}}
+        with (
+            mock.patch.dict(forwarder.CONFIG['forwarder']['settings'], settings),
+            self.assertRaises(requests.HTTPError),
+        ):
+            forwarder.process_message(
+                self.message,
+                'template.forward.jinja.html',
+                make_logs(soort, attachment_hash='abc'),
+            )
+        self.server.failing.clear()
+        return self.get_requests()
+
+    def resume(self) -> list[tuple[str, str]]:
+        "Resume msg-1 in a new run and return the requests."
+        self.assertTrue(forwarder.resume_message(self.get_message('msg-1'), self.journal.entry('msg-1')))
+        self.assertEqual(len(self.journal), 0)
+        return self.get_requests()
+
+    def test_completed_message_is_removed(self):
+        settings = {'save_as_draft': {'faculteit': False}}
+        with mock.patch.dict(forwarder.CONFIG['forwarder']['settings'], settings):
+            forwarder.process_message(
+                self.message,
+                'template.forward.jinja.html',
+                make_logs('faculteit', attachment_hash='abc'),
+            )
+        self.assertEqual(len(self.journal), 0)
+
+    def test_crash_after_send(self):
+        self.crash('faculteit', failing='/messages/msg-1/move')
+        self.assertListEqual(list(self.journal.steps('msg-1')), ['started', 'draft', 'delivered'])
+        # the message is not sent again, only archived
+        self.assertListEqual(self.resume(), [('POST', '/messages/msg-1/move')])
+
+    def test_crash_before_send(self):
+        requests = self.crash('faculteit', failing='/messages/id-1/send')
+        self.assertEqual(requests[0], ('POST', '/mailFolders/Drafts/messages'))
+        self.assertListEqual(list(self.journal.steps('msg-1')), ['started', 'draft'])
+        # the saved draft is sent, the pdf is not attached again
+        self.assertListEqual(self.resume(), [
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_crash_after_inline_send(self):
+        self.crash('faculteit', failing='/messages/msg-1/move')
+        # the run stopped after the send, before 'delivered' was recorded
+        self.journal.clear('msg-1')
+        self.journal.record('msg-1', 'started', {'kind': 'message', 'folder_id': None, 'uploaded': False})
+        self.journal.record('msg-1', 'draft', 'id-1')
+        self.server.failing.add('/messages/id-1/send')
+        self.server.failing_status = 404
+        self.assertListEqual(self.resume(), [
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_crash_before_send_of_large_pdf(self):
+        with mock.patch.object(forwarder.attachments, 'UPLOAD_LIMIT', 100):
+            self.crash('faculteit', failing='/messages/id-1/send')
+            self.assertListEqual(list(self.journal.steps('msg-1')), ['started', 'draft', 'uploaded'])
+            self.assertListEqual(self.resume(), [
+                ('POST', '/messages/id-1/send'),
+                ('POST', '/messages/msg-1/move'),
+            ])
+
+    def test_draft_sent_before_step_was_recorded(self):
+        with mock.patch.object(forwarder.attachments, 'UPLOAD_LIMIT', 100):
+            self.crash('faculteit', failing='/messages/id-1/send')
+        # the draft was sent, but the run stopped before 'delivered' was recorded
+        self.server.failing.add('/messages/id-1/send')
+        self.server.failing_status = 404
+        self.assertListEqual(self.resume(), [
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_crash_during_upload(self):
+        with (
+            mock.patch.object(forwarder.attachments, 'UPLOAD_LIMIT', 100),
+            mock.patch.object(forwarder.attachments, 'UPLOAD_CHUNKSIZE', 10_000),
+        ):
+            requests = self.crash('csa', failing='/createUploadSession', save_as_draft=True)
+            self.assertEqual(requests[0], ('POST', '/mailFolders/folder-csa/messages'))
+            self.assertListEqual(list(self.journal.steps('msg-1')), ['started', 'draft'])
+            # the downloaded pdf was removed after the crashed run
+            (self.folder / 'abc.pdf').unlink()
+            requests = self.resume()
+        self.assertListEqual(requests[:2], [
+            ('GET', '/messages/msg-1/attachments/att-2/$value'),
+            ('POST', '/messages/id-1/attachments/createUploadSession'),
+        ])
+        self.assertEqual(requests[-1], ('POST', '/messages/msg-1/move'))
+        self.assertNotIn(('POST', '/messages/id-1/send'), requests)
+
+    def test_crash_after_forward_is_saved(self):
+        requests = self.crash('issue', failing='/messages/id-1/send')
+        self.assertTrue(requests[0][1].endswith('/messages/msg-1/createForward'))
+        self.assertEqual(self.journal.steps('msg-1')['draft'], 'id-1')
+        self.assertListEqual(self.resume(), [
+            ('POST', '/messages/id-1/send'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_crash_before_move_of_forward(self):
+        self.crash('issue', failing='/messages/id-1/move', save_as_draft=True)
+        self.assertListEqual(self.resume(), [
+            ('POST', '/messages/id-1/move'),
+            ('POST', '/messages/msg-1/move'),
+        ])
+
+    def test_crash_before_first_step(self):
+        self.crash('faculteit', failing='/mailFolders/Drafts/messages')
+        self.assertListEqual(list(self.journal.steps('msg-1')), ['started'])
+        # nothing was sent: the message is processed again
+        self.assertFalse(forwarder.resume_message(self.message, self.journal.entry('msg-1')))
+        self.assertEqual(len(self.journal), 0)
+        self.assertListEqual(self.get_requests(), [])
+
+    def test_resume_messages(self):
+        self.crash('faculteit', failing='/messages/msg-1/move')
+        self.journal.record('msg-2', 'started', {'kind': 'forward', 'folder_id': None})
+        self.journal.record('msg-gone', 'delivered')
+        messages = {i:self.get_message(i) for i in ['msg-1', 'msg-2', 'msg-3']}
+        remaining = script.resume_messages(messages)
+        self.assertListEqual(list(remaining), ['msg-2', 'msg-3'])
+        self.assertEqual(len(self.journal), 0)
+        self.assertListEqual(self.get_requests(), [('POST', '/messages/msg-1/move')])
+
+    def test_failed_resume_is_moved_to_issue(self):
+        with mock.patch.object(forwarder.attachments, 'UPLOAD_LIMIT', 100):
+            self.crash('faculteit', failing='/messages/id-1/send')
+        self.server.failing.add('/messages/id-1/send')
+        messages = {i:self.get_message(i) for i in ['msg-1', 'msg-2']}
+        with mock.patch('builtins.print') as print_:
+            remaining = script.resume_messages(messages)
+        self.assertListEqual(list(remaining), ['msg-2'])
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(json.loads(self.server.requests[-1][2])['destinationId'], 'folder-issue')
+        self.assertEqual(self.get_requests()[-1], ('POST', '/messages/msg-1/move'))
+        self.assertIn("'issue'", print_.call_args.args[0])
+
+    def test_failed_resume_stays_in_journal(self):
+        self.crash('faculteit', failing='/messages/msg-1/move')
+        self.server.failing.add('/messages/msg-1/move')
+        messages = {'msg-1': self.get_message('msg-1')}
+        with mock.patch('builtins.print'):
+            remaining = script.resume_messages(messages)
+        self.assertDictEqual(remaining, {})
+        self.assertEqual(len(self.journal), 1)
+
+    def test_test_run_does_not_resume(self):
+        self.crash('faculteit', failing='/messages/msg-1/move')
+        messages = {'msg-1': self.get_message('msg-1')}
+        self.assertDictEqual(script.resume_messages(messages, test_run=True), messages)
+        self.assertEqual(len(self.journal), 1)
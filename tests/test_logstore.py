@@ -0,0 +1,116 @@
+import tempfile
+import unittest
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+from bbc_forwarder import dataset
+from bbc_forwarder.logstore import LogStore
+from benchmarks.corpus import make_records
+
+
+def make_logs(statuses: dict, week: int = 1) -> pd.DataFrame:
+    "Return logs with one pdf per message, with status (and soort) by object_id."
+    return pd.DataFrame([
+        dict(
+            object_id = object_id,
+            attachment_id = f"att-{object_id}",
+            attachment_hash = f"hash-{object_id}",
+            is_pdf = True,
+            status = status,
+            soort = 'faculteit' if status == 'one_matched_sinh_id' else 'issue',
+            instelling = frozenset(['UU']),
+        )
+        for object_id, status in statuses.items()
+    ]).pipe(dataset.to_categoricals)
+
+
+class Test_LogStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = LogStore(Path(self.tmp.name) / 'logs.sqlite3')
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_append_dataset(self):
+        logs = dataset.create_dataset(make_records(50))
+        self.store.append(logs, started=datetime(2021, 8, 2, 9))
+        self.store.append(logs, started=datetime(2021, 8, 2, 14))
+        runs = self.store.runs()
+        self.assertListEqual(runs.run_id.to_list(), [1, 2])
+        self.assertListEqual(runs.n_messages.to_list(), [50, 50])
+        records = self.store.read(since='2021-08-02', until='2021-08-02')
+        self.assertEqual(len(records), 2 * len(logs))
+        self.assertListEqual(
+            records.loc[records.run_id == 1, 'object_id'].to_list(),
+            logs.object_id.to_list(),
+        )
+        self.assertTrue(self.store.read(since='2021-08-03').empty)
+
+    def test_new_columns(self):
+        self.store.append(make_logs({'msg-1': 'no_student_matched'}))
+        self.store.append(make_logs({'msg-2': 'no_pdfs'}).assign(tier='fast'))
+        records = self.store.read()
+        self.assertTrue(pd.isna(records.tier[0]))
+        self.assertEqual(records.tier[1], 'fast')
+        self.assertListEqual(records.instelling.to_list(), ['UU', 'UU'])
+
+    def test_unmatched(self):
+        runs = [
+            (datetime(2021, 8, 2), {'msg-1': 'no_student_matched', 'msg-2': 'no_student_matched'}),
+            (datetime(2021, 8, 5), {'msg-1': 'no_student_matched', 'msg-2': 'one_matched_sinh_id'}),
+            # msg-1 was moved back to the folder and got another id
+            (datetime(2021, 8, 9), {'msg-1b': 'no_student_matched', 'msg-3': 'no_student_matched'}),
+        ]
+        for started, statuses in runs:
+            logs = make_logs(statuses)
+            logs.loc[logs.object_id == 'msg-1b', 'attachment_hash'] = 'hash-msg-1'
+            self.store.append(logs, started=started)
+        unmatched = self.store.unmatched().set_index('bbc')
+        self.assertListEqual(unmatched.index.to_list(), ['hash-msg-1', 'hash-msg-3'])
+        self.assertEqual(unmatched.loc['hash-msg-1', 'days_unmatched'], 7)
+        self.assertEqual(unmatched.loc['hash-msg-1', 'object_id'], 'msg-1b')
+        self.assertEqual(unmatched.loc['hash-msg-3', 'days_unmatched'], 0)
+        self.assertEqual(len(self.store.unmatched('msg-3')), 1)
+        self.assertTrue(self.store.unmatched('msg-2').empty)
+
+    def test_issues_per_week(self):
+        self.store.append(make_logs({'msg-1': 'no_pdfs', 'msg-2': 'too_many_pdfs'}), started=datetime(2021, 8, 2))
+        self.store.append(make_logs({'msg-1': 'no_pdfs', 'msg-3': 'no_pdfs'}), started=datetime(2021, 8, 3))
+        self.store.append(make_logs({'msg-1': 'one_matched_sinh_id'}), started=datetime(2021, 8, 10))
+        result = self.store.issues_per_week()
+        expected = pd.DataFrame(
+            {'no_pdfs': [2], 'too_many_pdfs': [1]},
+            index = pd.Index(['2021-W31'], name='week'),
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_export_excel(self):
+        self.store.append(make_logs({'msg-1': 'no_pdfs'}), started=datetime(2021, 8, 2, 9))
+        self.store.append(make_logs({'msg-2': 'no_pdfs'}), started=datetime(2021, 8, 2, 14))
+        self.store.append(make_logs({'msg-3': 'no_pdfs'}), started=datetime(2021, 8, 3))
+        path = self.store.export_excel(Path(self.tmp.name) / 'logs.xlsx', run_date='2021-08-02')
+        exported = pd.read_excel(path, index_col=0)
+        self.assertListEqual(exported.object_id.to_list(), ['msg-1', 'msg-2'])
+
+    def test_unreported(self):
+        self.assertIsNone(self.store.last_report())
+        self.store.append(make_logs({'msg-1': 'no_pdfs'}), started=datetime(2021, 8, 2, 9))
+        self.store.append_metrics({'durations': {'parse': [1.0]}, 'counters': {}})
+        self.store.append(make_logs({'msg-2': 'no_pdfs'}), started=datetime(2021, 8, 2, 14))
+        self.assertListEqual(self.store.unreported().object_id.to_list(), ['msg-1', 'msg-2'])
+        self.store.mark_reported(date(2021, 8, 2), sent=datetime(2021, 8, 2, 17))
+        self.assertEqual(self.store.last_report(), date(2021, 8, 2))
+        self.assertTrue(self.store.unreported().empty)
+        self.assertListEqual(self.store.unreported_metrics(), [])
+        # metrics of a run that failed before its logs were appended
+        self.store.append_metrics({'durations': {'parse': [2.0]}, 'counters': {}})
+        self.store.append(make_logs({'msg-3': 'no_pdfs'}), started=datetime(2021, 8, 2, 18))
+        self.assertListEqual(self.store.unreported().object_id.to_list(), ['msg-3'])
+        self.assertListEqual(
+            self.store.unreported_metrics(),
+            [{'durations': {'parse': [2.0]}, 'counters': {}}],
+        )
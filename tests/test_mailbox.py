@@ -0,0 +1,168 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from O365.connection import MSGraphProtocol
+
+from bbc_forwarder import mailbox
+from bbc_forwarder.config import CONFIG
+
+
+class FakeFolder:
+    "Folder with child folders, counting the requests to find them."
+    def __init__(self, name, folder_id, children=(), counter=None):
+        self.name = name
+        self.folder_id = folder_id
+        self.children = list(children)
+        self.counter = counter
+
+    def get_folder(self, folder_name):
+        self.counter['get_folder'] += 1
+        return next(i for i in self.children if i.name == folder_name)
+
+    def get_folders(self):
+        self.counter['get_folders'] += 1
+        return self.children
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeGraphMailbox:
+    """Mailbox with the workspace location and folders from config. Answers
+    batch requests for the folders in the tree."""
+    protocol = MSGraphProtocol()
+
+    def __init__(self, folders: dict|None = None):
+        self.counter = {'get_folder': 0, 'get_folders': 0, 'batch': 0}
+        folders = CONFIG['forwarder']['folders'] if folders is None else folders
+        children = [
+            FakeFolder(name, f"id-{key}", counter=self.counter)
+            for key, name in folders.items()
+        ]
+        location = CONFIG['forwarder']['location'].split('/')
+        folder = FakeFolder(location[-1], 'id-workspace', children, self.counter)
+        for i, name in enumerate(reversed(location[:-1])):
+            folder = FakeFolder(name, f"id-location-{i}", [folder], self.counter)
+        self.inbox = FakeFolder('Inbox', 'id-inbox', [folder], self.counter)
+        self.con = self
+        self.batches = []
+
+    def inbox_folder(self):
+        return self.inbox
+
+    def build_url(self, endpoint):
+        return f"{self.protocol.service_url}users/bbc@uu.nl{endpoint}"
+
+    def folders(self):
+        stack, result = [(self.inbox, None)], {}
+        while stack:
+            folder, parent = stack.pop()
+            result[folder.folder_id] = (folder, parent)
+            stack.extend((child, folder) for child in folder.children)
+        return result
+
+    def post(self, url, data):
+        self.counter['batch'] += 1
+        self.batches.append((url, data))
+        folders = self.folders()
+        responses = []
+        for request in data['requests']:
+            folder_id = request['url'].split('/mailFolders/')[1].split('?')[0]
+            if folder_id not in folders:
+                responses.append({'id': request['id'], 'status': 404, 'body': {}})
+                continue
+            folder, parent = folders[folder_id]
+            body = {
+                'id': folder_id,
+                'displayName': folder.name,
+                'parentFolderId': parent.folder_id,
+            }
+            responses.append({'id': request['id'], 'status': 200, 'body': body})
+        return FakeResponse({'responses': responses})
+
+    def folder_constructor(self, parent, folder_id):
+        return FakeFolder(None, folder_id, counter=self.counter)
+
+
+class Test_Workspace(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'folders.json'
+        settings = {'folder_cache': {'path': self.path, 'ttl_hours': 1}}
+        patch = mock.patch.dict(CONFIG['forwarder'], settings)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_workspace(self, box):
+        account = mock.Mock()
+        account.mailbox.return_value = box
+        return mailbox.Workspace(connect=lambda: account), account
+
+    def test_nothing_is_connected_until_used(self):
+        connect = mock.Mock()
+        workspace = mailbox.Workspace(connect=connect)
+        connect.assert_not_called()
+        workspace.mailbox
+        connect.assert_called_once()
+
+    def test_discover_and_store(self):
+        box = FakeGraphMailbox()
+        workspace, _ = self.make_workspace(box)
+        expected = {key:f"id-{key}" for key in CONFIG['forwarder']['folders']}
+        self.assertDictEqual(workspace.folder_ids, expected)
+        self.assertEqual(workspace.folder.folder_id, 'id-workspace')
+        self.assertEqual(workspace.get_folder('logs').folder_id, 'id-logs')
+        self.assertEqual(box.counter['batch'], 0)
+        stored = json.loads(self.path.read_text())
+        self.assertDictEqual(stored['folder_ids'], expected)
+
+    def test_stored_ids_are_verified_in_one_batch(self):
+        self.make_workspace(FakeGraphMailbox())[0].folder_ids
+        box = FakeGraphMailbox()
+        workspace, _ = self.make_workspace(box)
+        self.assertEqual(workspace.folder_ids['archived'], 'id-archived')
+        self.assertDictEqual(box.counter, {'get_folder': 0, 'get_folders': 0, 'batch': 1})
+        url, data = box.batches[0]
+        self.assertTrue(url.endswith('/v1.0/$batch'))
+        self.assertTrue(data['requests'][0]['url'].startswith('/users/bbc@uu.nl/mailFolders/'))
+
+    def test_failed_verification_discovers_again(self):
+        self.make_workspace(FakeGraphMailbox())[0].folder_ids
+        folders = CONFIG['forwarder']['folders'] | {'logs': 'renamed'}
+        box = FakeGraphMailbox(folders)
+        workspace, _ = self.make_workspace(box)
+        with self.assertRaises(EnvironmentError):
+            workspace.folder_ids
+        self.assertEqual(box.counter['batch'], 1)
+        self.assertEqual(box.counter['get_folders'], 1)
+
+    def test_expired_ids_are_not_verified(self):
+        self.make_workspace(FakeGraphMailbox())[0].folder_ids
+        stored = json.loads(self.path.read_text())
+        stored['created'] = time.time() - 2 * 3600
+        self.path.write_text(json.dumps(stored))
+        box = FakeGraphMailbox()
+        workspace, _ = self.make_workspace(box)
+        workspace.folder_ids
+        self.assertEqual(box.counter['batch'], 0)
+        self.assertEqual(box.counter['get_folders'], 1)
+
+    def test_module_attributes(self):
+        box = FakeGraphMailbox()
+        workspace, _ = self.make_workspace(box)
+        with mock.patch.object(mailbox, '_workspace', workspace):
+            self.assertIs(mailbox.MAILBOX, box)
+            self.assertEqual(mailbox.FOLDER_IDS['to_process'], 'id-to_process')
+            self.assertEqual(mailbox.WORKSPACE.folder_id, 'id-workspace')
+        with self.assertRaises(AttributeError):
+            mailbox.OTHER
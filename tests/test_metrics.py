@@ -0,0 +1,100 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import engine, parser
+from bbc_forwarder.metrics import METRICS, Metrics
+from bbc_forwarder.templates import ENV
+from tests.fakes import FakeMailboxServer, FakeOsiris, FakeServerConnection, make_messages
+
+
+class Test_Metrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        for i in range(1, 101):
+            self.metrics.add('extract', i / 1000)
+        self.metrics.count('download', 'bytes', 1024)
+
+    def test_summary(self):
+        summary = self.metrics.summary()
+        self.assertListEqual(summary.index.to_list(), ['extract', 'download'])
+        extract = summary.loc['extract']
+        self.assertEqual(extract.aantal, 100)
+        self.assertAlmostEqual(extract.totaal_s, 5.05)
+        self.assertAlmostEqual(extract.p50_ms, 50.5)
+        self.assertAlmostEqual(extract.p95_ms, 95.05)
+        self.assertAlmostEqual(extract.max_ms, 100)
+        self.assertEqual(summary.loc['download', 'bytes'], 1024)
+        self.assertTrue(pd.isna(summary.loc['download', 'p50_ms']))
+
+    def test_merge(self):
+        other = Metrics()
+        other.merge(self.metrics.export())
+        other.merge(self.metrics.export())
+        self.assertEqual(other.summary().loc['extract', 'aantal'], 200)
+        self.assertEqual(other.summary().loc['download', 'bytes'], 2048)
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'metrics.jsonl'
+            self.metrics.write(path)
+            self.metrics.write(path)
+            lines = [json.loads(line) for line in path.read_text().splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]['stage'], 'extract')
+        self.assertEqual(lines[0]['aantal'], 100)
+        self.assertIsNone(lines[1]['p95_ms'])
+
+    def test_template(self):
+        body = ENV.get_template('template.logs.jinja.html').render(
+            n_records = 0,
+            metrics = self.metrics.summary(),
+            today = '2021-08-01',
+        )
+        self.assertIn('Doorlooptijden', body)
+        self.assertIn('p95_ms', body)
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+class Test_Instrumentation(unittest.TestCase):
+    def setUp(self):
+        METRICS.reset()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(parser, 'get_download_folder', return_value=Path(self.tmp.name)),
+            mock.patch.object(parser, 'osi', FakeOsiris()),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmp.cleanup()
+        METRICS.reset()
+
+    def test_parse_all_messages(self, _):
+        for workers in [0, 2]:
+            METRICS.reset()
+            parser.parse_all_messages(make_messages(), workers=workers, state=None)
+            summary = METRICS.summary()
+            # four pdfs, two of which are read again in full (no date found)
+            self.assertEqual(summary.loc['read_pdf', 'aantal'], 6)
+            self.assertEqual(summary.loc['parse_message', 'aantal'], 5)
+            self.assertEqual(summary.loc['get_kandidaten', 'aantal'], 1)
+            self.assertGreater(summary.loc['download', 'bytes'], 0)
+
+    def test_retries(self, _):
+        with FakeMailboxServer(throttle_every=3, retry_after=0) as server:
+            connection = FakeServerConnection(server.url)
+            throttle = engine.Throttle(rate=1000, burst=1000)
+            throttle.install(connection)
+            for i in range(6):
+                connection.post(f"/messages/msg-{i}/move")
+        summary = METRICS.summary()
+        self.assertEqual(summary.loc['graph', 'retries'], throttle.n_throttled)
+        self.assertEqual(summary.loc['graph', 'aantal'], 6 + throttle.n_throttled)
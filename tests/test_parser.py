@@ -1,6 +1,28 @@
+import re
+import tempfile
 import unittest
+from pathlib import Path
+from unittest import mock
 import pandas as pd
 from bbc_forwarder import parser
+from bbc_forwarder.state import State
+from tests.fakes import (
+    BBC, POPULATION, FakeAttachment, FakeMessage, FakeOsiris, make_messages, make_pdf,
+)
+
+
+def setUpModule():
+    global DOWNLOADS, PATCH_DOWNLOADS
+    DOWNLOADS = tempfile.TemporaryDirectory()
+    PATCH_DOWNLOADS = mock.patch.object(
+        parser, 'get_download_folder', return_value=Path(DOWNLOADS.name),
+    )
+    PATCH_DOWNLOADS.start()
+
+
+def tearDownModule():
+    PATCH_DOWNLOADS.stop()
+    DOWNLOADS.cleanup()
 
 
 class Test_RemoveWhitespace(unittest.TestCase):
@@ -54,6 +76,18 @@ class Test_ReplaceMonths(unittest.TestCase):
         result = parser.replace_months(text)
         self.assertEqual(result, expected)
 
+    def test_edge_cases(self):
+        cases = {
+            '31-DEC-2020': '31-12-2020',
+            '1 ſep 2000': '1 09 2000',
+            'xjanov': 'x01ov',
+            '_jan': '_jan',
+            'éfeb': 'éfeb',
+            'Maart': 'Maart',
+        }
+        for text, expected in cases.items():
+            self.assertEqual(parser.replace_months(text), expected)
+
 
 class Test_FindDatestrings(unittest.TestCase):
     def test(self):
@@ -85,6 +119,194 @@ class Test_GetEarliest(unittest.TestCase):
         result = parser.get_earliest(datestrings)
         self.assertEqual(result, expected)
 
+    def test_invalid_dates(self):
+        self.assertIsNone(parser.get_earliest(['29-02-2002', '31-13-2001']))
 
-class Test_SearchName(unittest.TestCase):
-    pass
+
+class Test_Matcher(unittest.TestCase):
+    text = """
+    J. Smit-Jansen, geboren op 01-01-2001
+    De heer O'Brien (Bakker) verklaart
+    Jansen, Janssen en Vries-de Vries
+    """
+    words = [
+        'Smit', 'Smit-Jansen', 'Jansen', 'Jans', 'Janssen', "O'Brien",
+        'Brien', '(Bakker)', 'Bakker', 'Vries', 'Vries-de Vries', 'ries',
+        'Berg', 'Smit.Jansen', None,
+    ]
+
+    def test_equals_separate_search(self):
+        for boundaries in [True, False]:
+            boundary = r"\b" if boundaries else ''
+            expected = {
+                word for word in self.words if word and
+                re.search(rf"{boundary}{re.escape(word)}{boundary}", self.text)
+            }
+            matcher = parser.Matcher(self.words, boundaries=boundaries)
+            self.assertSetEqual(matcher.find(self.text), expected)
+
+    def test_positions(self):
+        matcher = parser.Matcher(['Jansen', 'Smit'])
+        hits = sorted(matcher.finditer(self.text))
+        self.assertListEqual(
+            [(self.text[i:i+len(word)], word) for i, word in hits],
+            [('Smit', 'Smit'), ('Jansen', 'Jansen'), ('Jansen', 'Jansen')],
+        )
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+class Test_ParseAllMessages(unittest.TestCase):
+    def test_parallel_equals_serial(self, _):
+        with mock.patch.object(parser, 'osi', FakeOsiris()):
+            serial = parser.parse_all_messages(make_messages(), workers=0)
+            parallel = parser.parse_all_messages(make_messages(), workers=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+        self.assertListEqual(
+            serial.object_id.unique().tolist(),
+            ['msg-1', 'msg-2', 'msg-3', 'msg-4', 'msg-5'],
+        )
+        self.assertListEqual(
+            serial.studentnummer.dropna().tolist(),
+            ['1234567', '7654321'],
+        )
+
+    def test_batched_equals_per_message(self, _):
+        osiris = FakeOsiris()
+        with mock.patch.object(parser, 'osi', osiris):
+            expected = pd.DataFrame([
+                record
+                for message in make_messages()
+                for record in parser.parse_message(message)
+            ])
+            self.assertEqual(osiris.n_queries, 2)
+            osiris.n_queries = 0
+            messages = make_messages() + make_messages()
+            result = parser.parse_all_messages(messages, workers=0)
+        self.assertEqual(osiris.n_queries, 1)
+        pd.testing.assert_frame_equal(result.iloc[:len(expected)], expected)
+
+    def test_matcher_per_date(self, _):
+        messages = make_messages() + make_messages()
+        with (
+            mock.patch.object(parser, 'osi', FakeOsiris()),
+            mock.patch.object(parser, 'Matcher', wraps=parser.Matcher) as matcher,
+        ):
+            result = parser.parse_all_messages(messages, workers=0)
+        # 4 pdfs with a birth date on 2 dates
+        self.assertEqual(matcher.call_count, 2)
+        self.assertListEqual(result.studentnummer.dropna().tolist(), ['1234567', '7654321'] * 2)
+
+    def test_chunks(self, _):
+        osiris = FakeOsiris()
+        dates = pd.date_range('2000-01-01', periods=5).tolist() * 2
+        with (
+            mock.patch.object(parser, 'osi', osiris),
+            mock.patch.object(parser, 'CHUNKSIZE', 2),
+        ):
+            kandidaten = parser.get_all_kandidaten(dates)
+        self.assertEqual(osiris.n_queries, 3)
+        self.assertListEqual(list(kandidaten), sorted(set(dates)))
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+@mock.patch.dict(parser.CONFIG['parser'], fast_tier_pages=1)
+class Test_Tiers(unittest.TestCase):
+    bbc = BBC.format(naam='J. de Vries', geboortedatum='3 maart 2001')
+
+    def parse(self, *pages):
+        message = FakeMessage('msg', [FakeAttachment('att', 'bbc.pdf', make_pdf(*pages))])
+        osiris = FakeOsiris()
+        with mock.patch.object(parser, 'osi', osiris):
+            serial = pd.DataFrame(parser.parse_message(message))
+            batched = parser.parse_all_messages([message], workers=0)
+        pd.testing.assert_frame_equal(serial, batched)
+        return batched
+
+    def test_fast(self, _):
+        result = self.parse(self.bbc, 'bijlage\n' * 20)
+        self.assertListEqual(result.tier.to_list(), ['fast'])
+        self.assertListEqual(result.studentnummer.to_list(), ['1234567'])
+
+    def test_no_date_on_first_page(self, _):
+        result = self.parse('Bewijs betaald collegegeld, zie volgende pagina', self.bbc)
+        self.assertListEqual(result.tier.to_list(), ['full'])
+        self.assertListEqual(result.studentnummer.to_list(), ['1234567'])
+
+    def test_name_not_on_first_page(self, _):
+        first, second = self.bbc.split('J. de Vries')
+        result = self.parse(first, 'J. de Vries' + second)
+        self.assertListEqual(result.tier.to_list(), ['full'])
+        self.assertListEqual(result.studentnummer.to_list(), ['1234567'])
+
+    def test_full_only(self, _):
+        with mock.patch.dict(parser.CONFIG['parser'], fast_tier_pages=None):
+            result = self.parse(self.bbc)
+        self.assertListEqual(result.tier.to_list(), ['full'])
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+class Test_Incremental(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'state.pickle'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def parse(self, messages, osiris):
+        state = State(self.path, version=parser.get_version())
+        with mock.patch.object(parser, 'osi', osiris):
+            return parser.parse_all_messages(messages, workers=0, state=state)
+
+    def test_known_messages_are_not_downloaded(self, _):
+        expected = self.parse(make_messages(), FakeOsiris())
+        messages = make_messages()
+        result = self.parse(messages, FakeOsiris())
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertListEqual([i.con.n_downloads for i in messages], [0] * 5)
+
+    def test_rematch_with_current_candidates(self, _):
+        without_vries = FakeOsiris(POPULATION.query("achternaam != 'Vries'"))
+        first = self.parse(make_messages(), without_vries)
+        self.assertListEqual(first.studentnummer.dropna().tolist(), ['7654321'])
+        messages = make_messages()
+        result = self.parse(messages, FakeOsiris())
+        self.assertListEqual(result.studentnummer.dropna().tolist(), ['1234567', '7654321'])
+        self.assertEqual(messages[0].con.n_downloads, 0)
+
+    def test_new_and_removed_messages(self, _):
+        self.parse(make_messages()[:2], FakeOsiris())
+        messages = make_messages()[1:]
+        result = self.parse(messages, FakeOsiris())
+        self.assertListEqual([i.con.n_downloads for i in messages], [0, 1, 1, 1])
+        state = State(self.path, version=parser.get_version())
+        self.assertListEqual(sorted(state.messages), ['msg-2', 'msg-3', 'msg-4', 'msg-5'])
+        self.assertListEqual(result.studentnummer.dropna().tolist(), ['7654321'])
+
+    def test_other_version_is_discarded(self, _):
+        self.parse(make_messages(), FakeOsiris())
+        self.assertEqual(len(State(self.path, version='other')), 0)
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+class Test_SelectiveDownload(unittest.TestCase):
+    def test_only_pdfs_are_downloaded(self, _):
+        message = make_messages()[2]
+        with mock.patch.object(parser, 'osi', FakeOsiris()):
+            result = pd.DataFrame(parser.parse_message(message))
+        self.assertEqual(message.con.n_downloads, 1)
+        self.assertTrue(message.con.requests[-1].endswith('/att-3/$value'))
+        self.assertListEqual(result.attachment_size.tolist()[:1], [9])
+        self.assertListEqual(result.studentnummer.dropna().tolist(), ['7654321'])
+
+    def test_size_limit(self, _):
+        settings = {'max_size_mb': 0.0001}
+        with (
+            mock.patch.dict(parser.CONFIG['parser'], attachments=settings),
+            mock.patch.object(parser, 'osi', FakeOsiris()),
+        ):
+            messages = make_messages()
+            result = parser.parse_all_messages(messages, workers=0)
+        self.assertListEqual([i.con.n_downloads for i in messages], [0, 0, 0, 1, 0])
+        self.assertFalse(result.query("attachment_id == 'att-1'").is_parsed.iloc[0])
+        self.assertNotIn('studentnummer', result)
@@ -0,0 +1,109 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import attachments, dataset, logstore, parser, pipeline
+from bbc_forwarder.state import State
+from tests.fakes import POPULATION, FakeOsiris, make_messages
+
+
+# candidates with the enrolment fields used to classify the messages
+ENROLMENTS = POPULATION.assign(
+    soort_inschrijving = ['F', 'S', 'F'],
+    opleiding = ['B Wiskunde', 'B Rechten', 'B Geschiedenis'],
+    aggregaat_2 = None,
+    aggregaat_1 = None,
+    faculteit = ['BETA', 'REBO', 'GW'],
+)
+
+
+@mock.patch.object(parser, 'get_cache', return_value=None)
+@mock.patch.object(parser, 'osi', FakeOsiris(ENROLMENTS))
+class Test_Pipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.downloads = Path(self.tmp.name) / 'attachments'
+        self.state = None
+        patches = [
+            mock.patch.object(parser, 'get_download_folder', return_value=self.downloads),
+            mock.patch.object(parser, 'get_state', side_effect=lambda: self.state),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.events = []
+        parse_all_messages = parser.parse_all_messages
+        def parse(messages, **kwargs):
+            messages = list(messages)
+            self.events.append(('parse', [i.object_id for i in messages]))
+            return parse_all_messages(messages, workers=0, **kwargs)
+        patch = mock.patch.object(parser, 'parse_all_messages', side_effect=parse)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def process(self, logs, page):
+        self.events.append(('process', sorted(page)))
+        self.assertSetEqual(set(logs.object_id), set(page))
+
+    def test_pages_are_processed_in_turn(self, _):
+        pipeline.run(make_messages(), self.process, page_size=2)
+        expected = [
+            ('parse', ['msg-1', 'msg-2']),
+            ('process', ['msg-1', 'msg-2']),
+            ('parse', ['msg-3', 'msg-4']),
+            ('process', ['msg-3', 'msg-4']),
+            ('parse', ['msg-5']),
+            ('process', ['msg-5']),
+        ]
+        self.assertListEqual(self.events, expected)
+
+    def test_summaries_equal_complete_run(self, _):
+        result = pipeline.run(make_messages(), self.process, page_size=2)
+        records = parser.parse_all_messages(make_messages())
+        expected = pipeline.summarize(dataset.create_dataset(records))
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertEqual(len(result), 5)
+
+    def test_downloads_are_cleared_per_page(self, _):
+        downloaded = []
+        def process(logs, page):
+            downloaded.append({i.stem for i in self.downloads.glob('*')})
+        pipeline.run(make_messages(), process, page_size=2)
+        hashes = [set(logs.attachment_hash.dropna()) for logs in self.pages()]
+        self.assertListEqual(downloaded, hashes)
+        self.assertFalse(self.downloads.exists())
+
+    def pages(self):
+        for i in range(0, 5, 2):
+            records = parser.parse_all_messages(make_messages()[i:i + 2])
+            attachments.clear(self.downloads)
+            yield records
+
+    def test_state_is_pruned_after_all_pages(self, _):
+        path = Path(self.tmp.name) / 'state.pickle'
+        self.state = State(path, version=parser.get_version())
+        pipeline.run(make_messages()[:4], self.process, page_size=2)
+        self.assertListEqual(sorted(self.state.messages), ['msg-1', 'msg-2', 'msg-3', 'msg-4'])
+        pipeline.run(make_messages()[2:], self.process, page_size=2)
+        state = State(path, version=parser.get_version())
+        self.assertListEqual(sorted(state.messages), ['msg-3', 'msg-4', 'msg-5'])
+
+    def test_no_messages(self, _):
+        result = pipeline.run([], self.process)
+        self.assertListEqual(list(result.columns), pipeline.SUMMARY_FIELDS)
+        self.assertListEqual(self.events, [])
+
+    def test_summaries_identify_bbc_as_complete_run(self, _):
+        result = pipeline.run(make_messages(), self.process, page_size=2)
+        logs = dataset.create_dataset(parser.parse_all_messages(make_messages()))
+        self.assertIn('attachment_hash', result)
+        expected = logstore.get_messages(logstore.to_storage(logs)).set_index('object_id').bbc
+        summaries = logstore.get_messages(logstore.to_storage(result)).set_index('object_id').bbc
+        pd.testing.assert_series_equal(summaries, expected)
+        self.assertTrue(summaries.ne(summaries.index).any())
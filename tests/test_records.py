@@ -0,0 +1,40 @@
+import unittest
+
+import pandas as pd
+
+from bbc_forwarder import parser
+from bbc_forwarder.records import AttachmentRecord, MessageRecord, RecordBuilder
+from benchmarks.corpus import make_parse_inputs
+
+
+class Test_RecordBuilder(unittest.TestCase):
+    def test_equals_dicts(self):
+        messages, message_attachments, extracted, kandidaten = make_parse_inputs(200)
+        expected = pd.DataFrame([
+            record
+            for message in messages
+            for record in parser.parse_message(
+                message,
+                extracted = extracted,
+                kandidaten = kandidaten,
+                attachments = message_attachments[message.object_id],
+            )
+        ])
+        result = parser.build_records(messages, message_attachments, extracted, kandidaten)
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertIn('n_sinh', result)
+
+    def test_message_without_records(self):
+        messages, *_ = make_parse_inputs(1)
+        builder = RecordBuilder()
+        builder.add(MessageRecord.from_message(messages[0]), [])
+        self.assertEqual(len(builder), 0)
+        pd.testing.assert_frame_equal(builder.to_frame(), pd.DataFrame())
+
+    def test_attachment_fields(self):
+        record = AttachmentRecord('att', 'logo.png', 100, None, False)
+        self.assertListEqual(
+            [key for key, _ in record.items()],
+            ['attachment_id', 'attachment_name', 'attachment_size', 'attachment_hash', 'is_pdf'],
+        )
+        self.assertFalse(hasattr(record, '__dict__'))
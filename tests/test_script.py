@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import script_bbc_forwarder as script
+from bbc_forwarder.config import PATH, read_json_from_path
+
+
+class Test_Run(unittest.TestCase):
+    def setUp(self):
+        self.calls = mock.Mock()
+        self.logs = pd.DataFrame({'object_id': ['msg-1']})
+        patches = [
+            mock.patch.object(script.mailbox, 'get_workspace'),
+            mock.patch.dict(script.CONFIG['forwarder'], streaming={'enabled': False}),
+            mock.patch.object(script.parser, 'list_messages', return_value=[]),
+            mock.patch.object(script.parser, 'parse_all_messages'),
+            mock.patch.object(script.dataset, 'create_dataset', return_value=self.logs),
+            mock.patch.object(script, 'resume_messages', side_effect=lambda messages, test_run: messages),
+            mock.patch.object(script, 'get_pending_messages', return_value={}),
+            mock.patch.object(script, 'store_logs', self.calls.store_logs),
+            mock.patch.object(script, 'process_tasks', self.calls.process_tasks),
+            mock.patch.object(script, 'send_log_report', self.calls.send_log_report),
+            mock.patch.object(script.attachments, 'clear'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_calls(self) -> list[str]:
+        return [name for name, *_ in self.calls.mock_calls]
+
+    def test_report_is_sent_after_processing(self):
+        script.run(send_report=True)
+        self.assertListEqual(self.get_calls(), ['store_logs', 'process_tasks', 'send_log_report'])
+
+    def test_report_is_sent_after_error(self):
+        self.calls.process_tasks.side_effect = RuntimeError('graph unavailable')
+        with self.assertRaises(RuntimeError):
+            script.run(send_report=True)
+        self.assertListEqual(self.get_calls(), ['store_logs', 'process_tasks', 'send_log_report'])
+        self.assertIs(self.calls.send_log_report.call_args.args[0], self.logs)
+
+    def test_processing_error_is_raised_after_report_error(self):
+        self.calls.process_tasks.side_effect = RuntimeError('graph unavailable')
+        self.calls.send_log_report.side_effect = ValueError('template error')
+        for streaming in [False, True]:
+            with (
+                self.subTest(streaming=streaming),
+                mock.patch.dict(script.CONFIG['forwarder'], streaming={'enabled': streaming, 'page_size': 2}),
+                mock.patch.object(script.parser, 'list_pages', return_value=[{'msg-1': mock.Mock()}]),
+                mock.patch.object(script.pipeline, 'parse', side_effect=lambda pages: ((page, None) for page in pages)),
+                mock.patch.object(script.pipeline, 'classify', side_effect=lambda parsed: ((page, self.logs) for page, _ in parsed)),
+                mock.patch.object(script.attachments, 'clear') as clear,
+                mock.patch('traceback.print_exc'),
+                mock.patch('builtins.print'),
+                self.assertRaisesRegex(RuntimeError, 'graph unavailable'),
+            ):
+                script.run(send_report=True)
+            clear.assert_called()
+
+    def test_report_error_is_raised(self):
+        self.calls.send_log_report.side_effect = ValueError('template error')
+        with (
+            mock.patch.object(script.attachments, 'clear') as clear,
+            self.assertRaisesRegex(ValueError, 'template error'),
+        ):
+            script.run(send_report=True)
+        clear.assert_called_once()
+
+    def test_processed_pages_are_reported_after_error(self):
+        def process(logs, messages, test_run):
+            if 'msg-3' in messages:
+                raise RuntimeError('graph unavailable')
+
+        self.calls.process_tasks.side_effect = process
+        messages = [mock.Mock(object_id=f"msg-{i}") for i in range(1, 5)]
+        with (
+            mock.patch.dict(script.CONFIG['forwarder'], streaming={'enabled': True, 'page_size': 2}),
+            mock.patch.object(
+                script.parser, 'list_pages',
+                side_effect=lambda folder, page_size, exclude: script.pipeline.paginate(messages, page_size),
+            ),
+            mock.patch.object(script.parser, 'parse_all_messages', return_value=pd.DataFrame()),
+            mock.patch.object(
+                script.dataset, 'create_dataset',
+                side_effect=[pd.DataFrame({'object_id': ['msg-1', 'msg-2']}), self.logs],
+            ),
+            self.assertRaises(RuntimeError),
+        ):
+            script.run(send_report=True)
+        reported = self.calls.send_log_report.call_args.args[0]
+        self.assertListEqual(reported.object_id.tolist(), ['msg-1', 'msg-2'])
+        self.calls.store_logs.assert_called_once()
+
+
+class Test_ExampleConfig(unittest.TestCase):
+    def setUp(self):
+        self.config = read_json_from_path(PATH / 'config.example.json')['forwarder']
+
+    def test_keys(self):
+        for soort in ['faculteit', 'csa', 'issue']:
+            with self.subTest(soort):
+                self.assertIn(soort, self.config['folders'])
+                self.assertIn(soort, self.config['subjects'])
+                self.assertIn(soort, self.config['settings']['save_as_draft'])
+        for key in ['to_process', 'logs', 'archived']:
+            self.assertIn(key, self.config['folders'])
+        self.assertIn('test_run', self.config['settings'])
+
+    def test_opt_in(self):
+        self.assertEqual(self.config['engine']['workers'], 1)
+        self.assertFalse(self.config['journal']['enabled'])
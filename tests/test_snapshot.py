@@ -0,0 +1,77 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import parser
+from bbc_forwarder.snapshot import Snapshot
+from tests.fakes import POPULATION, FakeOsiris
+
+
+class Test_Snapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.snapshot = Snapshot(Path(self.tmp.name) / 'population.sqlite3', 2021)
+        self.query = mock.Mock(return_value=POPULATION)
+
+    def tearDown(self):
+        self.snapshot.connection.close()
+        self.tmp.cleanup()
+
+    def test_full_refresh(self):
+        self.assertTrue(self.snapshot.is_empty)
+        self.snapshot.refresh(self.query)
+        self.query.assert_called_once_with(None)
+        self.assertFalse(self.snapshot.is_empty)
+        self.snapshot.refresh(self.query)
+        self.query.assert_called_once()
+
+    def test_incremental_refresh(self):
+        self.snapshot.refresh(self.query)
+        changes = POPULATION.iloc[[0]].assign(achternaam='de Vries')
+        self.query.return_value = changes
+        self.snapshot.refresh(self.query, max_age_minutes=0)
+        self.query.assert_called_with(self.snapshot.refreshed.normalize())
+        result = self.snapshot.lookup([pd.Timestamp('2001-03-03')])
+        self.assertListEqual(sorted(result.achternaam), ['Smit', 'de Vries'])
+
+    def test_lookup(self):
+        self.snapshot.refresh(self.query)
+        result = self.snapshot.lookup([pd.Timestamp('2001-03-03')] * 2)
+        self.assertListEqual(result.studentnummer.to_list(), ['1234567', '1111111'])
+        self.assertEqual(result.geboortedatum.dtype, POPULATION.geboortedatum.dtype)
+        self.assertTrue((result.bron == 'snapshot').all())
+
+    def test_stale(self):
+        self.snapshot.refresh(self.query)
+        self.query.side_effect = ConnectionError('osiris unavailable')
+        self.snapshot.refresh(self.query, max_age_minutes=0)
+        self.assertTrue(self.snapshot.stale)
+        result = self.snapshot.lookup([pd.Timestamp('2000-11-12')])
+        self.assertListEqual(result.bron.to_list(), ['snapshot_verouderd'])
+
+    def test_empty_unavailable(self):
+        self.query.side_effect = ConnectionError('osiris unavailable')
+        with self.assertRaises(ConnectionError):
+            self.snapshot.refresh(self.query)
+
+
+class Test_SnapshotKandidaten(unittest.TestCase):
+    def test_no_queries(self):
+        osiris = FakeOsiris()
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot = Snapshot(Path(tmp) / 'population.sqlite3', 2021)
+            snapshot.refresh(lambda sinds: POPULATION)
+            with (
+                mock.patch.object(parser, 'osi', osiris),
+                mock.patch.object(parser, 'get_snapshot', return_value=snapshot),
+            ):
+                kandidaten = parser.get_all_kandidaten(
+                    [pd.Timestamp('2001-03-03'), pd.Timestamp('1990-01-01')]
+                )
+            snapshot.connection.close()
+        self.assertEqual(osiris.n_queries, 0)
+        self.assertEqual(len(kandidaten[pd.Timestamp('2001-03-03')]), 2)
+        self.assertTrue(kandidaten[pd.Timestamp('1990-01-01')].empty)
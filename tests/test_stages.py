@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+from bbc_forwarder import parser
+from benchmarks import bench_stages
+from benchmarks.corpus import make_mailbox, make_population
+
+
+class Test_InMemoryMailbox(unittest.TestCase):
+    def test_parse(self):
+        population = make_population(20)
+        box = make_mailbox(30, population)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.object(parser, 'get_cache', return_value=None),
+            mock.patch.object(parser, 'get_download_folder', return_value=Path(tmp)),
+            mock.patch.object(parser, 'query_kandidaten', side_effect=lambda dates: (
+                population.loc[population.geboortedatum.isin(dates)]
+            )),
+        ):
+            messages = list(parser.list_messages(box.get_folder()))
+            result = parser.parse_all_messages(messages, workers=0, state=None)
+        self.assertEqual(result.object_id.nunique(), 30)
+        found = set(result.studentnummer.dropna())
+        self.assertTrue(found)
+        self.assertTrue(found <= set(population.studentnummer))
+        self.assertEqual(box.requests[0], ('GET', '/mailFolders/folder-to_process/messages'))
+
+
+class Test_BenchStages(unittest.TestCase):
+    def test_run_stages(self):
+        seconds = bench_stages.run_stages(20)
+        self.assertListEqual(list(seconds), [
+            'list', 'download', 'extract', 'features', 'lookup', 'match',
+            'dataset', 'render', 'forward',
+        ])
+
+    def test_save_and_compare(self):
+        results = pd.DataFrame({
+            'messages': [100, 100],
+            'stage': ['extract', 'match'],
+            'seconds': [2.0, 1.0],
+            'ms_per_message': [20.0, 10.0],
+        })
+        with tempfile.TemporaryDirectory() as tmp:
+            path = bench_stages.save(results, folder=Path(tmp))
+            baseline = bench_stages.load(path)
+        compared = bench_stages.compare(results.assign(seconds=[1.0, 1.0]), baseline)
+        self.assertListEqual(compared.ratio.to_list(), [0.5, 1.0])
@@ -0,0 +1,241 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader
+
+from bbc_forwarder import dataset, forwarder, templates
+from bbc_forwarder.config import CONFIG, PATH
+from benchmarks.corpus import make_mailbox, make_population
+
+
+# the html of DataFrame.to_html differs between pandas versions
+GOLDEN = Path(__file__).parent / 'golden' / f"pandas-{pd.__version__.split('.')[0]}"
+
+TEMPLATES = {
+    'faculteit': 'template.forward.jinja.html',
+    'csa': 'template.annotated.jinja.html',
+    'issue': 'template.issues.jinja.html',
+}
+
+ADDRESS = CONFIG['forwarder']['address'] | {'csa': 'csa@uu.nl', 'beta': 'beta@uu.nl'}
+
+MESSAGE = dict(
+    datum_ontvangst = pd.Timestamp('2021-08-02 09:15:00'),
+    folder_id = 'to_process',
+    zender = 'bbc@instelling.nl',
+    flag = None,
+    is_read = False,
+    has_attachments = True,
+)
+
+LOGO = dict(attachment_name='logo.png', attachment_size=2_000, is_pdf=False)
+
+PDF = dict(
+    attachment_name = 'bbc.pdf',
+    attachment_size = 35_000,
+    is_pdf = True,
+    tier = 'fast',
+    is_parsed = True,
+    instelling = frozenset(['Universiteit Leiden']),
+    bedrag = frozenset(['€ 2.168,00']),
+    n_dates_found = 2,
+    search_date = pd.Timestamp('2001-03-03'),
+    has_candidates = True,
+)
+
+
+def make_student(studentnummer: str, sinh_id: int, **fields) -> dict:
+    return dict(
+        found_student = True,
+        n_sinh = 1,
+        studentnummer = studentnummer,
+        voorletters = 'J.',
+        voorvoegsels = 'de',
+        achternaam = 'Vries',
+        geboortedatum = pd.Timestamp('2001-03-03'),
+        sinh_id = sinh_id,
+        soort_inschrijving = 'F',
+        opleiding = 'B Wiskunde',
+        aggregaat_2 = None,
+        aggregaat_1 = 'BETA',
+        faculteit = 'BETA',
+        inschrijvingstatus = 'I',
+        datum_verzoek = pd.Timestamp('2021-05-12'),
+        datum_intrekking = None,
+        ingangsdatum = pd.Timestamp('2021-09-01'),
+        afloopdatum = pd.Timestamp('2022-08-31'),
+        examentype = 'B',
+    ) | fields
+
+
+def make_records() -> pd.DataFrame:
+    """Return the records of messages covering the templates and the values
+    in their tables: missing values, characters that are escaped, repeated
+    spaces, tabs and several enrolment records."""
+    records = [
+        MESSAGE | dict(object_id='msg-1', onderwerp='BBC  J. de Vries <Leiden> & co', attachment_id='att-1') | LOGO,
+        MESSAGE | dict(object_id='msg-1', onderwerp='BBC  J. de Vries <Leiden> & co', attachment_id='att-2') | PDF | make_student('1234567', 11),
+        MESSAGE | dict(object_id='msg-2', onderwerp=' bbc\tcentraal ', attachment_id='att-3') | PDF | make_student(
+            '7654321', 21, voorvoegsels=None, soort_inschrijving='S', opleiding='M Rechten', faculteit='REBO',
+        ),
+        MESSAGE | dict(object_id='msg-3', onderwerp='geen student', attachment_id='att-4') | PDF | dict(
+            instelling=frozenset(), bedrag=frozenset(), has_candidates=False, found_student=False,
+        ),
+        MESSAGE | dict(object_id='msg-4', onderwerp='twee studenten', attachment_id='att-5') | PDF | make_student('1234567', 11),
+        MESSAGE | dict(object_id='msg-4', onderwerp='twee studenten', attachment_id='att-5') | PDF | make_student(
+            '1111111', 31, voorletters='K.', voorvoegsels=None, achternaam='Smit', opleiding='B Geschiedenis', faculteit='GW',
+        ),
+        MESSAGE | dict(object_id='msg-5', onderwerp='zonder bijlage', has_attachments=False),
+        MESSAGE | dict(object_id='msg-6', onderwerp='twee inschrijvingen', attachment_id='att-6') | PDF | make_student(
+            '7654321', 21, n_sinh=2, opleiding='M Rechten', faculteit='REBO',
+        ),
+        MESSAGE | dict(object_id='msg-6', onderwerp='twee inschrijvingen', attachment_id='att-6') | PDF | make_student(
+            '7654321', 22, n_sinh=2, opleiding='B Rechten', faculteit='REBO', datum_intrekking=pd.Timestamp('2021-08-01'),
+        ),
+    ]
+    return pd.DataFrame(records)
+
+
+def render_all(logs: pd.DataFrame) -> dict[str, str]:
+    "Return the body of every message in `logs`, rendered with the template of its soort."
+    rendered = {}
+    for object_id, message_logs in logs.groupby('object_id', sort=False):
+        data = forwarder.get_message_data(message_logs)
+        template = TEMPLATES[data['soort']]
+        rendered[f"{template.split('.')[1]}.{object_id}"] = templates.get_template(template).render(**data)
+    return rendered
+
+
+def transpose(df: pd.DataFrame, fields: list[str], unique: bool = False) -> pd.DataFrame:
+    "Return the table of `fields` as the transposed DataFrame the templates rendered before `Table`."
+    table = df[fields].drop_duplicates() if unique else df[fields]
+    return table.T
+
+
+def to_html(df: pd.DataFrame, fields: list[str], unique: bool) -> str:
+    "Return the table of `fields` as rendered from a transposed DataFrame."
+    return transpose(df, fields, unique).to_html(header=False, na_rep='-')
+
+
+def write_golden() -> None:
+    """Write the golden files of the installed pandas version with the tables
+    rendered from transposed DataFrames (only after an intended change of the
+    templates)."""
+    with mock.patch.dict(CONFIG['forwarder'], address=ADDRESS):
+        logs = dataset.create_dataset(make_records())
+    with mock.patch.object(forwarder.Table, 'from_frame', transpose):
+        rendered = render_all(logs)
+    GOLDEN.mkdir(exist_ok=True)
+    for name, html in rendered.items():
+        (GOLDEN / f"{name}.html").write_text(html, encoding='utf8', newline='')
+
+
+@mock.patch.dict(CONFIG['forwarder'], address=ADDRESS)
+class Test_Golden(unittest.TestCase):
+    def test_render(self):
+        logs = dataset.create_dataset(make_records())
+        rendered = render_all(logs)
+        self.assertEqual(len(rendered), 6)
+        for name, html in rendered.items():
+            with self.subTest(name):
+                expected = (GOLDEN / f"{name}.html").read_bytes()
+                self.assertEqual(html.encode('utf8'), expected)
+
+
+class Test_Table(unittest.TestCase):
+    def test_equals_dataframe(self):
+        fields = {
+            'mail': (['datum_ontvangst', 'zender', 'onderwerp'], True),
+            'bbc': (['instelling', 'bedrag'], True),
+            'student': (['studentnummer', 'voorletters', 'voorvoegsels', 'achternaam', 'geboortedatum'], True),
+            'inschrijfregel': (['soort_inschrijving', 'opleiding', 'faculteit', 'datum_intrekking'], False),
+        }
+        population = make_population(20)
+        box = make_mailbox(40, population)
+        with (
+            tempfile.TemporaryDirectory() as tmp,
+            mock.patch.object(forwarder.parser, 'get_cache', return_value=None),
+            mock.patch.object(forwarder.parser, 'get_download_folder', return_value=Path(tmp)),
+            mock.patch.object(forwarder.parser, 'query_kandidaten', side_effect=lambda dates: (
+                population.loc[population.geboortedatum.isin(dates)].reset_index(drop=True)
+            )),
+        ):
+            messages = list(forwarder.parser.list_messages(box.get_folder()))
+            records = forwarder.parser.parse_all_messages(messages, workers=0, state=None)
+        logs = dataset.create_dataset(records)
+        for object_id, message_logs in logs.groupby('object_id', sort=False):
+            for name, (columns, unique) in fields.items():
+                with self.subTest(object_id=object_id, table=name):
+                    table = templates.Table.from_frame(message_logs, columns, unique=unique)
+                    self.assertEqual(table.to_html(na_rep='-'), to_html(message_logs, columns, unique))
+
+    def test_values(self):
+        df = pd.DataFrame({
+            'tekst': [' a  b\t<c> & d ', 'x'],
+            'getal': [1 / 3, np.nan],
+            'rond': [2.0, 1e20],
+            'geheel': pd.array([5, None], dtype='Int64'),
+            'leeg': [None, pd.NaT],
+            'set': [frozenset(['UU']), frozenset()],
+            'reeks': [['a', 1], ('a\tb',)],
+            'object': [pd.Timestamp('2021-08-01'), True],
+        }, dtype=object)
+        table = templates.Table.from_frame(df, list(df.columns))
+        self.assertEqual(table.to_html(na_rep='-'), df.T.to_html(header=False, na_rep='-'))
+
+    def test_dtypes(self):
+        df = pd.DataFrame({
+            'tekst': pd.array([' a  b\t<c> ', pd.NA, 'x'], dtype='string'),
+            'naam': pd.array(['de  Vries', 'Smit', pd.NA], dtype='string'),
+            'soort': pd.Categorical(['F', 'S', None]),
+            'object': [frozenset(['UU  Utrecht']), None, 'a\tb'],
+            'getal': pd.array([1, None, 3], dtype='Int64'),
+            'aantal': pd.array([2, 4, None], dtype='Int64'),
+        })
+        tables = [
+            (['tekst', 'naam'], 'string'),
+            (['tekst', 'soort'], 'object'),
+            (['naam', 'object'], 'object'),
+            (['tekst', 'getal'], 'object'),
+            (['getal', 'aantal'], None),
+            (['getal'], None),
+        ]
+        for fields, dtype in tables:
+            with self.subTest(fields=fields):
+                table = templates.Table.from_frame(df, fields, unique=True)
+                self.assertEqual(table.dtype, dtype)
+                self.assertEqual(table.to_html(na_rep='-'), to_html(df, fields, unique=True))
+
+    def test_unique(self):
+        df = pd.DataFrame({'a': ['x', 'x', 'y', 'y'], 'b': [pd.NA, pd.NA, np.nan, 1.0]}, dtype=object)
+        table = templates.Table.from_frame(df, ['a', 'b'], unique=True)
+        self.assertEqual(table.to_html(), df.drop_duplicates().T.to_html(header=False))
+
+
+class Test_Templates(unittest.TestCase):
+    def test_preloaded(self):
+        for name in TEMPLATES.values():
+            self.assertIs(templates.get_template(name), templates.TEMPLATES[name])
+
+    def test_bytecode_cache(self):
+        with mock.patch.dict(CONFIG['forwarder'], address=ADDRESS):
+            logs = dataset.create_dataset(make_records())
+        data = forwarder.get_message_data(logs.loc[logs.object_id == 'msg-3'])
+        expected = (GOLDEN / 'issues.msg-3.html').read_bytes()
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch.dict(CONFIG['forwarder'], template_cache={'path': tmp}):
+                cache = templates.get_bytecode_cache()
+            for _ in range(2):
+                env = Environment(
+                    loader = FileSystemLoader(searchpath = PATH / 'templates'),
+                    trim_blocks = True,
+                    lstrip_blocks = True,
+                    bytecode_cache = cache,
+                )
+                html = env.get_template('template.issues.jinja.html').render(**data)
+                self.assertEqual(html.encode('utf8'), expected)
+            self.assertEqual(len(list(Path(tmp).iterdir())), 2)